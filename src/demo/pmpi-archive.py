@@ -0,0 +1,73 @@
+import sys
+
+sys.path.append('..')
+
+import binascii
+import getopt
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pmpi.archive import export_chain, import_archive, ArchiveError, DEFAULT_BATCH_SIZE
+import pmpi.core
+
+USAGE = "[-e] [-c] [-a <assume-valid block id>] [-b <batch size>] [-j <workers>] <database file> <archive file>"
+
+
+def print_progress(progress):
+    print("{} blocks, {} operations, {:.1f} blocks/s".format(
+        progress.blocks, progress.operations, progress.blocks_per_second))
+
+
+try:
+    opts, args = getopt.getopt(sys.argv[1:], "heca:b:j:")
+except getopt.GetoptError:
+    print(sys.argv[0], USAGE)
+    sys.exit(2)
+
+export = False
+checkpoint = False
+assume_valid = None
+batch_size = DEFAULT_BATCH_SIZE
+workers = os.cpu_count()
+
+for opt, arg in opts:
+    if opt == '-h':
+        print(sys.argv[0], USAGE)
+        print("Imports blocks from the archive into the database, or exports the main chain with -e.")
+        print("Signatures of the assume-valid block (-a, the database checkpoint by default) and its ancestors are "
+              "not verified; -c makes the head a new checkpoint.")
+        sys.exit()
+    elif opt == '-e':
+        export = True
+    elif opt == '-c':
+        checkpoint = True
+    elif opt == '-a':
+        assume_valid = binascii.unhexlify(arg)
+    elif opt == '-b':
+        batch_size = int(arg)
+    elif opt == '-j':
+        workers = int(arg)
+
+if len(args) != 2:
+    print(sys.argv[0], USAGE)
+    sys.exit(2)
+
+database_file, archive_file = args
+pmpi.core.initialise_database(database_file)
+
+try:
+    if export:
+        with open(archive_file, 'wb') as f:
+            print("Exported {} blocks.".format(export_chain(f)))
+    else:
+        with open(archive_file, 'rb') as f, ProcessPoolExecutor(workers) as executor:
+            print_progress(import_archive(f, executor, batch_size, print_progress, assume_valid=assume_valid))
+
+    if checkpoint:
+        head = pmpi.core.get_blockchain().head
+        pmpi.core.get_database().set_checkpoint(head)
+        print("Checkpoint:", binascii.hexlify(head).decode())
+except ArchiveError as e:
+    print(e)
+    sys.exit(1)
+finally:
+    pmpi.core.close_database()
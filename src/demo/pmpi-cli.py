@@ -6,48 +6,72 @@ sys.path.append('..')
 import asyncio
 import getopt
 import binascii
-from unittest.mock import patch
+from concurrent.futures import ProcessPoolExecutor
 from ecdsa import SigningKey
-from pmpi.block import Block, BlockRev
+from pmpi.block import Block, BlockRev, CompactBlock
 from pmpi.operation import Operation, OperationRev
-from pmpi.blockchain import BlockChain
 from pmpi.user import User
 from pmpi.identifier import Identifier
+from pmpi.mempool import Mempool
+from pmpi.mining import Miner
+from pmpi.profiler import Profiler, MemoryTracer, structure_sizes, format_size
+from pmpi.sync import SyncEngine
+import pmpi.metrics
+from pmpi.protocol import FrameDecoder, encode_frame, encode_ids, decode_ids, HELLO, OPERATION, BLOCK, \
+    COMPACT_BLOCK, GET_OPERATIONS
 import pmpi.core
 
-patch.object = patch.object
-
 is_miner = False
 io_queue = asyncio.Queue()
 block_queue = asyncio.Queue()
-operation_queue = asyncio.Queue()
-
-MIN_OPS_IN_BLOCK = 2
+mempool = Mempool()
+miner = Miner(executor=ProcessPoolExecutor(1))
+profiler = Profiler()
+memory_tracer = MemoryTracer()
+sync_engine = SyncEngine()
 
 
 class ClientProtocol(asyncio.Protocol):
+    # seconds to wait for the missing operations of a compact block
+    COMPACT_BLOCK_TIMEOUT = 60
+
     def __init__(self, user, loop):
         self.user = user
         self.loop = loop
         self.transport = None
+        self.decoder = FrameDecoder()
+        self.compact_blocks = {}
 
         pmpi.core.initialise_database('database_pmpi_' + binascii.hexlify(user._public_key.der).decode()[-6:])
 
     def connection_made(self, transport):
         self.transport = transport
-        self.transport.write(self.user._public_key.der)
+        self.transport.write(encode_frame(HELLO, self.user._public_key.der))
         print("\nPMPI User/Miner Console\n(type 'help' for help, 'exit' for exit)")
         self._add_input_callback()
 
     def data_received(self, data):
-        if data[:2] == b'OP':
-            print("Operation received.")
-            self.process_operation(data[2:])
-        elif data[:2] == b'BL':
-            print("Block received")
-            self.process_block(data[2:])
-        else:
-            print("Data not recognized.")
+        try:
+            messages = self.decoder.feed(data)
+        except FrameDecoder.FrameError as e:
+            print("Malformed data received ({}), closing the connection.".format(e))
+            self.transport.close()
+            return
+
+        for message_type, payload in messages:
+            if message_type == OPERATION:
+                print("Operation received.")
+                self.process_operation(payload)
+            elif message_type == BLOCK:
+                print("Block received")
+                self.process_block(payload)
+            elif message_type == COMPACT_BLOCK:
+                print("Compact block received")
+                self.process_compact_block(payload)
+            elif message_type == GET_OPERATIONS:
+                self.send_operations(decode_ids(payload))
+            else:
+                print("Data not recognized.")
 
     def connection_lost(self, exc):
         print('The server closed the connection')
@@ -67,6 +91,11 @@ class ClientProtocol(asyncio.Protocol):
                 "- help   -- show this message\n"
                 "- uuids  -- list minted uuids\n"
                 "- new op -- create operation\n"
+                "- profile start | stop [<sort> [<file>]] | <seconds> [<sort>]\n"
+                "         -- profile the node with cProfile; sort by {}\n"
+                "- memory start | snapshot | diff | stop\n"
+                "         -- trace memory allocations, compare with the previous snapshot\n"
+                "- sizes  -- show the largest in-memory structures\n".format(', '.join(Profiler.SORT_KEYS))
             )
             self._add_input_callback()
         elif line == "uuids":
@@ -76,10 +105,63 @@ class ClientProtocol(asyncio.Protocol):
         elif line == "new op":
             self.new_operation()
             self._add_input_callback()
+        elif line.split()[:1] == ["profile"]:
+            self.profile(line.split()[1:])
+            self._add_input_callback()
+        elif line.split()[:1] == ["memory"]:
+            self.memory(line.split()[1:])
+            self._add_input_callback()
+        elif line == "sizes":
+            self.show_sizes()
+            self._add_input_callback()
         else:
             print("Unknown command. Type 'help' for list of available commands.")
             self._add_input_callback()
 
+    def profile(self, args):
+        try:
+            if args == ["start"]:
+                profiler.start()
+                print("Profiling started.")
+            elif args[:1] == ["stop"] and len(args) <= 3:
+                sort = args[1] if len(args) > 1 else 'cumulative'
+                path = args[2] if len(args) > 2 else None
+                print(profiler.stop(sort, filename=path))
+            elif len(args) in (1, 2) and args[0].isdigit():
+                profiler.start()
+                print("Profiling for {} s.".format(args[0]))
+                self.loop.call_later(int(args[0]), self.profile, ["stop"] + args[1:2])
+            else:
+                print("Usage: profile start | stop [<sort> [<file>]] | <seconds> [<sort>]")
+        except Profiler.ProfilerError as e:
+            print("Profiler: {}.".format(e))
+
+    @staticmethod
+    def memory(args):
+        try:
+            if args == ["start"]:
+                memory_tracer.start()
+                print("Memory tracing started.")
+            elif args == ["snapshot"]:
+                print(memory_tracer.snapshot())
+            elif args == ["diff"]:
+                print(memory_tracer.diff())
+            elif args == ["stop"]:
+                memory_tracer.stop()
+                print("Memory tracing stopped.")
+            else:
+                print("Usage: memory start | snapshot | diff | stop")
+        except MemoryTracer.TracerError as e:
+            print("Memory tracer: {}.".format(e))
+
+    def show_sizes(self):
+        structures = {'pending compact blocks': self.compact_blocks}
+        structures.update(pmpi.core.get_blockchain().structures())
+        structures.update(mempool.structures())
+
+        for name, length, size in structure_sizes(structures):
+            print("{:>12} {:>10} items  {}".format(format_size(size), length if length is not None else '-', name))
+
     def _add_input_callback(self):
         future = asyncio.ensure_future(io_queue.get())
         future.add_done_callback(self.input_callback)
@@ -103,7 +185,8 @@ class ClientProtocol(asyncio.Protocol):
             while x not in ('y', 'n'):
                 x = input("Send operation? (y/n) ")
             if x == 'y':
-                self.transport.write(b'OP' + operation.raw())  # TODO also -- length of operation?
+                self.transport.write(encode_frame(OPERATION, operation.raw()))
+                self.add_operation(operation)  # the relay doesn't send it back
 
         try:
             x = int(input("index="))
@@ -131,76 +214,115 @@ class ClientProtocol(asyncio.Protocol):
 
     def process_operation(self, raw_operation):
         op = Operation.from_raw(raw_operation)
-        future = asyncio.ensure_future(operation_queue.put(op))
-        future.add_done_callback(self.new_block)
 
-    def new_block(self, result):
-        print("New block... Operations in queue: {}".format(operation_queue.qsize()))
-        ops = []
+        for compact_block in list(self.compact_blocks.values()):
+            compact_block.add_operations([op])
+            if compact_block.is_complete():
+                del self.compact_blocks[compact_block.id]
+                self.accept_block(compact_block.to_block())
 
-        def clean_queue():
-            if not operation_queue.empty():
-                future = asyncio.ensure_future(operation_queue.get())
-                future.add_done_callback(get_from_queue_cb)
-            else:
-                mint_block()
+        if not Operation.exist(op.id):
+            self.add_operation(op)
 
-        def get_from_queue_cb(future):
-            op = future.result()
-            try:
-                Operation.get(op.id)
-            except Operation.DoesNotExist:
-                ops.append(op)
-                clean_queue()
+    def add_operation(self, op):
+        try:
+            mempool.add(op)
+        except (Mempool.DuplicationError, Mempool.ConflictError) as e:
+            print("Operation rejected: {}".format(e))
+            return
 
-        clean_queue()
+        self.new_block()
 
-        def mint_block():
+    def new_block(self):
+        if miner.is_mining():
+            return
 
-            if len(ops) >= MIN_OPS_IN_BLOCK:
-                print("Preparing block with {} operations.".format(len(ops)))
+        print("New block... Operations in pool: {}".format(len(mempool)))
+        block = mempool.build_block(int(time.time()))
 
-                blockchain = pmpi.core.get_blockchain()
-                rev = BlockRev.from_id(blockchain.head) if blockchain.max_depth > 0 else BlockRev()
-                block = Block.from_operations_list(rev, int(time.time()), ops)
-                block.difficulty = 10  # TODO difficulty!
-                block.mine()
-                self.user.sign_object(block)
-                block.verify()
+        if block is not None:
+            print("Mining block with {} operations.".format(len(block.operations_ids)))
+            block.difficulty = 10  # TODO difficulty!
+            miner.start(block).add_done_callback(self.block_mined)
+        else:
+            print("There are not enough operations to mint a block")
 
-                print("Block minted. Sending.")
+    def block_mined(self, future):
+        if future.cancelled():
+            print("Mining cancelled.")
+            return
 
-                self.transport.write(b'BL' + block.raw_with_operations())
-            else:
-                print("There are not enough operations to mint a block")
-                for op in ops:
-                    asyncio.ensure_future(operation_queue.put(op))
+        block = future.result()
+        self.user.sign_object(block)
+        block.verify()
+
+        print("Block minted. Sending.")
 
+        self.transport.write(encode_frame(COMPACT_BLOCK, block.raw()))
+        self.accept_block(block)  # the relay doesn't send it back
 
     def process_block(self, raw_block):
-        block = Block.from_raw_with_operations(raw_block)
+        self.accept_block(Block.from_raw_with_operations(raw_block))
 
-        with patch.object(BlockChain, '_get_new_blocks', return_value=[block]):
-            pmpi.core.get_blockchain().update_blocks()
+    def process_compact_block(self, raw_block):
+        compact_block = CompactBlock(raw_block)
+        missing_ids = compact_block.fill(mempool)
+
+        if len(missing_ids) == 0:
+            self.accept_block(compact_block.to_block())
+        else:
+            print("Requesting {} missing operations.".format(len(missing_ids)))
+            self.compact_blocks[compact_block.id] = compact_block
+            self.loop.call_later(self.COMPACT_BLOCK_TIMEOUT, self.expire_compact_block, compact_block.id)
+            self.transport.write(encode_frame(GET_OPERATIONS, encode_ids(missing_ids)))
+
+    def expire_compact_block(self, block_id):
+        if self.compact_blocks.pop(block_id, None) is not None:
+            print("Missing operations of a compact block haven't arrived, dropping the block.")
+
+    def send_operations(self, operations_ids):
+        for h in operations_ids:
+            if h in mempool:
+                self.transport.write(encode_frame(OPERATION, mempool[h].raw()))
+            elif Operation.exist(h):
+                self.transport.write(encode_frame(OPERATION, Operation.get(h).raw()))
+
+    def accept_block(self, block):
+        blockchain = pmpi.core.get_blockchain()
+        head = blockchain.head
+
+        sync_engine.apply_blocks([block])
+        mempool.remove_confirmed(block.operations)
+
+        if blockchain.head != head:
+            # the block being mined is stale now -- restart on a new template
+            miner.cancel()
+            self.loop.call_soon(self.new_block)
 
 # Miner initialisation
 
 try:
-    opts, args = getopt.getopt(sys.argv[1:], "hmk:")
+    opts, args = getopt.getopt(sys.argv[1:], "hmk:p:o:")
 except getopt.GetoptError:
-    print(sys.argv[0], "[-m] [-k <private key>]")
+    print(sys.argv[0], "[-m] [-k <private key>] [-p <metrics port>] [-o <max operations per block>]")
     sys.exit(2)
 
 private_key = None
+metrics_port = None
 
 for opt, arg in opts:
     if opt == '-h':
-        print(sys.argv[0], "[-m] [-k <private key>]")
+        print(sys.argv[0], "[-m] [-k <private key>] [-p <metrics port>] [-o <max operations per block>]")
         sys.exit()
     elif opt == '-k':
         private_key = SigningKey.from_der(binascii.unhexlify(arg))
     elif opt == '-m':
         is_miner = True
+    elif opt == '-p':
+        metrics_port = int(arg)
+    elif opt == '-o':
+        # a chain parameter -- all the nodes of the network have to use the same value
+        pmpi.core.set_chain_parameters(pmpi.core.ChainParameters(max_operations=int(arg)))
 
 if private_key is None:
     private_key = SigningKey.generate()
@@ -209,6 +331,10 @@ if private_key is None:
 
 user = User(private_key)
 
+if metrics_port is not None:
+    pmpi.metrics.start_http_server(metrics_port)
+    print("Metrics: http://127.0.0.1:{}/metrics".format(metrics_port))
+
 print("Starting...")
 
 # Asyncio
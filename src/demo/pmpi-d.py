@@ -1,46 +1,38 @@
 import asyncio
-import random
 import sys
-import binascii
 
-clients = {}
+sys.path.append('..')
 
-# def got_stdin_data(q):
-#     asyncio.ensure_future(q.put(sys.stdin.readline()))
+from pmpi.relay import RelayHub, RelayProtocol
 
-class EchoServerClientProtocol(asyncio.Protocol):
-    def __init__(self):
-        self.transport = None
-        self.key = None
+STATS_INTERVAL = 60
 
+hub = RelayHub()
+
+
+class VerboseRelayProtocol(RelayProtocol):
     def connection_made(self, transport):
-        peer_name = transport.get_extra_info('peername')
-        print('Connection from {}'.format(peer_name))
-        self.transport = transport
-
-    def data_received(self, data):
-        if self.key is None:
-            self.key = data
-            clients[self.key] = self
-            print("Client added: {}".format(binascii.hexlify(self.key)[-6:].decode()))
-        else:
-            print("{} from {}".format(data[:2].decode(), binascii.hexlify(self.key)[-6:].decode()))
-            for key, protocol in clients.items():
-                    protocol.transport.write(data)
-            print("Sent.")
+        super(VerboseRelayProtocol, self).connection_made(transport)
+        print('Connection from {}'.format(transport.get_extra_info('peername')))
 
     def connection_lost(self, exc):
-        if self.key in clients:
-            print("Goodbye, {}".format(binascii.hexlify(self.key)[-6:].decode()))
-            del clients[self.key]
+        super(VerboseRelayProtocol, self).connection_lost(exc)
+        print("Goodbye, {}".format(self.peer.name))
+
+
+def print_stats():
+    for name, stats in sorted(hub.stats().items()):
+        print("{}: in {messages_in} msgs ({bytes_in_per_second:.0f} B/s), out {messages_out} msgs "
+              "({bytes_out_per_second:.0f} B/s), dropped {messages_dropped}, queued {queue_size} B".format(
+                  name, **stats))
+    loop.call_later(STATS_INTERVAL, print_stats)
 
 
-# q = asyncio.Queue()
 loop = asyncio.get_event_loop()
-# loop.add_reader(sys.stdin, got_stdin_data, q)
 # Each client connection will create a new protocol instance
-coroutine = loop.create_server(EchoServerClientProtocol, '127.0.0.1', 8888)
+coroutine = loop.create_server(lambda: VerboseRelayProtocol(hub), '127.0.0.1', 8888)
 server = loop.run_until_complete(coroutine)
+loop.call_later(STATS_INTERVAL, print_stats)
 
 # Serve requests until CTRL+c is pressed
 print('Serving on {}'.format(server.sockets[0].getsockname()))
@@ -52,4 +44,4 @@ except KeyboardInterrupt:
 # Close the server
 server.close()
 loop.run_until_complete(server.wait_closed())
-loop.close()
\ No newline at end of file
+loop.close()
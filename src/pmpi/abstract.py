@@ -2,11 +2,15 @@ from ecdsa import BadSignatureError
 from pmpi.exceptions import ObjectDoesNotExist
 from pmpi.utils import double_sha
 import pmpi.core
+import pmpi.metrics
 
 
 class AbstractRevision:
-    __id = None
-    __obj = None
+    __slots__ = ('__id', '__obj')
+
+    def __init__(self):
+        self.__id = None
+        self.__obj = None
 
     @classmethod
     def from_id(cls, obj_id):
@@ -51,10 +55,13 @@ class AbstractSignedObject:
     :type __signature: SigningKey
     """
 
-    __requires_signature_verification = True
-    __public_key = None
-    __signature = None
-    __id = None
+    __slots__ = ('__requires_signature_verification', '__public_key', '__signature', '__id')
+
+    def __init__(self):
+        self.__requires_signature_verification = True
+        self.__public_key = None
+        self.__signature = None
+        self.__id = None
 
     @property
     def public_key(self):
@@ -82,6 +89,13 @@ class AbstractSignedObject:
         self.__signature = signature
         self.__requires_signature_verification = True
 
+    def _assume_signature_verified(self):
+        """
+        Skip the signature verification of the object -- for signatures already verified elsewhere (e.g. in another
+        process).
+        """
+        self.__requires_signature_verification = False
+
     # Serialisation
 
     def unsigned_raw(self):
@@ -117,10 +131,14 @@ class AbstractSignedObject:
     def verify_signature(self):
         if self.requires_signature_verification:
             if self.__signature is not None:
+                if pmpi.metrics.enabled:
+                    pmpi.metrics.SIGNATURE_VERIFICATIONS.labels(type(self).__name__).inc()
                 try:
                     self.__public_key.verifying_key.verify(self.__signature, self.unsigned_raw())
                     self.__requires_signature_verification = False
                 except BadSignatureError:
+                    if pmpi.metrics.enabled:
+                        pmpi.metrics.SIGNATURE_FAILURES.labels(type(self).__name__).inc()
                     raise self.VerifyError("wrong signature")
             else:
                 raise self.VerifyError("object is not signed")
@@ -152,11 +170,7 @@ class AbstractSignedObject:
     @classmethod
     @pmpi.core.with_database
     def exist(cls, database, obj_id):
-        try:
-            database.get(cls._get_dbname(), obj_id)
-            return True
-        except KeyError:
-            return False
+        return database.exist(cls._get_dbname(), obj_id)
 
     @classmethod
     @pmpi.core.with_database
@@ -170,11 +184,7 @@ class AbstractSignedObject:
             raise cls.DoesNotExist
 
     def is_in_database(self):
-        try:
-            self.get(self.id)
-            return True
-        except self.DoesNotExist:
-            return False
+        return self.exist(self.id)
 
     @pmpi.core.with_database
     def put(self, database):
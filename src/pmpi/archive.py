@@ -0,0 +1,245 @@
+from io import BytesIO
+import time
+
+from pmpi.block import Block
+from pmpi.exceptions import RawFormatError
+from pmpi.operation import Operation
+from pmpi.protocol import FrameDecoder, encode_frame, BLOCK
+from pmpi.sync import SyncEngine, ancestors
+from pmpi.utils import double_sha, read_sized_bytes, read_uint32
+import pmpi.core
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_BATCH_SIZE = 500
+
+
+# Archive format: stream of BLOCK frames of the node protocol, each carrying Block.raw_with_operations(),
+# every block after its previous block.
+
+def write_archive(stream, blocks):
+    """
+    :param stream: binary file-like object
+    :return: number of blocks written
+    """
+    count = 0
+    for block in blocks:
+        stream.write(encode_frame(BLOCK, block.raw_with_operations()))
+        count += 1
+    return count
+
+
+def export_chain(stream):
+    """
+    Write the main chain (from the genesis block to the head) into the archive.
+
+    :return: number of blocks written
+    """
+    blockchain = pmpi.core.get_blockchain()
+    return write_archive(stream, (Block.get(blockchain.main_chain_block_id(depth))
+                                  for depth in range(1, blockchain.max_depth + 1)))
+
+
+def read_archive(stream, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    :return: generator of records (raw blocks with operations) read from the stream chunk by chunk
+    :raise FrameDecoder.FrameError: on malformed or truncated archive
+    """
+    decoder = FrameDecoder()
+    while True:
+        chunk = stream.read(chunk_size)
+        if len(chunk) == 0:
+            break
+        for message_type, payload in decoder.feed(chunk):
+            if message_type != BLOCK:
+                raise FrameDecoder.FrameError("archive contains a message other than block")
+            yield payload
+
+    if decoder.buffered_size > 0:
+        raise FrameDecoder.FrameError("incomplete frame at the end of the archive")
+
+
+def split_record(raw):
+    """
+    :return: list of raw operations and the raw block (without operations)
+    """
+    buffer = BytesIO(raw)
+    operations = [read_sized_bytes(buffer) for _ in range(read_uint32(buffer))]
+    return operations, buffer.read()
+
+
+def parse_record(raw, verify_signatures=True):
+    """
+    :param verify_signatures: False to assume the signatures are correct
+    :return: block and its operations -- only the signatures are verified
+    """
+    raw_operations, raw_block = split_record(raw)
+    operations = [Operation._from_raw_without_verifying(raw_operation) for raw_operation in raw_operations]
+    for op in operations:
+        if verify_signatures:
+            op.verify_signature()
+        else:
+            op._assume_signature_verified()
+
+    block = Block.from_raw_and_operations(raw_block, operations, verify=False)
+    if verify_signatures:
+        block.verify_signature()
+    else:
+        block._assume_signature_verified()
+    return block, operations
+
+
+def check_record(raw, verify_signatures=True):
+    """
+    Stateless checks of the record: the checksum and all the signatures.
+
+    :param verify_signatures: False for blocks assumed valid -- only the checksum is checked
+    :return: the block, with its operations
+    """
+    block = parse_record(raw, verify_signatures)[0]
+    if not block.is_checksum_correct():
+        raise Block.VerifyError("wrong checksum")
+    return block
+
+
+def verify_record(raw, verify_signatures=True):
+    """
+    check_record returning only the number of operations of the block -- needs only bytes and returns an int, so it can
+    be run in another process.
+    """
+    return len(check_record(raw, verify_signatures).operations_ids)
+
+
+def _previous_ids(stream, chunk_size):
+    """
+    Read headers of all the blocks of the archive.
+
+    :return: mapping of block ids to ids of their previous blocks (up to the first malformed record)
+    """
+    previous_ids = {}
+    try:
+        for raw in read_archive(stream, chunk_size):
+            raw_block = split_record(raw)[1]
+            previous_ids[double_sha(raw_block)] = Block._from_raw_without_verifying(raw_block).previous_block_rev.id
+    except (FrameDecoder.FrameError, RawFormatError):
+        pass
+    return previous_ids
+
+
+class ImportProgress:
+    def __init__(self):
+        self.blocks = 0
+        self.operations = 0
+        self.started_at = time.time()
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started_at
+
+    @property
+    def blocks_per_second(self):
+        return self.blocks / max(self.elapsed, 1e-9)
+
+
+def _verified_batches(records, executor, batch_size, assumed_valid_ids):
+    """
+    Split the records into batches, submitting verification of every batch before the previous one is returned.
+
+    :return: generator of (records, results) pairs -- without executor the results are the checked blocks, computed
+        lazily; otherwise the numbers of operations of the blocks (see verify_record)
+    """
+    def submit(batch):
+        if len(assumed_valid_ids) > 0:
+            signatures = [double_sha(split_record(raw)[1]) not in assumed_valid_ids for raw in batch]
+        else:
+            signatures = [True] * len(batch)
+        if executor is None:
+            return batch, map(check_record, batch, signatures)
+        return batch, executor.map(verify_record, batch, signatures)
+
+    pending = None
+    batch = []
+    error = None
+    try:
+        for raw in records:
+            batch.append(raw)
+            if len(batch) >= batch_size:
+                submitted = submit(batch)
+                if pending is not None:
+                    yield pending
+                pending = submitted
+                batch = []
+    except FrameDecoder.FrameError as e:
+        # records read before the malformed one are still imported
+        error = e
+
+    if len(batch) > 0:
+        submitted = submit(batch)
+        if pending is not None:
+            yield pending
+        pending = submitted
+    if pending is not None:
+        yield pending
+
+    if error is not None:
+        raise error
+
+
+def import_archive(stream, executor=None, batch_size=DEFAULT_BATCH_SIZE, progress=None,
+                   chunk_size=DEFAULT_CHUNK_SIZE, assume_valid=None):
+    """
+    Import blocks from the archive into the database.
+
+    Stateless checks run in parallel in the executor, a batch ahead of the blocks being put. Every batch is put with
+    a separate call of BlockChain.update_blocks, so the head is moved after every batch -- the blocks are verified
+    against a head at most one batch behind them; the database is flushed after every batch.
+
+    :param executor: concurrent.futures executor for the stateless checks, or None to run them in this thread
+    :param progress: function called with ImportProgress after every batch
+    :param assume_valid: id of a trusted block, or None to trust the checkpoint of the database; signatures of the block
+        and its ancestors are not verified (requires a seekable stream -- ancestors are found by a pass over headers)
+    :return: ImportProgress
+    :raise ArchiveError: when some of the records are malformed, not properly signed or can't be put into the
+        blockchain -- the blocks preceding it are imported anyway
+    """
+    if assume_valid is None:
+        assume_valid = pmpi.core.get_database().get_checkpoint()
+
+    assumed_valid_ids = set()
+    if assume_valid is not None and stream.seekable():
+        start = stream.tell()
+        assumed_valid_ids = ancestors(assume_valid, _previous_ids(stream, chunk_size))
+        stream.seek(start)
+
+    result = ImportProgress()
+    sync_engine = SyncEngine()
+
+    def counted(batch_blocks):
+        for block in batch_blocks:
+            yield block
+            result.blocks += 1
+            result.operations += len(block.operations_ids)
+
+    try:
+        for batch, results in _verified_batches(read_archive(stream, chunk_size), executor, batch_size,
+                                               assumed_valid_ids):
+            results = list(results)  # the whole batch is checked before any of its blocks is put
+            if executor is None:
+                batch_blocks = results
+            else:
+                # checked in the executor -- parsed again, but the signatures are not verified twice
+                batch_blocks = (parse_record(raw, verify_signatures=False)[0] for raw in batch)
+
+            sync_engine.apply_blocks(counted(batch_blocks))
+
+            pmpi.core.get_database().sync()
+            if progress is not None:
+                progress(result)
+
+    except (FrameDecoder.FrameError, RawFormatError, Block.VerifyError, Block.ChainError, Operation.VerifyError) as e:
+        raise ArchiveError("import stopped after {} blocks: {}".format(result.blocks, e)) from e
+
+    return result
+
+
+class ArchiveError(Exception):
+    pass
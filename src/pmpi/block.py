@@ -2,17 +2,51 @@ from io import BytesIO
 
 import pmpi.database
 from pmpi.exceptions import RawFormatError
+from pmpi.merkle import MerkleTree, merkle_root
 
 # from pmpi.operation import Operation
+from pmpi.packed_ids import PackedIds
 from pmpi.utils import double_sha, read_bytes, read_uint32, read_sized_bytes
 from pmpi.public_key import PublicKey
 
 import pmpi.abstract
 import pmpi.core
+import pmpi.metrics
+import pmpi.tracing
 import pmpi.operation
 
 
+MAX_PADDING = 1 << 32
+
+
+def mining_target(difficulty):
+    """
+    :return: the greatest checksum satisfying the difficulty
+    """
+    assert 0 < difficulty < 256
+    return ((1 << 256 - difficulty) - 1).to_bytes(32, 'big')
+
+
+def find_padding(unmined_raw, difficulty, start=0, stop=MAX_PADDING):
+    """
+    Search for a padding satisfying the difficulty. Needs only bytes and ints, so it can be run in another process.
+
+    :param unmined_raw: Block.unmined_raw() -- its last four bytes (the padding) are replaced
+    :return: the first padding from range(start, stop) satisfying the difficulty, or None
+    """
+    target = mining_target(difficulty)
+    prefix = unmined_raw[:-4]
+
+    for padding in range(start, stop):
+        if double_sha(prefix + padding.to_bytes(4, 'big')) <= target:
+            return padding
+
+    return None
+
+
 class BlockRev(pmpi.abstract.AbstractRevision):
+    __slots__ = ()
+
     def _get_obj_from_database(self):
         return Block.get(self.id)
 
@@ -20,47 +54,69 @@ class BlockRev(pmpi.abstract.AbstractRevision):
 class Block(pmpi.abstract.AbstractSignedObject):
     """
 
+    :type version: int
     :type previous_block_rev: BlockRev
     :type timestamp: int
-    :type __operations_ids: tuple[bytes]
+    :type __operations_ids: PackedIds
+    :type __merkle_root: NoneType | bytes
     :type __operations: tuple[Operation]
     :type difficulty: int
     :type padding: int
     :type __checksum: NoneType | bytes
+    :type __checksum_check: NoneType | (tuple, bool)
     :type operations_limit: int
     """
 
+    __slots__ = ('version', 'previous_block_rev', 'timestamp', '__operations_ids', '__merkle_root', '__operations',
+                 'difficulty', 'padding', '__checksum', '__checksum_check', 'operations_limit')
+
     VERSION = 1
+    # the mined header commits to the Merkle root of the operations' ids instead of the ids themselves
+    MERKLE_VERSION = 2
+    VERSIONS = (VERSION, MERKLE_VERSION)
+    HEADER_SIZE = 88  # unmined_raw() of MERKLE_VERSION blocks
 
+    # defaults of pmpi.core.ChainParameters -- use pmpi.core.get_chain_parameters() for the limits of the chain
     MIN_OPERATIONS = 2
     MAX_OPERATIONS = 10
 
-    def __init__(self, previous_block_rev, timestamp, operations_ids):
+    def __init__(self, previous_block_rev, timestamp, operations_ids, version=VERSION):
         """
 
         :type previous_block_rev: BlockRev
         :type timestamp: int
-        :type operations_ids: tuple[bytes]
+        :type operations_ids: PackedIds | tuple[bytes]
+        :type version: int
         :param previous_block_rev: BlockRevID of the previous block
         :param timestamp: time of block creation
         :param operations_ids: the list of operations' hashes that the new block will contain
+        :param version: one of VERSIONS
         """
+        super(Block, self).__init__()
 
+        if version not in self.VERSIONS:
+            raise self.VerifyError("unknown block version")
+
+        self.version = version
         self.previous_block_rev = previous_block_rev
         self.timestamp = timestamp
-        self.__operations_ids = tuple(operations_ids)
+        if not isinstance(operations_ids, PackedIds):
+            operations_ids = PackedIds(operations_ids)
+        self.__operations_ids = operations_ids
+        self.__merkle_root = None
         self.__operations = tuple()
 
         self.difficulty = 1
         self.padding = 0
         self.__checksum = None
+        self.__checksum_check = None
 
-        self.operations_limit = self.MAX_OPERATIONS
+        self.operations_limit = pmpi.core.get_chain_parameters().max_operations
 
     @classmethod
-    def from_operations_list(cls, previous_block_rev, timestamp, operations):
+    def from_operations_list(cls, previous_block_rev, timestamp, operations, version=VERSION):
         try:
-            block = cls(previous_block_rev, timestamp, [op.id for op in operations])
+            block = cls(previous_block_rev, timestamp, [op.id for op in operations], version)
             block.__operations = tuple(operations)
             return block
         except pmpi.operation.Operation.VerifyError:
@@ -78,17 +134,66 @@ class Block(pmpi.abstract.AbstractSignedObject):
         return self.__operations
 
     def extend_operations(self, new_operations):
-        distinct_operations = tuple(filter(lambda op: op.id not in self.__operations_ids, new_operations))
-        if len(distinct_operations) != len(new_operations):
+        new_operations = tuple(new_operations)
+        new_ids = PackedIds(op.id for op in new_operations)
+        new_ids_set = set(new_ids)
+        if len(new_ids_set) != len(new_ids) or not new_ids_set.isdisjoint(self.__operations_ids):
             raise self.VerifyError("some of the new operations have been added to the block already")
-        self.__operations += distinct_operations
-        self.__operations_ids += tuple(op.id for op in new_operations)
+        self._update_operations()
+        self.__operations += new_operations
+        self.__operations_ids += new_ids
+        self.__merkle_root = None
+
+    @property
+    def merkle_root(self):
+        """
+        Root of the MerkleTree of operations_ids (committed to by the header of MERKLE_VERSION blocks).
+        """
+        if self.__merkle_root is None:
+            self.__merkle_root = merkle_root(self.__operations_ids)
+        return self.__merkle_root
+
+    def operation_proof(self, operation_id):
+        """
+        :return: MerkleProof of the operation -- verifiable against merkle_root, see verify_operation_proof
+        :raise ValueError: when the operation is not in the block
+        """
+        return MerkleTree(self.__operations_ids).proof(self.__operations_ids.index(operation_id))
+
+    @classmethod
+    def verify_operation_proof(cls, unmined_raw, operation_id, proof):
+        """
+        Check that the operation is in the block, knowing only the header of the block (e.g. by a light client).
+
+        :param unmined_raw: Block.unmined_raw() of a MERKLE_VERSION block -- HEADER_SIZE bytes
+        :type proof: pmpi.merkle.MerkleProof
+        :return: True if the proof is correct
+        """
+        if len(unmined_raw) != cls.HEADER_SIZE or int.from_bytes(unmined_raw[:4], 'big') != cls.MERKLE_VERSION:
+            return False
+
+        count = int.from_bytes(unmined_raw[44:48], 'big')
+        root = unmined_raw[48:80]
+        return proof.count == count and proof.verify(operation_id, root)
 
     def is_checksum_correct(self):
         """
-        Check if checksum is correct.
+        Check if checksum is correct. The result is kept until any field of the header changes -- VERSION headers
+        contain all the operations' ids, and the check is made on every access to the block's id.
         """
-        return self.__checksum == double_sha(self.unmined_raw())
+        # operations_ids are immutable (extend_operations replaces them) -- compared by identity first
+        header = (self.version, self.previous_block_rev.id, self.timestamp, self.operations_limit, self.__operations_ids,
+                  self.difficulty, self.padding, self.__checksum)
+        if self.__checksum_check is None or self.__checksum_check[0] != header:
+            self.__checksum_check = (header, self.__checksum == double_sha(self.unmined_raw()))
+        return self.__checksum_check[1]
+
+    def is_mined(self):
+        """
+        Check if checksum is correct and satisfies the difficulty.
+        """
+        return 0 < self.difficulty < 256 and self.is_checksum_correct() \
+            and self.__checksum <= mining_target(self.difficulty)
 
     @property
     def requires_signature_verification(self):
@@ -100,26 +205,36 @@ class Block(pmpi.abstract.AbstractSignedObject):
     # Serialization and deserialization
 
     def operations_ids_raw(self):
-        self._update_operations()
-        return len(self.operations_ids).to_bytes(4, 'big') + b''.join(self.operations_ids)
+        return len(self.operations_ids).to_bytes(4, 'big') + self.operations_ids.raw()
 
     def operations_full_raw(self):
         return len(self.operations).to_bytes(4, 'big') + b''.join(
             [len(op_raw).to_bytes(4, 'big') + op_raw for op_raw in [op.raw() for op in self.operations]])
 
     def unmined_raw(self):
-        ret = self.VERSION.to_bytes(4, 'big')
+        """
+        The header hashed when mining. VERSION headers contain all the operations' ids; MERKLE_VERSION headers contain
+        their number and Merkle root only, so they are always HEADER_SIZE bytes long.
+        """
+        ret = self.version.to_bytes(4, 'big')
         ret += self.previous_block_rev.id
         ret += self.timestamp.to_bytes(4, 'big')
         ret += self.operations_limit.to_bytes(4, 'big')
-        ret += self.operations_ids_raw()
+        if self.version == self.MERKLE_VERSION:
+            ret += len(self.operations_ids).to_bytes(4, 'big')
+            ret += self.merkle_root
+        else:
+            ret += self.operations_ids_raw()
         ret += self.difficulty.to_bytes(4, 'big')
         ret += self.padding.to_bytes(4, 'big')
         return ret
 
     def unsigned_raw(self):
         if self.is_checksum_correct():
-            return self.unmined_raw() + self.__checksum
+            ret = self.unmined_raw() + self.__checksum
+            if self.version == self.MERKLE_VERSION:
+                ret += self.operations_ids.raw()  # bound to the header by the Merkle root
+            return ret
         else:
             raise self.VerifyError("wrong checksum")
 
@@ -132,17 +247,29 @@ class Block(pmpi.abstract.AbstractSignedObject):
     def _from_raw_without_verifying(cls, raw):
         buffer = BytesIO(raw)
 
-        if read_uint32(buffer) != cls.VERSION:
+        version = read_uint32(buffer)
+        if version not in cls.VERSIONS:
             raise RawFormatError("version number mismatch")
 
         previous_block_rev = BlockRev.from_id(read_bytes(buffer, 32))
         timestamp = read_uint32(buffer)
         operations_limit = read_uint32(buffer)
 
-        operations_ids = [read_bytes(buffer, 32) for _ in range(read_uint32(buffer))]
-        difficulty = read_uint32(buffer)
-        padding = read_uint32(buffer)
-        checksum = read_bytes(buffer, 32)
+        if version == cls.MERKLE_VERSION:
+            operations_count = read_uint32(buffer)
+            root = read_bytes(buffer, 32)
+            difficulty = read_uint32(buffer)
+            padding = read_uint32(buffer)
+            checksum = read_bytes(buffer, 32)
+            operations_ids = PackedIds.from_raw(read_bytes(buffer, PackedIds.SIZE * operations_count))
+            if merkle_root(operations_ids) != root:
+                raise RawFormatError("merkle root mismatch")
+        else:
+            operations_ids = PackedIds.from_raw(read_bytes(buffer, PackedIds.SIZE * read_uint32(buffer)))
+            root = None
+            difficulty = read_uint32(buffer)
+            padding = read_uint32(buffer)
+            checksum = read_bytes(buffer, 32)
         public_key_der = read_sized_bytes(buffer)
         signature = read_sized_bytes(buffer)
 
@@ -152,7 +279,8 @@ class Block(pmpi.abstract.AbstractSignedObject):
         if int.from_bytes(previous_block_rev.id, 'big') == 0:
             previous_block_rev = BlockRev()
 
-        block = cls(previous_block_rev, timestamp, operations_ids)
+        block = cls(previous_block_rev, timestamp, operations_ids, version)
+        block.__merkle_root = root
         block.operations_limit = operations_limit
         block.difficulty = difficulty
         block.padding = padding
@@ -162,68 +290,96 @@ class Block(pmpi.abstract.AbstractSignedObject):
         return block
 
     @classmethod
-    def __from_raw_and_operations(cls, raw, operations):
+    def from_raw_and_operations(cls, raw, operations, verify=True):
+        """
+        :param raw: raw block (without operations)
+        :param operations: operations of the block, in order of block.operations_ids, or None to load them from the
+            database
+        :param verify: False to leave the verification to the caller (put() verifies the block anyway)
+        """
         block = cls._from_raw_without_verifying(raw)
         if operations is not None:
-            for (h, op) in zip(block.operations_ids, operations):
-                if h != op.id:
-                    raise cls.VerifyError("wrong given operations list")
-            block.__operations = operations
-        block.verify()
+            block._attach_operations(operations)
+        if verify:
+            block.verify()
         return block
 
+    def _attach_operations(self, operations):
+        """
+        Give the block parsed from a raw header (e.g. with _from_raw_without_verifying) its operations.
+
+        :param operations: operations of the block, in order of block.operations_ids
+        """
+        if len(operations) != len(self.operations_ids):
+            raise self.VerifyError("wrong given operations list")
+        for (h, op) in zip(self.operations_ids, operations):
+            if h != op.id:
+                raise self.VerifyError("wrong given operations list")
+        self.__operations = operations
+
     @classmethod
     def from_raw(cls, raw):
-        return cls.__from_raw_and_operations(raw, None)
+        return cls.from_raw_and_operations(raw, None)
 
     @classmethod
     def from_raw_with_operations(cls, raw):
         buffer = BytesIO(raw)
         operations = [pmpi.operation.Operation.from_raw(read_sized_bytes(buffer)) for _ in range(read_uint32(buffer))]
 
-        return cls.__from_raw_and_operations(buffer.read(), operations)
+        return cls.from_raw_and_operations(buffer.read(), operations)
 
     # Verification
 
     def _update_operations(self):
+        # the operations are either all loaded (and match operations_ids) or none of them
         try:
-            if self.operations_ids != tuple(op.id for op in self.__operations):
+            if len(self.__operations) != len(self.operations_ids):
                 self.__operations = tuple(pmpi.operation.Operation.get(h) for h in self.operations_ids)
         except pmpi.operation.Operation.VerifyError:
             raise self.VerifyError("at least one of the operations is not properly signed")
 
+    @pmpi.metrics.timed(pmpi.metrics.BLOCK_VERIFY_SECONDS)
+    @pmpi.tracing.traced('Block.verify', lambda block: {'block_id': pmpi.tracing.hexlify(block.id)})
     def verify(self):
         self.verify_signature()
 
-        operations_counter = {h: 0 for h in self.operations_ids}
-        for op in self.operations:
-            op.verify()
-            if op.previous_operation_rev.id in operations_counter:
-                operations_counter[op.previous_operation_rev.id] += 1
+        operations = self.operations
+        operations_ids = set(self.operations_ids)
 
-        if not all([count <= 1 for count in operations_counter.values()]):
-            raise self.ChainError("operations are creating tree inside the block")
+        # every operation of the block can be followed by at most one operation of the block
+        continued_ids = set()
+        for op in operations:
+            op.verify()
+            previous_id = op.previous_operation_rev.id
+            if previous_id in operations_ids:
+                if previous_id in continued_ids:
+                    raise self.ChainError("operations are creating tree inside the block")
+                continued_ids.add(previous_id)
 
         try:
             prev_block = self.previous_block_rev.obj
             if prev_block is not None:
-                for op in self.operations:
-                    if not op.previous_operation_rev.is_none() \
-                            and op.previous_operation_rev.id not in operations_counter:
-                        if op.previous_operation_rev.obj.forward_operations_chain(self.previous_block_rev.id) \
-                                != [op.previous_operation_rev.id]:
-                            raise self.ChainError("operation's previous_operation_rev is not pointing at the last "
-                                                  "operation on current blockchain")
-                            # TODO also: should it check if the previous block is in the database?
-                            # TODO [or should it be moved to put_verify?]
+                # operations continuing the ones from outside the block have to continue the latest ones -- a single
+                # lookup per identifier when the block extends the head
+                continuing = [op for op in operations if not op.previous_operation_rev.is_none()
+                              and op.previous_operation_rev.id not in operations_ids]
+                latest_ids = pmpi.core.get_blockchain().resolve_operation_ids({op.uuid for op in continuing},
+                                                                              self.previous_block_rev.id)
+                for op in continuing:
+                    if latest_ids[op.uuid] != op.previous_operation_rev.id:
+                        raise self.ChainError("operation's previous_operation_rev is not pointing at the last "
+                                              "operation on current blockchain")
+                        # TODO also: should it check if the previous block is in the database?
+                        # TODO [or should it be moved to put_verify?]
 
         except self.DoesNotExist:
             raise self.ChainError("previous_block_rev does not exist")
 
-        if not self.MIN_OPERATIONS <= self.operations_limit <= self.MAX_OPERATIONS:
+        chain_parameters = pmpi.core.get_chain_parameters()
+        if not chain_parameters.min_operations <= self.operations_limit <= chain_parameters.max_operations:
             raise self.VerifyError("operations_limit out of range")
 
-        if not self.MIN_OPERATIONS <= len(self.operations) <= self.operations_limit:
+        if not chain_parameters.min_operations <= len(operations) <= self.operations_limit:
             raise self.VerifyError("number of operations doesn't satisfy limitations")
 
         # TODO check: difficulty is correctly set -- i.e. check block depth and self.difficulty <= DIFF_AT_DEPTH(depth)
@@ -242,17 +398,18 @@ class Block(pmpi.abstract.AbstractSignedObject):
 
     # Mine
 
+    @pmpi.metrics.timed(pmpi.metrics.BLOCK_MINE_SECONDS)
     def mine(self):
-        unmined_raw = self.unmined_raw()
-        assert 0 < self.difficulty < 256
-        target = ((1 << 256 - self.difficulty) - 1).to_bytes(32, 'big')
-
-        self.padding = 0
-
-        while double_sha(unmined_raw) > target:
-            self.padding += 1
-            unmined_raw = unmined_raw[:-4] + self.padding.to_bytes(4, 'big')
+        padding = find_padding(self.unmined_raw(), self.difficulty)
+        if padding is None:
+            raise self.MiningError("no padding satisfies the difficulty")
+        self.apply_padding(padding)
 
+    def apply_padding(self, padding):
+        """
+        Finish mining with the padding found (e.g. by find_padding run in another process).
+        """
+        self.padding = padding
         self.__checksum = double_sha(self.unmined_raw())
 
     # Database operations
@@ -261,13 +418,17 @@ class Block(pmpi.abstract.AbstractSignedObject):
     def _get_dbname(cls):
         return pmpi.database.Database.BLOCKS
 
+    @pmpi.metrics.timed(pmpi.metrics.BLOCK_PUT_SECONDS)
+    @pmpi.tracing.traced('Block.put', lambda block: {'block_id': pmpi.tracing.hexlify(block.id),
+                                                     'operations': len(block.operations_ids)})
     @pmpi.core.with_database
     def put(self, database):
         super(Block, self).put()
         database.blockchain.add_block(self)
 
+        block_rev = self.get_rev()
         for op in self.operations:
-            op.put(self.get_rev())
+            op.put(block_rev)
 
     @pmpi.core.with_database
     def remove(self, database):
@@ -282,3 +443,73 @@ class Block(pmpi.abstract.AbstractSignedObject):
 
     class GenesisBlockDuplicationError(pmpi.abstract.AbstractSignedObject.DuplicationError):
         pass
+
+    class MiningError(Exception):
+        pass
+
+
+class CompactBlock:
+    """
+    Block relayed without the bodies of its operations -- as Block.raw(), which carries only the operations' ids.
+    The receiver rebuilds the block from the operations it already knows and requests only the missing ones.
+
+    :type raw: bytes
+    :type id: bytes
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.id = double_sha(raw)
+        self.__header = Block._from_raw_without_verifying(raw)
+        self.__operations_ids = set(self.__header.operations_ids)
+        self.__operations = {}
+
+    @property
+    def operations_ids(self):
+        return self.__header.operations_ids
+
+    @property
+    def previous_block_rev(self):
+        return self.__header.previous_block_rev
+
+    def missing_operations_ids(self):
+        return [h for h in self.operations_ids if h not in self.__operations]
+
+    def is_complete(self):
+        return len(self.missing_operations_ids()) == 0
+
+    def add_operations(self, operations):
+        """
+        Take the operations of the block out of given ones. Other operations are ignored.
+        """
+        for op in operations:
+            if op.id in self.__operations_ids:
+                self.__operations[op.id] = op
+
+    def fill(self, pool):
+        """
+        Look up the missing operations in the pool of pending operations and then in the database.
+
+        :param pool: mapping of operations' ids to operations
+        :return: ids of the operations that are still missing
+        """
+        for h in self.missing_operations_ids():
+            if h in pool:
+                self.__operations[h] = pool[h]
+            elif pmpi.operation.Operation.exist(h):
+                self.__operations[h] = pmpi.operation.Operation.get(h)
+
+        return self.missing_operations_ids()
+
+    def to_block(self):
+        """
+        :return: verified block
+        :raise self.IncompleteError: when some operations are missing
+        """
+        if not self.is_complete():
+            raise self.IncompleteError("some of the operations are missing")
+
+        return Block.from_raw_and_operations(self.raw, tuple(self.__operations[h] for h in self.operations_ids))
+
+    class IncompleteError(Exception):
+        pass
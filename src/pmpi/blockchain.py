@@ -4,7 +4,10 @@ from pmpi.exceptions import ObjectDoesNotExist
 import pmpi.database
 import pmpi.block
 import pmpi.identifier
+import pmpi.metrics
+import pmpi.tracing
 from pmpi.identifier import Identifier
+from pmpi.state_tree import StateTree
 import pmpi.operation
 
 
@@ -12,6 +15,8 @@ class BlockChain:
     class Record:
         FIELD_NAMES = ('depth', 'previous_id', 'next_ids')
 
+        __slots__ = ('__depth', '__previous_id', '__next_ids')
+
         def __init__(self, depth, previous_id, next_ids):
             self.__depth = depth
             self.__previous_id = previous_id
@@ -76,6 +81,25 @@ class BlockChain:
                 self.__modify_record(next_rev, depth=lambda _: depth + 1)
                 queue.append(next_rev)
 
+        self.__main_chain = list(reversed(self.backward_blocks_chain(self.__head, self.ROOT)))
+        self.__state_tree = StateTree((uuid, Identifier.get_operation_id(uuid)) for uuid in Identifier.get_uuid_list())
+        self.__sync_engine = None
+
+    def rebuild_history(self):
+        """
+        Record the identifiers' history of all the blocks -- for databases written before the history was kept.
+        """
+        for block_id, record in self.__map.items():
+            if block_id != self.ROOT:
+                Identifier.put_history(pmpi.block.Block.get(block_id), record.depth)
+
+    def rebuild_undo_records(self):
+        """
+        Store the undo records of all the blocks of the main chain -- for databases written before they were kept.
+        """
+        for block_id in self.__main_chain[1:]:
+            Identifier.put_undo_record(block_id, self.__rebuilt_undo_record(pmpi.block.Block.get(block_id)))
+
     def __modify_record(self, revision_id, **kwargs):
         for field in kwargs:
             if field not in self.Record.FIELD_NAMES:
@@ -98,6 +122,8 @@ class BlockChain:
             except KeyError:
                 raise self.Record.DoesNotExist("previous block id doesn't exist")
 
+            Identifier.put_history(block, self.get(block.id).depth)
+
     def remove_block(self, block):
         if block.id not in self.__map:
             raise pmpi.block.Block.DoesNotExist("block isn't in the blockchain")
@@ -122,6 +148,8 @@ class BlockChain:
             self.__modify_record(record.previous_id, next_ids=lambda x: tuple(filter(lambda i: i != block.id, x)))
             del self.__map[block.id]
 
+            Identifier.remove_history(block, record.depth)
+
     def get(self, block_id: bytes) -> Record:
         try:
             return self.__map[block_id]
@@ -142,22 +170,109 @@ class BlockChain:
         except pmpi.block.Block.DoesNotExist:
             return -1
 
+    def structures(self):
+        """
+        :return: dictionary of the in-memory structures of the blockchain, by name (see pmpi.profiler.structure_sizes)
+        """
+        return {'blockchain map': self.__map, 'main chain': self.__main_chain, 'state tree': self.__state_tree}
+
+    @property
+    def state_root(self):
+        """
+        Root of the StateTree of the identifiers as of the head -- what clients check StateProofs against.
+        """
+        return self.__state_tree.root
+
+    def state_proof(self, uuid):
+        """
+        :type uuid: UUID
+        :return: StateProof of the identifier's resolution (or of its absence) as of the head, verifiable against
+            state_root
+        """
+        return self.__state_tree.proof(uuid)
+
+    def main_chain_block_id(self, depth):
+        """
+        :return: id of the block placed at the given depth on the main chain (i.e. the chain ending with the head)
+        """
+        if 0 <= depth < len(self.__main_chain):
+            return self.__main_chain[depth]
+        else:
+            raise pmpi.block.Block.DoesNotExist("there is no block at the given depth on the main chain")
+
+    def resolve_operation_id(self, uuid, block_id):
+        """
+        Find the last operation on the identifier as seen from the block block_id.
+
+        Versions recorded between ROOT and the lowest common ancestor of the block and the head are checked against the
+        main chain; versions recorded after the LCA must belong to the side branch leading to block_id.
+
+        :return: id of the operation, or None if the identifier was not minted up to block_id
+        """
+        return self.resolve_operation_ids([uuid], block_id)[uuid]
+
+    @pmpi.tracing.traced('BlockChain.resolve_operation_ids', lambda blockchain, uuids, block_id: {
+        'identifiers': len(uuids), 'block_id': pmpi.tracing.hexlify(block_id), 'head': block_id == blockchain.head})
+    def resolve_operation_ids(self, uuids, block_id):
+        """
+        resolve_operation_id of many identifiers at once. At the head it's a single lookup of the identifier's current
+        operation; elsewhere the LCA and the side branch are found once, and then the identifier's history is searched.
+
+        :return: dictionary of uuids and ids of the operations (or None)
+        """
+        if block_id == self.head:
+            return {uuid: Identifier.get_operation_id(uuid) for uuid in uuids}
+
+        depth = self.get(block_id).depth
+        lca_id = self.__lowest_common_ancestor(self.head, block_id)
+        lca_depth = self.get(lca_id).depth
+        branch = set(self.backward_blocks_chain(block_id, lca_id)[:-1])
+
+        operations_ids = {}
+        for uuid in uuids:
+            operations_ids[uuid] = None
+            for version_depth, version_block_id, operation_id in reversed(Identifier.get_history(uuid)):
+                if version_depth > depth:
+                    continue
+                if version_depth > lca_depth:
+                    if version_block_id in branch:
+                        operations_ids[uuid] = operation_id
+                        break
+                elif self.__main_chain[version_depth] == version_block_id:
+                    operations_ids[uuid] = operation_id
+                    break
+
+        return operations_ids
+
+    @pmpi.metrics.timed(pmpi.metrics.UPDATE_BLOCKS_SECONDS)
+    @pmpi.tracing.traced('BlockChain.update_blocks', lambda blockchain: {'head_depth': blockchain.max_depth})
     def update_blocks(self):
         new_max_depth = self.max_depth
         new_head = self.head
 
-        for block in self._get_new_blocks():
-            # TODO some additional criteria for accepting block?
-
-            block.put()  # put() is making all needed validations before actually putting the block into the database
-            record = self.get(block.id)
-
-            if record.depth > new_max_depth:
-                new_max_depth = record.depth
-                new_head = block.id
+        try:
+            for block in self._get_new_blocks():
+                # TODO some additional criteria for accepting block?
 
-        if new_max_depth > self.max_depth:
-            self.__set_head(new_head)
+                # put() is making all needed validations before actually putting the block into the database
+                try:
+                    block.put()
+                except Exception:
+                    if pmpi.metrics.enabled:
+                        pmpi.metrics.BLOCKS_REJECTED.inc()
+                    raise
+                if pmpi.metrics.enabled:
+                    pmpi.metrics.BLOCKS_ACCEPTED.inc()
+                record = self.get(block.id)
+
+                if record.depth > new_max_depth:
+                    new_max_depth = record.depth
+                    new_head = block.id
+
+        finally:
+            # blocks put before a rejected one stay in the database -- the head is moved onto them anyway
+            if new_max_depth > self.max_depth:
+                self.__set_head(new_head)
 
     def backward_blocks_chain(self, block_id, end_block_id):
         chain = [block_id]
@@ -170,84 +285,158 @@ class BlockChain:
 
         return chain
 
+    @pmpi.tracing.traced('BlockChain.forward_operations_chain', lambda blockchain, operation_rev, block_id: {
+        'operation_id': pmpi.tracing.hexlify(operation_rev.id), 'block_id': pmpi.tracing.hexlify(block_id)})
     def forward_operations_chain(self, operation_rev, block_id):
-        start_block_id = None
-        root_chain = self.backward_blocks_chain(block_id, self.ROOT)
-        for b_id in operation_rev.obj.containing_blocks:
-            if b_id in root_chain:
-                start_block_id = b_id
-                break
+        return self.forward_operations_chains([operation_rev], block_id)[operation_rev.id]
 
-        if start_block_id is None:
-            raise self.TreeError("operation_rev is not contained by any block being an ancestor of block_id")
+    @pmpi.tracing.traced('BlockChain.forward_operations_chains', lambda blockchain, operation_revs, block_id: {
+        'operations': len(operation_revs), 'block_id': pmpi.tracing.hexlify(block_id)})
+    def forward_operations_chains(self, operation_revs, block_id):
+        """
+        forward_operations_chain of many operations at once -- the chain of blocks, its LCA with the head and the
+        blocks of the side branch are walked (and loaded) once for all of them.
 
+        :return: dictionary of operations' ids and their forward operations chains
+        """
+        root_chain = self.backward_blocks_chain(block_id, self.ROOT)
+        root_chain_positions = {b_id: position for position, b_id in enumerate(root_chain)}
         lca_id = self.__lowest_common_ancestor(self.head, block_id)
+        lca_index = root_chain_positions[lca_id]
+
+        head_branch = None  # blocks from HEAD to LCA
+        side_branch = None  # (operations_ids, {previous operation id: operation id}) of blocks from block_id to LCA
+
+        chains = {}
+        for operation_rev in operation_revs:
+            start_block_id = None
+            for b_id in operation_rev.obj.containing_blocks:
+                if b_id in root_chain_positions:
+                    start_block_id = b_id
+                    break
+
+            if start_block_id is None:
+                raise self.TreeError("operation_rev is not contained by any block being an ancestor of block_id")
+
+            op_chain = []
+
+            if root_chain_positions[start_block_id] >= lca_index:
+                # operation_rev is between ROOT and LCA blocks
+                if head_branch is None:
+                    head_branch = self.backward_blocks_chain(self.head, lca_id)[:-1]
+                ops = pmpi.identifier.Identifier.get(operation_rev.obj.uuid).operation_rev.obj\
+                    .backward_operations_chain(operation_rev.id)
+                idx = 0
+                for b_id in head_branch:
+                    while idx < len(ops) and b_id in pmpi.operation.Operation.get_containing_blocks(ops[idx]):
+                        idx += 1
+
+                op_chain = list(reversed(ops[idx:]))
+
+            if side_branch is None:
+                side_branch = []
+                for b_id in root_chain[:lca_index]:
+                    block = pmpi.block.Block.get(b_id)
+                    side_branch.append((set(block.operations_ids),
+                                        {op.previous_operation_rev.id: op.id for op in block.operations}))
+
+            for operations_ids, op_dict in side_branch:
+                if len(op_chain) == 0:
+                    if operation_rev.id in operations_ids:
+                        op_chain.append(operation_rev.id)
+
+                if len(op_chain) > 0:
+                    while op_chain[-1] in op_dict:
+                        op_chain.append(op_dict[op_chain[-1]])
+
+            chains[operation_rev.id] = op_chain
+
+        return chains
+
+    def set_sync_engine(self, sync_engine):
+        """
+        :param sync_engine: source of new blocks for update_blocks (see pmpi.sync.SyncEngine)
+        """
+        self.__sync_engine = sync_engine
 
-        op_chain = []
+    def _get_new_blocks(self):
+        if self.__sync_engine is None:
+            raise NotImplementedError
+        return self.__sync_engine.get_new_blocks()
 
-        if root_chain.index(start_block_id) >= root_chain.index(lca_id):
-            # operation_rev is between ROOT and LCA blocks
-            ops = pmpi.identifier.Identifier.get(operation_rev.obj.uuid).operation_rev.obj\
-                .backward_operations_chain(operation_rev.id)
-            idx = 0
-            for b_id in self.backward_blocks_chain(self.head, lca_id)[:-1]:  # blocks from HEAD to LCA
-                while idx < len(ops) and b_id in pmpi.operation.Operation.get(ops[idx]).containing_blocks:
-                    idx += 1
+    @pmpi.tracing.traced('BlockChain.set_head', lambda blockchain, new_head_id: {
+        'block_id': pmpi.tracing.hexlify(new_head_id), 'head_depth': blockchain.max_depth})
+    def __set_head(self, new_head_id):
+        lca_id = self.__lowest_common_ancestor(self.head, new_head_id)
 
-            op_chain = list(reversed(ops[idx:]))
+        disconnected = self.backward_blocks_chain(self.head, lca_id)[:-1]
+        for block_id in disconnected:
+            self.__disconnect_block(block_id)
 
-        for b_id in root_chain[:root_chain.index(lca_id)]:
-            if len(op_chain) == 0:
-                if operation_rev.id in pmpi.block.Block.get(b_id).operations_ids:
-                    op_chain.append(operation_rev.id)
+        for block_id in reversed(self.backward_blocks_chain(new_head_id, lca_id)[:-1]):
+            self.__connect_block(block_id)
 
-            if len(op_chain) > 0:
-                op_dict = {op.previous_operation_rev.id: op.id for op in pmpi.block.Block.get(b_id).operations}
-                while op_chain[-1] in op_dict:
-                    op_chain.append(op_dict[op_chain[-1]])
+        lca_depth = self.get(lca_id).depth
+        self.__main_chain[lca_depth + 1:] = reversed(self.backward_blocks_chain(new_head_id, lca_id)[:-1])
+        self.__head = new_head_id
 
-        return op_chain
+        if pmpi.metrics.enabled:
+            if len(disconnected) > 0:
+                pmpi.metrics.REORG_DEPTH.observe(len(disconnected))
+            pmpi.metrics.HEAD_DEPTH.set(self.max_depth)
 
-    def _get_new_blocks(self):
-        raise NotImplementedError
+    def __connect_block(self, block_id):
+        """
+        Move identifiers (and the state tree) forward by the operations of the block and store the undo record of
+        these changes.
+        """
+        undo_record = []
 
-    def __set_head(self, new_head_id):
-        lca_id = self.__lowest_common_ancestor(self.head, new_head_id)
-        blocks_after_lca = self.backward_blocks_chain(self.head, lca_id)[:-1]
-
-        for identifier in [Identifier.get(uuid) for uuid in Identifier.get_uuid_list()]:
-            op = identifier.operation_rev.obj
-            containing_blocks = list(filter(lambda bl: bl in blocks_after_lca, op.containing_blocks))
-            if len(containing_blocks) == 1:
-                while len(containing_blocks) == 1:  # while operation is in a block that belongs to path to the LCA
-                    op = op.previous_operation_rev.obj
-                    if op is not None:
-                        containing_blocks = list(filter(lambda bl: bl in blocks_after_lca, op.containing_blocks))
-                    else:
-                        break
-
-                identifier.remove()
-                if op is not None:
+        for op in pmpi.block.Block.get(block_id).operations:
+            try:
+                identifier = Identifier.get(op.uuid)
+                if identifier.operation_rev == op.previous_operation_rev:
+                    undo_record.append((op.uuid, identifier.operation_rev.id))
                     identifier.operation_rev = op.get_rev()
                     identifier.put()
+                    self.__state_tree.set(op.uuid, op.id)
+                else:
+                    raise self.TreeError("inconsistency of operations")
+            except Identifier.DoesNotExist:
+                if op.previous_operation_rev.is_none():
+                    undo_record.append((op.uuid, None))
+                    Identifier(op.uuid, op.get_rev()).put()
+                    self.__state_tree.set(op.uuid, op.id)
+                else:
+                    raise self.TreeError("multiple minting of the identifier")
+
+        Identifier.put_undo_record(block_id, undo_record)
+
+    def __disconnect_block(self, block_id):
+        """
+        Restore identifiers (and the state tree) to the state from before the block, using its undo record.
+
+        Blocks connected by older versions have no undo record -- the record is then rebuilt from the block itself:
+        connecting requires every operation to continue the current operation of its identifier, so the replaced
+        pointers are the previous operations.
+        """
+        try:
+            undo_record = Identifier.pop_undo_record(block_id)
+        except Identifier.DoesNotExist:
+            undo_record = self.__rebuilt_undo_record(pmpi.block.Block.get(block_id))
+
+        for uuid, operation_id in reversed(undo_record):
+            if operation_id is None:
+                Identifier.remove_uuid(uuid)
+                self.__state_tree.remove(uuid)
+            else:
+                Identifier(uuid, pmpi.operation.OperationRev.from_id(operation_id)).put()
+                self.__state_tree.set(uuid, operation_id)
 
-        for block_id in reversed(self.backward_blocks_chain(new_head_id, lca_id)[:-1]):
-            for op in pmpi.block.Block.get(block_id).operations:
-                try:
-                    identifier = Identifier.get(op.uuid)
-                    if identifier.operation_rev == op.previous_operation_rev:
-                        identifier.remove()
-                        identifier.operation_rev = op.get_rev()
-                        identifier.put()
-                    else:
-                        raise self.TreeError("inconsistency of operations")
-                except Identifier.DoesNotExist:
-                    if op.previous_operation_rev.is_none():
-                        Identifier(op.uuid, op.get_rev()).put()
-                    else:
-                        raise self.TreeError("multiple minting of the identifier")
-
-        self.__head = new_head_id
+    @staticmethod
+    def __rebuilt_undo_record(block):
+        return [(op.uuid, None if op.previous_operation_rev.is_none() else op.previous_operation_rev.id)
+                for op in block.operations]
 
     def __lowest_common_ancestor(self, block_id1, block_id2):
         records = [(b_id, self.get(b_id)) for b_id in (block_id1, block_id2)]
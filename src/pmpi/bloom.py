@@ -0,0 +1,89 @@
+from hashlib import sha256
+from io import BytesIO
+from math import ceil, log
+
+from pmpi.utils import read_bytes, read_uint32
+
+
+class BloomFilter:
+    """
+    Set of keys answering definite "no" for the keys that were never added. Positive answers can be false.
+
+    Keys can't be removed from the filter -- removals are only counted as stale entries, so the owner knows when the
+    filter should be rebuilt from scratch.
+
+    :type size: int
+    :type hashes: int
+    :type capacity: int
+    :type count: int
+    :type stale: int
+    """
+
+    DEFAULT_ERROR_RATE = 0.01
+    MIN_CAPACITY = 1024
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        """
+        :param capacity: number of keys the filter is designed for
+        :param error_rate: expected false positives rate when the filter holds capacity keys
+        """
+        self.capacity = max(capacity, self.MIN_CAPACITY)
+        self.size = int(ceil(-self.capacity * log(error_rate) / log(2) ** 2))
+        self.hashes = max(1, int(round(self.size / self.capacity * log(2))))
+        self.count = 0
+        self.stale = 0
+        self.__bits = bytearray((self.size + 7) // 8)
+
+    def __positions(self, key):
+        digest = sha256(key).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for position in self.__positions(key):
+            self.__bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def discard(self, key):
+        self.stale += 1
+
+    def __contains__(self, key):
+        return all(self.__bits[position >> 3] & (1 << (position & 7)) for position in self.__positions(key))
+
+    def is_saturated(self):
+        """
+        :return: True if the filter holds too many (also stale) keys to keep its error rate
+        """
+        return self.count > self.capacity or self.stale > max(self.count - self.stale, self.MIN_CAPACITY)
+
+    # Serialization and deserialization
+
+    def raw(self):
+        ret = self.capacity.to_bytes(4, 'big')
+        ret += self.size.to_bytes(4, 'big')
+        ret += self.hashes.to_bytes(4, 'big')
+        ret += self.count.to_bytes(4, 'big')
+        ret += self.stale.to_bytes(4, 'big')
+        ret += bytes(self.__bits)
+        return ret
+
+    @classmethod
+    def from_raw(cls, raw):
+        buffer = BytesIO(raw)
+        bloom_filter = cls.__new__(cls)
+        bloom_filter.capacity = read_uint32(buffer)
+        bloom_filter.size = read_uint32(buffer)
+        bloom_filter.hashes = read_uint32(buffer)
+        bloom_filter.count = read_uint32(buffer)
+        bloom_filter.stale = read_uint32(buffer)
+        bloom_filter.__bits = bytearray(read_bytes(buffer, (bloom_filter.size + 7) // 8))
+        return bloom_filter
+
+    @classmethod
+    def from_keys(cls, keys, error_rate=DEFAULT_ERROR_RATE):
+        keys = list(keys)
+        bloom_filter = cls(2 * len(keys), error_rate)
+        for key in keys:
+            bloom_filter.add(key)
+        return bloom_filter
@@ -1,16 +1,69 @@
+import pmpi.block
 import pmpi.database
 
 
 __database = None
+__chain_parameters = None
 
 
-def initialise_database(filename):
+class ChainParameters:
+    """
+    Parameters of the chain which all of its nodes have to agree on.
+
+    :type min_operations: int
+    :type max_operations: int
+    """
+
+    __slots__ = ('min_operations', 'max_operations')
+
+    def __init__(self, min_operations=None, max_operations=None):
+        """
+        :param min_operations: the least number of operations in a block (Block.MIN_OPERATIONS by default)
+        :param max_operations: the greatest operations_limit of a block (Block.MAX_OPERATIONS by default)
+        """
+        self.min_operations = min_operations if min_operations is not None else pmpi.block.Block.MIN_OPERATIONS
+        self.max_operations = max_operations if max_operations is not None else pmpi.block.Block.MAX_OPERATIONS
+
+        if not 1 <= self.min_operations <= self.max_operations < 1 << 32:
+            raise self.ParametersError("wrong limits of the number of operations")
+
+    class ParametersError(Exception):
+        pass
+
+
+def set_chain_parameters(chain_parameters):
+    """
+    :type chain_parameters: ChainParameters
+    """
+    global __chain_parameters
+
+    __chain_parameters = chain_parameters
+
+
+def get_chain_parameters():
+    """
+    :return: ChainParameters set by set_chain_parameters, or the default ones
+    """
+    global __chain_parameters
+
+    if __chain_parameters is None:
+        __chain_parameters = ChainParameters()
+    return __chain_parameters
+
+
+def initialise_database(filename, segments_directory=None):
     global __database
 
     if __database is not None:
         raise pmpi.database.Database.InitialisationError("close opened database first")
-    __database = pmpi.database.Database(filename)
-    __database.initialise_blockchain()
+    database = pmpi.database.Database(filename, segments_directory)
+    __database = database
+    try:
+        database.initialise_blockchain()
+    except Exception:
+        __database = None
+        database.close()
+        raise
 
 
 def close_database():
@@ -1,52 +1,238 @@
+import os
+
 from bsddb3 import db
+from pmpi.bloom import BloomFilter
 from pmpi.exceptions import ObjectDoesNotExist
+from pmpi.segments import SegmentStore
 import pmpi.blockchain
+import pmpi.metrics
+import pmpi.operation
+import pmpi.tracing
 
 
 class Database:
     IDENTIFIERS = 'identifiers'
+    IDENTIFIERS_HISTORY = 'identifiers_history'
+    IDENTIFIERS_UNDO = 'identifiers_undo'
     OPERATIONS = 'operations'
+    OPERATIONS_BLOCKS = 'operations_blocks'
     BLOCKS = 'blocks'
-    DBNAMES = {IDENTIFIERS, OPERATIONS, BLOCKS}
+    DBNAMES = {IDENTIFIERS, IDENTIFIERS_HISTORY, IDENTIFIERS_UNDO, OPERATIONS, OPERATIONS_BLOCKS, BLOCKS}
+
+    # sub-databases which are scanned by key prefixes -- they need the keys to be ordered
+    ORDERED_DBNAMES = {IDENTIFIERS_HISTORY, OPERATIONS_BLOCKS}
+
+    # sub-databases probed mostly for keys that aren't there -- guarded by bloom filters
+    FILTERED_DBNAMES = {IDENTIFIERS, OPERATIONS, BLOCKS}
+
+    # sub-databases of immutable objects -- can be kept in append-only segment files instead
+    SEGMENTED_DBNAMES = {OPERATIONS, BLOCKS}
 
-    def __init__(self, filename):
+    # internal sub-database keeping the bloom filters between sessions
+    META = 'meta'
+    FILTERS_DIRTY_KEY = b'bloom_filters_dirty'
+    FILTER_KEY_PREFIX = b'bloom_filter:'
+    CHECKPOINT_KEY = b'checkpoint'
+
+    # format of the records -- databases written before it was recorded keep the containing blocks inside the records
+    # of operations and have no identifiers' history
+    FORMAT_KEY = b'format'
+    FORMAT = 2
+
+    def __init__(self, filename, segments_directory=None):
+        """
+        :param segments_directory: directory of the segment files keeping blocks and operations, or None to keep them
+            in the database file
+        """
         self.__db = {}
-        for dbname in self.DBNAMES:
-            self.__db[dbname] = db.DB()
-            self.__db[dbname].open(filename, dbname=dbname, dbtype=db.DB_HASH, flags=db.DB_CREATE)
+        for dbname in self.DBNAMES | {self.META}:
+            if segments_directory is not None and dbname in self.SEGMENTED_DBNAMES:
+                self.__db[dbname] = SegmentStore(os.path.join(segments_directory, dbname))
+            else:
+                self.__db[dbname] = db.DB()
+                self.__db[dbname].open(filename, dbname=dbname,
+                                       dbtype=db.DB_BTREE if dbname in self.ORDERED_DBNAMES else db.DB_HASH,
+                                       flags=db.DB_CREATE)
+
+        self.__filters = {}
+        self.__load_filters()
 
         self.__blockchain = None
 
+    # Bloom filters
+
+    def __load_filters(self):
+        """
+        Load bloom filters saved on the last close. When the database wasn't closed properly, rebuild them.
+        """
+        meta = self.__db[self.META]
+        dirty = self.FILTERS_DIRTY_KEY in meta
+
+        for dbname in self.FILTERED_DBNAMES:
+            filter_key = self.FILTER_KEY_PREFIX + dbname.encode()
+            if not dirty and filter_key in meta:
+                self.__filters[dbname] = BloomFilter.from_raw(meta[filter_key])
+            else:
+                self.rebuild_filter(dbname)
+
+        meta[self.FILTERS_DIRTY_KEY] = b''
+        meta.sync()
+
+    def __save_filters(self):
+        meta = self.__db[self.META]
+        for dbname, bloom_filter in self.__filters.items():
+            meta[self.FILTER_KEY_PREFIX + dbname.encode()] = bloom_filter.raw()
+        meta.delete(self.FILTERS_DIRTY_KEY)
+
+    def rebuild_filter(self, dbname):
+        self.__filters[dbname] = BloomFilter.from_keys(self.__db[dbname].keys())
+
+    def __may_contain(self, dbname, key):
+        if dbname not in self.__filters or key in self.__filters[dbname]:
+            return True
+        if pmpi.metrics.enabled:
+            pmpi.metrics.BLOOM_FILTER_SKIPS.labels(dbname).inc()
+        return False
+
+    # Checkpoint
+
+    def get_checkpoint(self):
+        """
+        :return: id of the block trusted by the node (see set_checkpoint), or None
+        """
+        return self.__db[self.META].get(self.CHECKPOINT_KEY)
+
+    def set_checkpoint(self, block_id):
+        """
+        Trust the block -- signatures of the block and its ancestors are not verified any more when the chain is
+        replayed (see pmpi.sync.SyncEngine and pmpi.archive.import_archive).
+
+        :param block_id: id of a block, e.g. of the head validated by the node, or None to remove the checkpoint
+        """
+        meta = self.__db[self.META]
+        if block_id is not None:
+            meta[self.CHECKPOINT_KEY] = block_id
+        elif self.CHECKPOINT_KEY in meta:
+            meta.delete(self.CHECKPOINT_KEY)
+        meta.sync()
+
+    # Database operations
+
     @property
     def blockchain(self):
         return self.__blockchain
 
     def initialise_blockchain(self):
         if self.__blockchain is None:
+            upgrade = self.__requires_upgrade()
+            if upgrade:
+                pmpi.operation.Operation.upgrade_records()
+
             self.__blockchain = pmpi.blockchain.BlockChain()
+
+            if upgrade:
+                self.__blockchain.rebuild_history()
+                self.__blockchain.rebuild_undo_records()
+                meta = self.__db[self.META]
+                meta[self.FORMAT_KEY] = self.FORMAT.to_bytes(4, 'big')
+                meta.sync()
         else:
             raise self.InitialisationError("BlockChain has been already initialised")
 
+    def __requires_upgrade(self):
+        """
+        :return: True if the records have to be upgraded to the current FORMAT
+        :raise self.InitialisationError: when the database was written in a newer format
+        """
+        meta = self.__db[self.META]
+        if self.FORMAT_KEY not in meta:
+            return True
+        if int.from_bytes(meta[self.FORMAT_KEY], 'big') > self.FORMAT:
+            raise self.InitialisationError("database format is newer than supported")
+        return False
+
     def length(self, dbname):
         return len(self.__db[dbname])
 
     def keys(self, dbname):
         return self.__db[dbname].keys()
 
+    def prefix_items(self, dbname, prefix):
+        """
+        :return: list of (key, data) pairs with keys starting with prefix, ordered by key
+        """
+        if dbname not in self.ORDERED_DBNAMES:
+            raise KeyError("prefix lookups are available only for ordered databases")
+
+        if pmpi.tracing.enabled:
+            pmpi.tracing.count_read()
+
+        items = []
+        cursor = self.__db[dbname].cursor()
+        try:
+            record = cursor.set_range(prefix)
+            while record is not None and record[0].startswith(prefix):
+                items.append(record)
+                record = cursor.next()
+        finally:
+            cursor.close()
+        return items
+
+    def exist(self, dbname, key):
+        if not self.__may_contain(dbname, key):
+            return False
+        if pmpi.tracing.enabled:
+            pmpi.tracing.count_read()
+        return key in self.__db[dbname]
+
     def get(self, dbname, key):
+        if not self.__may_contain(dbname, key):
+            raise KeyError(key)
+        if pmpi.metrics.enabled:
+            pmpi.metrics.DATABASE_READS.labels(dbname).inc()
+        if pmpi.tracing.enabled:
+            pmpi.tracing.count_read()
         return self.__db[dbname][key]
 
     def put(self, dbname, key, data):
+        if pmpi.metrics.enabled:
+            pmpi.metrics.DATABASE_WRITES.labels(dbname).inc()
+        if pmpi.tracing.enabled:
+            pmpi.tracing.count_write()
         self.__db[dbname][key] = data
 
+        bloom_filter = self.__filters.get(dbname)
+        if bloom_filter is not None and key not in bloom_filter:
+            bloom_filter.add(key)
+            if bloom_filter.is_saturated():
+                self.rebuild_filter(dbname)
+
     def delete(self, dbname, key):
-        if key in self.__db[dbname]:
+        if self.exist(dbname, key):
+            if pmpi.metrics.enabled:
+                pmpi.metrics.DATABASE_DELETES.labels(dbname).inc()
+            if pmpi.tracing.enabled:
+                pmpi.tracing.count_write()
             self.__db[dbname].delete(key)
+
+            bloom_filter = self.__filters.get(dbname)
+            if bloom_filter is not None:
+                bloom_filter.discard(key)
+                if bloom_filter.is_saturated():
+                    self.rebuild_filter(dbname)
         else:
             raise ObjectDoesNotExist
 
-    def close(self):
+    def sync(self):
+        """
+        Flush all the sub-databases to the disk.
+        """
         for dbname in self.DBNAMES:
+            self.__db[dbname].sync()
+
+    def close(self):
+        self.__save_filters()
+        for dbname in self.DBNAMES | {self.META}:
             self.__db[dbname].close()
 
     class InitialisationError(Exception):
@@ -1,6 +1,9 @@
+from io import BytesIO
 from uuid import UUID
 from pmpi.core import with_database
+import pmpi.core
 from pmpi.exceptions import ObjectDoesNotExist
+from pmpi.utils import read_bytes, read_uint32
 import pmpi.database
 import pmpi.operation
 
@@ -55,6 +58,129 @@ class Identifier:
         except KeyError:
             raise cls.DoesNotExist
 
+    @classmethod
+    @with_database
+    def get_operation_id(cls, database, uuid):
+        """
+        :type uuid: UUID
+        :param database: provided by database_required decorator
+        :return: id of the operation the identifier points at, or None if the identifier doesn't exist
+        """
+        try:
+            return database.get(pmpi.database.Database.IDENTIFIERS, uuid.bytes)
+        except KeyError:
+            return None
+
+    @classmethod
+    def resolve_at(cls, uuid, block_id_or_depth):
+        """
+        Resolve the identifier as it was seen by a given block.
+
+        :type uuid: UUID
+        :param block_id_or_depth: id of any block in the blockchain (also on a side branch) or depth on the main chain
+        :return: an identifier with requested UUID, pointing at the latest operation up to the given block
+        :raise cls.DoesNotExist: when the identifier was not minted yet at the given block
+        """
+        blockchain = pmpi.core.get_blockchain()
+
+        if isinstance(block_id_or_depth, int):
+            block_id = blockchain.main_chain_block_id(block_id_or_depth)
+        else:
+            block_id = block_id_or_depth
+
+        operation_id = blockchain.resolve_operation_id(uuid, block_id)
+        if operation_id is None:
+            raise cls.DoesNotExist
+
+        return Identifier(uuid, pmpi.operation.OperationRev.from_id(operation_id))
+
+    @classmethod
+    @with_database
+    def get_history(cls, database, uuid):
+        """
+        :type uuid: UUID
+        :param database: provided by database_required decorator
+        :return: list of (depth, block_id, operation_id) tuples for all the blocks changing the identifier,
+            ordered by depth
+        """
+        return [(int.from_bytes(key[16:20], 'big'), key[20:], operation_id) for key, operation_id in
+                database.prefix_items(pmpi.database.Database.IDENTIFIERS_HISTORY, uuid.bytes)]
+
+    @staticmethod
+    def _history_entries(block, depth):
+        """
+        :return: dict of history keys for the identifiers changed by the block, mapped to the last operation (within
+            the block) on each of them
+        """
+        operations = block.operations
+        previous_ids = {op.previous_operation_rev.id for op in operations}
+        key_suffix = depth.to_bytes(4, 'big') + block.id
+        return {op.uuid.bytes + key_suffix: op.id for op in operations if op.id not in previous_ids}
+
+    @classmethod
+    @with_database
+    def put_history(cls, database, block, depth):
+        """
+        Record the identifiers' versions introduced by the block placed at the given depth.
+
+        :param database: provided by database_required decorator
+        """
+        for key, operation_id in cls._history_entries(block, depth).items():
+            database.put(pmpi.database.Database.IDENTIFIERS_HISTORY, key, operation_id)
+
+    @classmethod
+    @with_database
+    def remove_history(cls, database, block, depth):
+        """
+        Remove the identifiers' versions introduced by the block placed at the given depth.
+
+        :param database: provided by database_required decorator
+        """
+        for key in cls._history_entries(block, depth):
+            try:
+                database.delete(pmpi.database.Database.IDENTIFIERS_HISTORY, key)
+            except ObjectDoesNotExist:
+                pass
+
+    @classmethod
+    @with_database
+    def put_undo_record(cls, database, block_id, undo_record):
+        """
+        Store the identifiers' pointers replaced by connecting the block to the main chain.
+
+        :param database: provided by database_required decorator
+        :param undo_record: list of (uuid, operation_id) pairs in order of changes; operation_id is None for minted uuids
+        """
+        none_id = pmpi.operation.OperationRev().id
+        database.put(pmpi.database.Database.IDENTIFIERS_UNDO, block_id,
+                     len(undo_record).to_bytes(4, 'big') + b''.join(
+                         uuid.bytes + (operation_id if operation_id is not None else none_id)
+                         for uuid, operation_id in undo_record))
+
+    @classmethod
+    @with_database
+    def pop_undo_record(cls, database, block_id):
+        """
+        Get and remove the undo record of the block.
+
+        :param database: provided by database_required decorator
+        :return: list of (uuid, operation_id) pairs stored by put_undo_record
+        :raise cls.DoesNotExist: when there is no undo record of the block
+        """
+        try:
+            buffer = BytesIO(database.get(pmpi.database.Database.IDENTIFIERS_UNDO, block_id))
+            database.delete(pmpi.database.Database.IDENTIFIERS_UNDO, block_id)
+        except (KeyError, ObjectDoesNotExist):
+            raise cls.DoesNotExist
+
+        none_id = pmpi.operation.OperationRev().id
+        undo_record = []
+        for _ in range(read_uint32(buffer)):
+            uuid = UUID(bytes=read_bytes(buffer, 16))
+            operation_id = read_bytes(buffer, 32)
+            undo_record.append((uuid, operation_id if operation_id != none_id else None))
+        return undo_record
+
     @with_database
     def put(self, database):
         """
@@ -65,18 +191,27 @@ class Identifier:
         self.verify()
         database.put(pmpi.database.Database.IDENTIFIERS, self.uuid.bytes, self.operation_rev.id)
 
-    @pmpi.core.with_database
-    def remove(self, database):
+    def remove(self):
         """
         Remove the identifier from the database.
 
-        :param database: provided by database_required decorator
         :raise self.DoesNotExist: when the identifier is not in the database
         """
+        self.remove_uuid(self.uuid)
+
+    @classmethod
+    @with_database
+    def remove_uuid(cls, database, uuid):
+        """
+        Remove the identifier with given UUID from the database.
+
+        :param database: provided by database_required decorator
+        :raise cls.DoesNotExist: when the identifier is not in the database
+        """
         try:
-            database.delete(pmpi.database.Database.IDENTIFIERS, self.uuid.bytes)
+            database.delete(pmpi.database.Database.IDENTIFIERS, uuid.bytes)
         except ObjectDoesNotExist:
-            raise self.DoesNotExist
+            raise cls.DoesNotExist
 
     # Exceptions
 
@@ -0,0 +1,202 @@
+from collections import OrderedDict
+
+from pmpi.block import Block, BlockRev
+from pmpi.identifier import Identifier
+from pmpi.operation import Operation
+import pmpi.core
+
+
+class Mempool:
+    """
+    Pool of pending (not yet confirmed) operations, indexed by operation id, by UUID and by previous_operation_rev.
+
+    Only one successor of every revision is accepted -- the first one to arrive. Minting operations are successors of
+    no revision, so among them only one per UUID is accepted. When the pool is full, the oldest operations are evicted
+    together with their descendants.
+    """
+
+    DEFAULT_MAX_SIZE = 10000
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+
+        self.__operations = OrderedDict()
+        self.__by_uuid = {}
+        self.__by_previous = {}
+
+    @staticmethod
+    def __successor_key(op):
+        if op.previous_operation_rev.is_none():
+            return op.uuid.bytes
+        else:
+            return op.previous_operation_rev.id
+
+    # Getters
+
+    def __len__(self):
+        return len(self.__operations)
+
+    def __contains__(self, operation_id):
+        return operation_id in self.__operations
+
+    def __getitem__(self, operation_id):
+        return self.__operations[operation_id]
+
+    def __iter__(self):
+        return iter(self.__operations.values())
+
+    def get(self, operation_id, default=None):
+        return self.__operations.get(operation_id, default)
+
+    def structures(self):
+        """
+        :return: dictionary of the in-memory structures of the pool, by name (see pmpi.profiler.structure_sizes)
+        """
+        return {'mempool': self.__operations, 'mempool uuid index': self.__by_uuid,
+                'mempool successors index': self.__by_previous}
+
+    def get_by_uuid(self, uuid):
+        """
+        :return: pending operations on the identifier, in order of arrival
+        """
+        return [self.__operations[h] for h in self.__by_uuid.get(uuid, ())]
+
+    def get_successor(self, previous_operation_id):
+        """
+        :return: pending operation pointing at the given revision, or None
+        """
+        operation_id = self.__by_previous.get(previous_operation_id)
+        return self.__operations[operation_id] if operation_id is not None else None
+
+    def get_minting(self, uuid):
+        """
+        :return: pending minting operation of the identifier, or None
+        """
+        operation_id = self.__by_previous.get(uuid.bytes)
+        return self.__operations[operation_id] if operation_id is not None else None
+
+    # Block templates
+
+    def __is_mintable(self, op):
+        if Operation.exist(op.id):
+            return True  # contained by a block on another branch already
+        return len(Identifier.get_history(op.uuid)) == 0
+
+    def select_operations(self, operations_limit):
+        """
+        Pick pending operations forming a valid continuation of the current head: for every identifier, the chain of
+        pending successors of its current revision (or of no revision, for identifiers not minted yet).
+
+        :return: at most operations_limit operations, parents always before their children
+        """
+        selected = []
+        for uuid in self.__by_uuid:
+            if len(selected) >= operations_limit:
+                break
+
+            tip_id = Identifier.get_operation_id(uuid)
+            if tip_id is None:
+                op = self.get_minting(uuid)
+                if op is None or not self.__is_mintable(op):
+                    continue
+            else:
+                op = self.get_successor(tip_id)
+
+            while op is not None and len(selected) < operations_limit:
+                selected.append(op)
+                op = self.get_successor(op.id)
+
+        return selected
+
+    def build_block(self, timestamp, operations_limit=None):
+        """
+        :param operations_limit: operations_limit of the block, the greatest one allowed by the chain parameters by
+            default
+        :return: block template (not mined and not signed) on top of the current head, or None if there are not enough
+            valid pending operations
+        """
+        chain_parameters = pmpi.core.get_chain_parameters()
+        if operations_limit is None:
+            operations_limit = chain_parameters.max_operations
+
+        operations = self.select_operations(operations_limit)
+        if len(operations) < chain_parameters.min_operations:
+            return None
+
+        head = pmpi.core.get_blockchain().head
+        previous_block_rev = BlockRev.from_id(head) if head != BlockRev().id else BlockRev()
+
+        block = Block.from_operations_list(previous_block_rev, timestamp, operations, Block.MERKLE_VERSION)
+        block.operations_limit = operations_limit
+        return block
+
+    # Modifiers
+
+    def add(self, op):
+        """
+        :raise self.DuplicationError: when the operation is pending already
+        :raise self.ConflictError: when another pending operation points at the same revision
+        """
+        if op.id in self.__operations:
+            raise self.DuplicationError("operation is already in the pool")
+
+        key = self.__successor_key(op)
+        if key in self.__by_previous:
+            raise self.ConflictError("another operation pointing at the same revision is already in the pool")
+
+        while len(self.__operations) >= self.max_size:
+            self.remove(next(iter(self.__operations)))
+
+        self.__operations[op.id] = op
+        self.__by_uuid.setdefault(op.uuid, OrderedDict())[op.id] = None
+        self.__by_previous[key] = op.id
+
+    def __pop(self, operation_id):
+        op = self.__operations.pop(operation_id)
+
+        ids = self.__by_uuid[op.uuid]
+        del ids[op.id]
+        if len(ids) == 0:
+            del self.__by_uuid[op.uuid]
+
+        del self.__by_previous[self.__successor_key(op)]
+        return op
+
+    def remove(self, operation_id):
+        """
+        Remove the operation and all the pending operations built on it.
+
+        :return: list of removed operations
+        """
+        removed = []
+        while operation_id in self.__operations:
+            op = self.__pop(operation_id)
+            removed.append(op)
+            operation_id = self.__by_previous.get(op.id)
+        return removed
+
+    def remove_confirmed(self, operations):
+        """
+        Drop operations confirmed by a newly accepted block, and pending operations conflicting with them.
+
+        :param operations: operations of the accepted block
+        :return: list of removed operations
+        """
+        removed = []
+        for op in operations:
+            if op.id in self.__operations:
+                # the successors of op stay in the pool -- they are still valid
+                removed.append(self.__pop(op.id))
+            else:
+                conflicting_id = self.__by_previous.get(self.__successor_key(op))
+                if conflicting_id is not None:
+                    removed.extend(self.remove(conflicting_id))
+        return removed
+
+    # Exceptions
+
+    class DuplicationError(Exception):
+        pass
+
+    class ConflictError(Exception):
+        pass
@@ -0,0 +1,136 @@
+from io import BytesIO
+
+from pmpi.exceptions import RawFormatError
+from pmpi.utils import double_sha, read_bytes, read_uint32
+
+
+EMPTY_ROOT = bytes(32)
+
+
+def _parent(left, right):
+    return double_sha(left + right)
+
+
+class MerkleTree:
+    """
+    Merkle tree of 32-byte ids (the leaves are the ids themselves). A node without a sibling (the last one on a level of
+    odd length) is moved up unchanged -- the leaves are not duplicated. The number of leaves is committed together with
+    the root (see Block.MERKLE_VERSION), which fixes the shape of the tree.
+
+    :type levels: list[list[bytes]]
+    """
+
+    __slots__ = ('levels',)
+
+    def __init__(self, ids):
+        """
+        :param ids: sequence of 32-byte ids (e.g. Block.operations_ids)
+        """
+        level = list(ids)
+        self.levels = [level]
+        while len(level) > 1:
+            level = [_parent(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                     for i in range(0, len(level), 2)]
+            self.levels.append(level)
+
+    def __len__(self):
+        return len(self.levels[0])
+
+    @property
+    def root(self):
+        return self.levels[-1][0] if len(self) > 0 else EMPTY_ROOT
+
+    def proof(self, index):
+        """
+        :param index: position of the leaf
+        :return: MerkleProof of the leaf
+        :raise IndexError: when there is no such leaf
+        """
+        if not 0 <= index < len(self):
+            raise IndexError("leaf index out of range")
+
+        hashes = []
+        position = index
+        for level in self.levels[:-1]:
+            sibling = position ^ 1
+            if sibling < len(level):
+                hashes.append(level[sibling])
+            position //= 2
+
+        return MerkleProof(index, len(self), hashes)
+
+
+def merkle_root(ids):
+    """
+    :return: root of the MerkleTree of given ids
+    """
+    return MerkleTree(ids).root
+
+
+class MerkleProof:
+    """
+    Proof that a leaf is at a position of a Merkle tree with a given number of leaves -- the siblings on the path from
+    the leaf to the root (logarithmic in the number of leaves).
+
+    :type index: int
+    :type count: int
+    :type hashes: tuple[bytes]
+    """
+
+    __slots__ = ('index', 'count', 'hashes')
+
+    def __init__(self, index, count, hashes):
+        self.index = index
+        self.count = count
+        self.hashes = tuple(hashes)
+
+    def __eq__(self, other):
+        return isinstance(other, MerkleProof) and \
+            (self.index, self.count, self.hashes) == (other.index, other.count, other.hashes)
+
+    def verify(self, leaf, root):
+        """
+        :param leaf: 32-byte id
+        :param root: root of the tree (e.g. Block.merkle_root)
+        :return: True if the leaf is at self.index of the tree with self.count leaves and given root
+        """
+        if not 0 <= self.index < self.count:
+            return False
+
+        node = leaf
+        position, width = self.index, self.count
+        hashes = iter(self.hashes)
+        try:
+            while width > 1:
+                if position % 2 == 1:
+                    node = _parent(next(hashes), node)
+                elif position + 1 < width:
+                    node = _parent(node, next(hashes))
+                position //= 2
+                width = (width + 1) // 2
+        except StopIteration:
+            return False  # too few hashes
+
+        return next(hashes, None) is None and node == root
+
+    # Serialization and deserialization
+
+    def raw(self):
+        ret = self.index.to_bytes(4, 'big')
+        ret += self.count.to_bytes(4, 'big')
+        ret += len(self.hashes).to_bytes(4, 'big')
+        ret += b''.join(self.hashes)
+        return ret
+
+    @classmethod
+    def from_raw(cls, raw):
+        buffer = BytesIO(raw)
+
+        index = read_uint32(buffer)
+        count = read_uint32(buffer)
+        hashes = [read_bytes(buffer, 32) for _ in range(read_uint32(buffer))]
+
+        if len(buffer.read()) > 0:
+            raise RawFormatError("raw input too long")
+
+        return cls(index, count, hashes)
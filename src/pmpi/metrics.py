@@ -0,0 +1,350 @@
+from bisect import bisect_left
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import math
+from socketserver import ThreadingMixIn
+import threading
+import time
+
+# Instrumented code checks this flag before touching any metric -- disabled metrics cost one attribute lookup.
+enabled = False
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+class Registry:
+    """
+    Set of metrics exported together.
+    """
+
+    def __init__(self):
+        self.__metrics = {}
+        self.__lock = threading.Lock()
+
+    def register(self, metric):
+        with self.__lock:
+            if metric.name in self.__metrics:
+                raise ValueError("metric {} already registered".format(metric.name))
+            self.__metrics[metric.name] = metric
+
+    def get(self, name):
+        return self.__metrics[name]
+
+    def metrics(self):
+        with self.__lock:
+            return list(self.__metrics.values())
+
+    def exposition(self):
+        """
+        :return: all the metrics in the Prometheus text format (version 0.0.4)
+        """
+        lines = []
+        for metric in self.metrics():
+            lines.append('# HELP {} {}'.format(metric.name, _escape_help(metric.documentation)))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.TYPE))
+            for suffix, labels, value in metric.samples():
+                if len(labels) > 0:
+                    lines.append('{}{}{{{}}} {}'.format(metric.name, suffix, ','.join(
+                        '{}="{}"'.format(name, _escape_label_value(label)) for name, label in labels), _format(value)))
+                else:
+                    lines.append('{}{} {}'.format(metric.name, suffix, _format(value)))
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+def _escape_help(text):
+    return text.replace('\\', r'\\').replace('\n', r'\n')
+
+
+def _escape_label_value(text):
+    return str(text).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+# Metrics
+
+class Metric:
+    """
+    Metric with an optional set of labels. Values are kept per combination of label values -- see labels().
+    """
+
+    TYPE = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+        self._lock = threading.Lock()
+        self.__values = {}
+        if len(self.labelnames) == 0:
+            self.__values[()] = self._new_value()
+
+        if registry is not None:
+            registry.register(self)
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *label_values):
+        """
+        :return: value of the metric for the given label values, created on the first use
+        """
+        try:
+            return self.__values[label_values]
+        except KeyError:
+            if len(label_values) != len(self.labelnames):
+                raise ValueError("wrong number of label values")
+            with self._lock:
+                return self.__values.setdefault(label_values, self._new_value())
+
+    def _unlabeled(self):
+        try:
+            return self.__values[()]
+        except KeyError:
+            raise ValueError("metric has labels -- use labels()")
+
+    def samples(self):
+        """
+        :return: generator of (name suffix, [(label name, label value), ...], value) tuples
+        """
+        for label_values, value in sorted(self.__values.items()):
+            for suffix, extra_labels, sample in value.samples():
+                yield suffix, list(zip(self.labelnames, label_values)) + extra_labels, sample
+
+
+class _CounterValue:
+    def __init__(self, lock):
+        self.__lock = lock
+        self.value = 0
+
+    def inc(self, amount=1):
+        if amount < 0:
+            raise ValueError("counters can only be increased")
+        with self.__lock:
+            self.value += amount
+
+    def samples(self):
+        yield '_total', [], self.value
+
+
+class Counter(Metric):
+    """
+    Monotonically increasing value, e.g. the number of database reads. The name should not end with _total -- the
+    suffix is added in the exposition.
+    """
+
+    TYPE = 'counter'
+
+    def _new_value(self):
+        return _CounterValue(self._lock)
+
+    def inc(self, amount=1):
+        self._unlabeled().inc(amount)
+
+    @property
+    def value(self):
+        return self._unlabeled().value
+
+
+class _GaugeValue:
+    def __init__(self, lock):
+        self.__lock = lock
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.__lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def samples(self):
+        yield '', [], self.value
+
+
+class Gauge(Metric):
+    """
+    Value which can go up and down, e.g. the depth of the head.
+    """
+
+    TYPE = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue(self._lock)
+
+    def set(self, value):
+        self._unlabeled().set(value)
+
+    def inc(self, amount=1):
+        self._unlabeled().inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabeled().dec(amount)
+
+    @property
+    def value(self):
+        return self._unlabeled().value
+
+
+class _HistogramValue:
+    def __init__(self, lock, buckets):
+        self.__lock = lock
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        with self.__lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield '_bucket', [('le', _format(float(bound)))], cumulative
+        yield '_sum', [], self.sum
+        yield '_count', [], self.count
+
+
+class Histogram(Metric):
+    """
+    Distribution of observed values (e.g. durations in seconds) in cumulative buckets.
+    """
+
+    TYPE = 'histogram'
+    DEFAULT_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY, buckets=DEFAULT_BUCKETS):
+        """
+        :param buckets: upper bounds of the buckets, increasing -- the +Inf bucket is added at the end
+        """
+        if list(buckets) != sorted(buckets):
+            raise ValueError("buckets must be sorted")
+        self.buckets = tuple(buckets) + (float('inf'),)
+        super(Histogram, self).__init__(name, documentation, labelnames, registry)
+
+    def _new_value(self):
+        return _HistogramValue(self._lock, self.buckets)
+
+    def observe(self, value):
+        self._unlabeled().observe(value)
+
+    @property
+    def count(self):
+        return self._unlabeled().count
+
+    @property
+    def sum(self):
+        return self._unlabeled().sum
+
+
+def timed(histogram):
+    """
+    Decorator observing the duration of every call of the function in the histogram, when metrics are enabled.
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+# Metrics of the node
+
+DATABASE_READS = Counter('pmpi_database_reads', "Reads of the database.", ['database'])
+DATABASE_WRITES = Counter('pmpi_database_writes', "Writes to the database.", ['database'])
+DATABASE_DELETES = Counter('pmpi_database_deletes', "Deletions from the database.", ['database'])
+BLOOM_FILTER_SKIPS = Counter('pmpi_bloom_filter_skips', "Lookups of missing keys answered by the bloom filters.",
+                             ['database'])
+
+SIGNATURE_VERIFICATIONS = Counter('pmpi_signature_verifications', "ECDSA signature verifications.", ['type'])
+SIGNATURE_FAILURES = Counter('pmpi_signature_failures', "Signatures found wrong.", ['type'])
+DOUBLE_SHA = Counter('pmpi_double_sha', "Calls of double_sha.")
+
+BLOCK_MINE_SECONDS = Histogram('pmpi_block_mine_seconds', "Time of mining a block.",
+                               buckets=(.01, .1, 1, 10, 60, 600))
+BLOCK_VERIFY_SECONDS = Histogram('pmpi_block_verify_seconds', "Time of verifying a block.")
+BLOCK_PUT_SECONDS = Histogram('pmpi_block_put_seconds', "Time of putting a block into the database.")
+UPDATE_BLOCKS_SECONDS = Histogram('pmpi_update_blocks_seconds', "Time of BlockChain.update_blocks.")
+
+BLOCKS_ACCEPTED = Counter('pmpi_blocks_accepted', "Blocks put into the blockchain.")
+BLOCKS_REJECTED = Counter('pmpi_blocks_rejected', "Blocks failing the validation.")
+REORG_DEPTH = Histogram('pmpi_reorg_depth', "Number of blocks disconnected from the main chain by a change of the head.",
+                        buckets=(1, 2, 3, 5, 10, 20, 50, 100))
+HEAD_DEPTH = Gauge('pmpi_head_depth', "Depth of the head of the main chain.")
+
+
+# HTTP endpoint
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+
+        body = self.registry.exposition().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    # http.server.ThreadingHTTPServer is available since Python 3.7 only
+    daemon_threads = True
+
+
+def start_http_server(port, address='127.0.0.1', registry=REGISTRY):
+    """
+    Enable the metrics and serve them at http://address:port/metrics, from a daemon thread.
+
+    :return: the server -- call shutdown() and server_close() to stop it
+    """
+    handler = type('MetricsHandler', (MetricsHandler,), {'registry': registry})
+    server = ThreadingHTTPServer((address, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    enable()
+    return server
@@ -0,0 +1,67 @@
+import asyncio
+
+try:
+    coroutine = asyncio.coroutine
+except AttributeError:  # asyncio.coroutine was removed in Python 3.11
+    from types import coroutine
+
+from pmpi.block import Block, find_padding, MAX_PADDING
+
+
+class Miner:
+    """
+    Mines blocks in an executor, without blocking the event loop.
+
+    The padding space is searched in chunks -- one executor call per chunk -- so the mining task can be cancelled
+    between chunks, e.g. when a new head arrives and the mined block becomes stale. Pass a ProcessPoolExecutor to mine
+    in parallel with the event loop thread; by default the loop's default executor is used.
+    """
+
+    DEFAULT_CHUNK_SIZE = 1 << 14
+
+    def __init__(self, executor=None, chunk_size=DEFAULT_CHUNK_SIZE, loop=None):
+        self.executor = executor
+        self.chunk_size = chunk_size
+        self.loop = loop
+        self.__task = None
+
+    @coroutine
+    def mine(self, block):
+        """
+        :return: the block, mined
+        :raise Block.MiningError: when no padding satisfies the difficulty
+        """
+        loop = self.loop if self.loop is not None else asyncio.get_event_loop()
+        unmined_raw = block.unmined_raw()
+
+        for start in range(0, MAX_PADDING, self.chunk_size):
+            stop = min(start + self.chunk_size, MAX_PADDING)
+            padding = yield from loop.run_in_executor(self.executor, find_padding, unmined_raw, block.difficulty,
+                                                      start, stop)
+            if padding is not None:
+                block.apply_padding(padding)
+                return block
+
+        raise Block.MiningError("no padding satisfies the difficulty")
+
+    @property
+    def task(self):
+        return self.__task
+
+    def is_mining(self):
+        return self.__task is not None and not self.__task.done()
+
+    def start(self, block):
+        """
+        Cancel the current mining task (if any) and start mining the given block.
+
+        :return: task resulting with the mined block
+        """
+        self.cancel()
+        self.__task = asyncio.ensure_future(self.mine(block), loop=self.loop)
+        return self.__task
+
+    def cancel(self):
+        if self.is_mining():
+            self.__task.cancel()
+        self.__task = None
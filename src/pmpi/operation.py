@@ -3,15 +3,20 @@ from uuid import UUID, uuid5
 import binascii
 
 import pmpi.database
-from pmpi.exceptions import RawFormatError
+from pmpi.exceptions import ObjectDoesNotExist, RawFormatError
+from pmpi.packed_ids import PackedIds
 from pmpi.utils import read_bytes, read_uint32, read_string, read_sized_bytes
 from pmpi.public_key import PublicKey
 import pmpi.abstract
 import pmpi.block
 import pmpi.core
+import pmpi.identifier
+import pmpi.tracing
 
 
 class OperationRev(pmpi.abstract.AbstractRevision):
+    __slots__ = ()
+
     def _get_obj_from_database(self):
         return Operation.get(self.id)
 
@@ -22,34 +27,36 @@ class Operation(pmpi.abstract.AbstractSignedObject):
     :type __uuid: UUID
     :type __address: str
     :type __owners: tuple[PublicKey]
+    :type __owners_der: NoneType | tuple[bytes]
+    :type __owners_verifying_keys: NoneType | tuple[VerifyingKey]
     """
 
+    __slots__ = ('__previous_operation_rev', '__uuid', '__address', '__owners', '__owners_der',
+                 '__owners_verifying_keys')
+
     VERSION = 1
     PMPI_UUID = UUID('b230748e-bcee-4c3b-ba6a-5a25485b5de5')
     # TODO add generating uuids based on the address
     # TODO (and maybe sth else, but it must be str due the requirements of the uuid5() function)...
 
-    __previous_operation_rev = None
-    __uuid = None
-    __address = None
-    __owners = None
-
     def __init__(self, previous_operation_rev, address, owners):
         """
         :type owners: tuple[PublicKey] | list[PublicKey]
         """
+        super(Operation, self).__init__()
 
         self.__previous_operation_rev = previous_operation_rev
         self.__address = address
         self.__owners = tuple(owners)
-
-        self.__containing_blocks = tuple()
+        self.__owners_der = None
+        self.__owners_verifying_keys = None
         self.__uuid = self.generate_uuid()
 
     @classmethod
     def from_owners_der(cls, previous_operation_rev, uuid, address, owners_der):
         op = cls._construct_with_uuid(previous_operation_rev, uuid, address, [])
-        op.__owners = tuple(PublicKey(der) for der in owners_der)
+        op.__owners_der = tuple(owners_der)
+        op.__owners = tuple(PublicKey(der) for der in op.__owners_der)
         return op
 
     @classmethod
@@ -79,35 +86,52 @@ class Operation(pmpi.abstract.AbstractSignedObject):
 
     @property
     def owners_der(self):
-        return tuple(owner.der for owner in self.owners)
+        # owners never change after the construction -- derived tuples are built once
+        if self.__owners_der is None:
+            self.__owners_der = tuple(owner.der for owner in self.__owners)
+        return self.__owners_der
 
     @property
     def owners_verifying_keys(self):
-        return tuple(owner.verifying_key for owner in self.owners)
+        if self.__owners_verifying_keys is None:
+            self.__owners_verifying_keys = tuple(owner.verifying_key for owner in self.__owners)
+        return self.__owners_verifying_keys
 
     @property
     def containing_blocks(self):
-        return self.__containing_blocks
+        return self.get_containing_blocks(self.id)
+
+    @classmethod
+    @pmpi.core.with_database
+    def get_containing_blocks(cls, database, operation_id):
+        """
+        :param database: provided by database_required decorator
+        :return: ids of the blocks containing the operation with given id
+        """
+        return PackedIds(key[32:] for key, _ in
+                         database.prefix_items(pmpi.database.Database.OPERATIONS_BLOCKS, operation_id))
 
-    def __add_containing_block(self, block_rev):
+    def __verify_containing_block(self, block_rev):
         if pmpi.block.Block.exist(block_rev.id):
             if self.id not in block_rev.obj.operations_ids:
                 raise self.DoesNotExist("block doesn't contain requested operation")
-
-            if block_rev.id not in self.containing_blocks:
-                self.__containing_blocks += (block_rev.id,)
         else:
             raise pmpi.block.Block.DoesNotExist
 
-    def __remove_containing_block(self, block_rev):
+    @pmpi.core.with_database
+    def __add_containing_block(self, database, block_rev):
+        database.put(pmpi.database.Database.OPERATIONS_BLOCKS, self.id + block_rev.id, b'')
+
+    @pmpi.core.with_database
+    def __remove_containing_block(self, database, block_rev):
         if pmpi.block.Block.exist(block_rev.id) and block_rev.obj.is_in_database():
             raise pmpi.block.Block.ChainError("block isn't removed from the database")
 
-        if block_rev.id not in self.containing_blocks:
+        try:
+            database.delete(pmpi.database.Database.OPERATIONS_BLOCKS, self.id + block_rev.id)
+        except ObjectDoesNotExist:
             raise pmpi.block.Block.DoesNotExist("block isn't listed on containing blocks list")
 
-        self.__containing_blocks = tuple(bl for bl in self.containing_blocks if bl != block_rev.id)
-
     def generate_uuid(self):
         if self.previous_operation_rev.is_none():
             return uuid5(self.PMPI_UUID, self.address + binascii.hexlify(b''.join(self.owners_der)).decode())
@@ -154,12 +178,6 @@ class Operation(pmpi.abstract.AbstractSignedObject):
         ret += b''.join([len(owner).to_bytes(4, 'big') + owner for owner in self.owners_der])
         return ret
 
-    def _database_raw(self):
-        raw = self.raw()
-        ret = len(raw).to_bytes(4, 'big') + raw
-        ret += len(self.containing_blocks).to_bytes(4, 'big') + b''.join(self.containing_blocks)
-        return ret
-
     @classmethod
     def _from_raw_without_verifying(cls, raw):
         buffer = BytesIO(raw)
@@ -184,13 +202,6 @@ class Operation(pmpi.abstract.AbstractSignedObject):
         operation.sign(PublicKey(public_key_der), signature)
         return operation
 
-    @classmethod
-    def _from_database_raw(cls, raw):
-        buffer = BytesIO(raw)
-        operation = cls._from_raw_without_verifying(read_sized_bytes(buffer))
-        operation.__containing_blocks = tuple(read_bytes(buffer, 32) for _ in range(read_uint32(buffer)))
-        return operation
-
     # Verification
 
     def verify_uuid(self):
@@ -221,10 +232,14 @@ class Operation(pmpi.abstract.AbstractSignedObject):
 
         return True
 
+    @pmpi.tracing.traced('Operation.put_verify', lambda op: {'operation_id': pmpi.tracing.hexlify(op.id),
+                                                             'minting': op.previous_operation_rev.is_none()})
     def put_verify(self):
         if self.previous_operation_rev.is_none():  # it's a minting operation
-            for rev in Operation.get_ids_list():
-                if rev != self.id and Operation.get(rev).uuid == self.uuid:
+            # every block containing operations on the uuid has its history entry -- the ones of the block being put are
+            # recorded before its operations, so they are checked against the database
+            for _, _, operation_id in pmpi.identifier.Identifier.get_history(self.uuid):
+                if operation_id != self.id and Operation.exist(operation_id):
                     raise self.VerifyError("trying to create a minting operation for an existing uuid")
         else:
             try:
@@ -238,27 +253,45 @@ class Operation(pmpi.abstract.AbstractSignedObject):
 
     # Database operations
 
+    @classmethod
+    @pmpi.core.with_database
+    def upgrade_records(cls, database):
+        """
+        Upgrade the records written when the ids of the containing blocks were kept inside the record of the operation
+        (length-prefixed raw operation, followed by the ids) -- the ids are moved to OPERATIONS_BLOCKS.
+
+        :param database: provided by database_required decorator
+        """
+        for operation_id in database.keys(pmpi.database.Database.OPERATIONS):
+            buffer = BytesIO(database.get(pmpi.database.Database.OPERATIONS, operation_id))
+            if read_uint32(buffer) == cls.VERSION:
+                continue  # upgraded already -- a length of raw operation is never equal to the version number
+
+            buffer.seek(0)
+            raw = read_sized_bytes(buffer)
+            for _ in range(read_uint32(buffer)):
+                database.put(pmpi.database.Database.OPERATIONS_BLOCKS, operation_id + read_bytes(buffer, 32), b'')
+            database.put(pmpi.database.Database.OPERATIONS, operation_id, raw)
+
     @classmethod
     def _get_dbname(cls):
         return pmpi.database.Database.OPERATIONS
 
-    def is_in_database(self):
-        if super(Operation, self).is_in_database():
-            db_operation = self.get(self.id)
-            return db_operation.containing_blocks == self.containing_blocks
-        else:
-            return False
-
+    @pmpi.tracing.traced('Operation.put', lambda op, block_rev: {'operation_id': pmpi.tracing.hexlify(op.id),
+                                                                 'block_id': pmpi.tracing.hexlify(block_rev.id)})
     def put(self, block_rev):
         """
-        Put the operation as contained by a given block_rev.
+        Put the operation as contained by a given block_rev. The operation record itself is written only once -- when
+        another block contains the operation already, only the membership is added.
         """
-        self.__add_containing_block(block_rev)
-        try:
+        self.__verify_containing_block(block_rev)
+
+        if not self.is_in_database():
             super(Operation, self).put()
-        except Exception:
-            self.__remove_containing_block(block_rev)
-            raise
+        elif block_rev.id in self.containing_blocks:
+            raise self.DuplicationError("operation is already contained by the block")
+
+        self.__add_containing_block(block_rev)
 
     def remove(self, block_rev):
         # When the containing_blocks tuple is cleared, we can remove operation. We don't need to check if there are any
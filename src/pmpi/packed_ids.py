@@ -0,0 +1,103 @@
+class PackedIds:
+    """
+    Immutable sequence of 32-byte ids kept in one contiguous buffer -- a compact replacement for tuples of separate bytes
+    objects (e.g. Block.operations_ids), serialised without copying. Membership tests and index() scan the buffer, so
+    callers testing many ids build a set (or a dict of positions) of the ids instead.
+
+    PackedIds compare equal to tuples and lists of the same ids, and hash as the tuples.
+    """
+
+    SIZE = 32
+
+    __slots__ = ('__buffer',)
+
+    def __init__(self, ids=()):
+        """
+        :param ids: iterable of 32-byte ids
+        """
+        ids = tuple(ids)
+        for obj_id in ids:
+            if not isinstance(obj_id, bytes) or len(obj_id) != self.SIZE:
+                raise ValueError("ids must be {}-byte bytes objects".format(self.SIZE))
+        self.__buffer = b''.join(ids)
+
+    @classmethod
+    def from_raw(cls, raw):
+        """
+        :param raw: concatenated ids (bytes -- kept as the buffer without copying)
+        """
+        if len(raw) % cls.SIZE != 0:
+            raise ValueError("raw ids length is not a multiple of {}".format(cls.SIZE))
+        packed_ids = cls()
+        packed_ids.__buffer = bytes(raw)
+        return packed_ids
+
+    def raw(self):
+        """
+        :return: concatenated ids
+        """
+        return self.__buffer
+
+    # Sequence
+
+    def __len__(self):
+        return len(self.__buffer) // self.SIZE
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return PackedIds(self[i] for i in range(*item.indices(len(self))))
+
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("PackedIds index out of range")
+        return self.__buffer[item * self.SIZE:(item + 1) * self.SIZE]
+
+    def __iter__(self):
+        buffer = self.__buffer
+        for offset in range(0, len(buffer), self.SIZE):
+            yield buffer[offset:offset + self.SIZE]
+
+    def __add__(self, other):
+        if not isinstance(other, PackedIds):
+            other = PackedIds(other)
+        return PackedIds.from_raw(self.__buffer + other.__buffer)
+
+    def __eq__(self, other):
+        if isinstance(other, PackedIds):
+            return self.__buffer == other.__buffer
+        if isinstance(other, (tuple, list)):
+            return len(other) == len(self) and all(isinstance(obj_id, bytes) for obj_id in other) \
+                and b''.join(other) == self.__buffer
+        return NotImplemented
+
+    def __hash__(self):
+        # equal to the tuples of the same ids -- so it has to hash as them
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return 'PackedIds({!r})'.format(tuple(self))
+
+    # Membership
+
+    def __contains__(self, obj_id):
+        return self.__find(obj_id) is not None
+
+    def index(self, obj_id):
+        """
+        :return: position of the first occurrence of the id
+        :raise ValueError: when the id is missing
+        """
+        position = self.__find(obj_id)
+        if position is None:
+            raise ValueError("id is not in PackedIds")
+        return position
+
+    def __find(self, obj_id):
+        if not isinstance(obj_id, bytes) or len(obj_id) != self.SIZE:
+            return None
+        buffer = self.__buffer
+        offset = buffer.find(obj_id)
+        while offset >= 0 and offset % self.SIZE != 0:
+            offset = buffer.find(obj_id, offset + 1)
+        return offset // self.SIZE if offset >= 0 else None
@@ -0,0 +1,191 @@
+import cProfile
+from collections import deque
+import io
+import pstats
+import sys
+import time
+import tracemalloc
+
+
+class Profiler:
+    """
+    cProfile of a running node -- started and stopped at any moment, e.g. from the console. Only the thread which started
+    the profiler (i.e. the one running the event loop) is profiled.
+    """
+
+    SORT_KEYS = ('cumulative', 'tottime', 'ncalls', 'filename')
+    DEFAULT_LIMIT = 30
+
+    def __init__(self):
+        self.__profile = None
+        self.__started_at = None
+
+    def is_running(self):
+        return self.__profile is not None
+
+    def start(self):
+        if self.is_running():
+            raise self.ProfilerError("profiler is already running")
+
+        self.__profile = cProfile.Profile()
+        self.__started_at = time.time()
+        self.__profile.enable()
+
+    def stop(self, sort='cumulative', limit=DEFAULT_LIMIT, filename=None):
+        """
+        :param sort: one of SORT_KEYS
+        :param filename: file for the raw stats (readable with pstats or snakeviz), or None
+        :return: report of the functions taking the most time
+        """
+        if not self.is_running():
+            raise self.ProfilerError("profiler is not running")
+        if sort not in self.SORT_KEYS:
+            raise self.ProfilerError("unknown sort key -- use one of: {}".format(', '.join(self.SORT_KEYS)))
+
+        self.__profile.disable()
+        profile, self.__profile = self.__profile, None
+
+        if filename is not None:
+            profile.dump_stats(filename)
+
+        output = io.StringIO()
+        output.write("Profiled for {:.1f} s.\n".format(time.time() - self.__started_at))
+        pstats.Stats(profile, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+        return output.getvalue()
+
+    class ProfilerError(Exception):
+        pass
+
+
+class MemoryTracer:
+    """
+    Snapshots of memory allocations (tracemalloc), compared with the previous snapshot to find what keeps growing.
+    Tracing slows the allocations down -- stop it when done.
+    """
+
+    DEFAULT_LIMIT = 20
+
+    def __init__(self):
+        self.__snapshot = None
+
+    @staticmethod
+    def is_running():
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=1):
+        """
+        :param frames: number of frames of every allocation traceback
+        """
+        if self.is_running():
+            raise self.TracerError("memory tracing is already running")
+        tracemalloc.start(frames)
+        self.__snapshot = None
+
+    def stop(self):
+        if not self.is_running():
+            raise self.TracerError("memory tracing is not running")
+        tracemalloc.stop()
+        self.__snapshot = None
+
+    def __take_snapshot(self):
+        if not self.is_running():
+            raise self.TracerError("memory tracing is not running")
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ))
+
+    def snapshot(self, limit=DEFAULT_LIMIT):
+        """
+        Take a snapshot -- the base of the following diff().
+
+        :return: report of the lines which allocated the most of the memory still in use
+        """
+        self.__snapshot = self.__take_snapshot()
+        statistics = self.__snapshot.statistics('lineno')
+
+        current, peak = tracemalloc.get_traced_memory()
+        lines = ["Traced memory: {} (peak {}).".format(format_size(current), format_size(peak))]
+        lines += [str(statistic) for statistic in statistics[:limit]]
+        return '\n'.join(lines)
+
+    def diff(self, limit=DEFAULT_LIMIT):
+        """
+        Take a snapshot and compare it with the previous one -- it becomes the base of the next diff().
+
+        :return: report of the lines which allocations changed the most
+        """
+        if self.__snapshot is None:
+            raise self.TracerError("take a snapshot first")
+
+        snapshot = self.__take_snapshot()
+        statistics = snapshot.compare_to(self.__snapshot, 'lineno')
+        self.__snapshot = snapshot
+
+        total = sum(statistic.size_diff for statistic in statistics)
+        lines = ["Change of traced memory: {}{}.".format('+' if total >= 0 else '-', format_size(abs(total)))]
+        lines += [str(statistic) for statistic in statistics[:limit]]
+        return '\n'.join(lines)
+
+    class TracerError(Exception):
+        pass
+
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if size < 1024:
+            return '{:.1f} {}'.format(size, unit) if unit != 'B' else '{} B'.format(size)
+        size /= 1024
+    return '{:.1f} GiB'.format(size)
+
+
+def deep_sizeof(obj):
+    """
+    :return: size in bytes of the object together with all the objects reachable from it through containers and
+        attributes; objects shared by many structures are counted in each of them. Classes, modules and functions
+        are not followed.
+    """
+    seen = set()
+    stack = [obj]
+    size = 0
+
+    while len(stack) > 0:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, type(sys), type(deep_sizeof))):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+            stack.extend(obj)
+
+        if hasattr(obj, '__dict__'):
+            stack.append(obj.__dict__)
+        for cls in type(obj).__mro__:
+            slots = getattr(cls, '__slots__', ())
+            for name in (slots,) if isinstance(slots, str) else slots:
+                if name.startswith('__') and not name.endswith('__'):
+                    name = '_' + cls.__name__.lstrip('_') + name  # name mangling
+                if hasattr(obj, name):
+                    stack.append(getattr(obj, name))
+
+    return size
+
+
+def structure_sizes(structures):
+    """
+    :param structures: dictionary of names and in-memory structures (e.g. BlockChain.structures())
+    :return: list of (name, number of elements, size in bytes) tuples, the largest structures first
+    """
+    sizes = []
+    for name, structure in structures.items():
+        try:
+            length = len(structure)
+        except TypeError:
+            length = None
+        sizes.append((name, length, deep_sizeof(structure)))
+    sizes.sort(key=lambda item: item[2], reverse=True)
+    return sizes
@@ -0,0 +1,140 @@
+from io import BytesIO
+
+from pmpi.exceptions import RawFormatError
+from pmpi.utils import double_sha, read_bytes, read_uint32, read_sized_bytes
+
+PROTOCOL_VERSION = 1
+
+HELLO = b'HI'
+OPERATION = b'OP'
+BLOCK = b'BL'
+COMPACT_BLOCK = b'CB'
+GET_OPERATIONS = b'GO'
+MESSAGE_TYPES = {HELLO, OPERATION, BLOCK, COMPACT_BLOCK, GET_OPERATIONS}
+
+# frame header: protocol version (1 byte), message type (2 bytes), payload length (4 bytes)
+HEADER_SIZE = 7
+MAX_PAYLOAD_SIZE = 32 * 1024 * 1024
+
+
+def encode_frame(message_type, payload):
+    """
+    :type message_type: bytes
+    :type payload: bytes
+    :return: message framed for the node protocol
+    """
+    if message_type not in MESSAGE_TYPES:
+        raise FrameDecoder.FrameError("unknown message type")
+    if len(payload) > MAX_PAYLOAD_SIZE:
+        raise FrameDecoder.FrameError("payload too long")
+
+    return PROTOCOL_VERSION.to_bytes(1, 'big') + message_type + len(payload).to_bytes(4, 'big') + payload
+
+
+def encode_frames(messages):
+    """
+    :param messages: iterable of (message_type, payload) pairs
+    :return: all the messages framed and joined into one batch
+    """
+    return b''.join(encode_frame(message_type, payload) for message_type, payload in messages)
+
+
+def encode_ids(ids):
+    """
+    :return: payload of GET_OPERATIONS message requesting objects with given ids
+    """
+    return len(ids).to_bytes(4, 'big') + b''.join(ids)
+
+
+def decode_ids(payload):
+    buffer = BytesIO(payload)
+    ids = [read_bytes(buffer, 32) for _ in range(read_uint32(buffer))]
+    if len(buffer.read()) > 0:
+        raise RawFormatError("raw input too long")
+    return ids
+
+
+def message_object_id(message_type, payload):
+    """
+    :return: id of the object carried by an OPERATION, BLOCK or COMPACT_BLOCK message -- the id of the operation or
+        of the block (the same for a block and its compact block)
+    """
+    if message_type == BLOCK:
+        # raw operations followed by the raw block (see Block.raw_with_operations)
+        buffer = BytesIO(payload)
+        try:
+            for _ in range(read_uint32(buffer)):
+                read_sized_bytes(buffer)
+        except RawFormatError:
+            return double_sha(payload)  # malformed -- rejected by the receivers anyway
+        return double_sha(buffer.read())
+
+    return double_sha(payload)
+
+
+def decode_frames(data):
+    """
+    Decode a complete batch of frames.
+
+    :return: list of (message_type, payload) pairs
+    :raise FrameDecoder.FrameError: when the batch ends with an incomplete frame
+    """
+    decoder = FrameDecoder()
+    messages = decoder.feed(data)
+    if decoder.buffered_size > 0:
+        raise FrameDecoder.FrameError("incomplete frame at the end of the batch")
+    return messages
+
+
+class FrameDecoder:
+    """
+    Incremental decoder of the framed stream. Partial frames are buffered until the rest of them arrives.
+
+    Every payload is copied out of the receive buffer exactly once, into an immutable bytes object, which can be passed
+    straight to Operation.from_raw or Block.from_raw_with_operations (BytesIO wraps bytes without copying them).
+    """
+
+    def __init__(self, max_payload_size=MAX_PAYLOAD_SIZE):
+        self.__buffer = bytearray()
+        self.__max_payload_size = max_payload_size
+
+    @property
+    def buffered_size(self):
+        return len(self.__buffer)
+
+    def feed(self, data):
+        """
+        :type data: bytes
+        :return: list of (message_type, payload) pairs of all the frames completed by data
+        :raise self.FrameError: on malformed frame header
+        """
+        self.__buffer += data
+
+        messages = []
+        position = 0
+
+        with memoryview(self.__buffer) as view:
+            while len(view) - position >= HEADER_SIZE:
+                if view[position] != PROTOCOL_VERSION:
+                    raise self.FrameError("protocol version mismatch")
+
+                message_type = bytes(view[position + 1:position + 3])
+                if message_type not in MESSAGE_TYPES:
+                    raise self.FrameError("unknown message type")
+
+                length = int.from_bytes(view[position + 3:position + HEADER_SIZE], 'big')
+                if length > self.__max_payload_size:
+                    raise self.FrameError("payload too long")
+
+                end = position + HEADER_SIZE + length
+                if end > len(view):
+                    break
+
+                messages.append((message_type, bytes(view[position + HEADER_SIZE:end])))
+                position = end
+
+        del self.__buffer[:position]
+        return messages
+
+    class FrameError(Exception):
+        pass
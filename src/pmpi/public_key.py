@@ -2,11 +2,11 @@ from ecdsa import VerifyingKey
 
 
 class PublicKey:
-    _der = None
-    _verifying_key = None
+    __slots__ = ('_der', '_verifying_key')
 
     def __init__(self, der):
         self._der = der
+        self._verifying_key = None
 
     @classmethod
     def from_verifying_key(cls, verifying_key):
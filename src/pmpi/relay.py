@@ -0,0 +1,227 @@
+import asyncio
+import binascii
+from collections import OrderedDict, deque
+import time
+
+from pmpi.exceptions import RawFormatError
+from pmpi.protocol import FrameDecoder, encode_frame, decode_ids, message_object_id, HELLO, OPERATION, BLOCK, \
+    COMPACT_BLOCK, GET_OPERATIONS
+
+
+class RelayPeer:
+    """
+    Connection of a single peer to the relay hub. Frames are written straight to the transport until it asks to pause
+    writing; then they wait in a bounded queue, flushed when the transport resumes writing.
+
+    :type key: bytes
+    """
+
+    def __init__(self, hub, transport, max_queue_size):
+        self.hub = hub
+        self.transport = transport
+        self.key = None
+        self.max_queue_size = max_queue_size
+
+        self.__queue = deque()
+        self.__queue_size = 0
+        self.__paused = False
+
+        self.connected_at = time.time()
+        self.messages_in = 0
+        self.bytes_in = 0
+        self.messages_out = 0
+        self.bytes_out = 0
+        self.messages_dropped = 0
+
+    @property
+    def name(self):
+        return binascii.hexlify(self.key)[-6:].decode() if self.key is not None else '?'
+
+    @property
+    def queue_size(self):
+        return self.__queue_size
+
+    def write(self, frame):
+        """
+        :return: False when the peer is too slow and the frame has been dropped
+        """
+        if not self.__paused:
+            self.__send(frame)
+            return True
+
+        if self.__queue_size + len(frame) > self.max_queue_size:
+            self.messages_dropped += 1
+            return False
+
+        self.__queue.append(frame)
+        self.__queue_size += len(frame)
+        return True
+
+    def __send(self, frame):
+        self.transport.write(frame)
+        self.messages_out += 1
+        self.bytes_out += len(frame)
+
+    def pause_writing(self):
+        self.__paused = True
+
+    def resume_writing(self):
+        self.__paused = False
+        while len(self.__queue) > 0 and not self.__paused:
+            frame = self.__queue.popleft()
+            self.__queue_size -= len(frame)
+            self.__send(frame)
+
+    def stats(self):
+        elapsed = max(time.time() - self.connected_at, 1e-9)
+        return {
+            'messages_in': self.messages_in,
+            'bytes_in': self.bytes_in,
+            'messages_out': self.messages_out,
+            'bytes_out': self.bytes_out,
+            'messages_dropped': self.messages_dropped,
+            'queue_size': self.__queue_size,
+            'bytes_in_per_second': self.bytes_in / elapsed,
+            'bytes_out_per_second': self.bytes_out / elapsed,
+        }
+
+
+class RelayHub:
+    """
+    Relays messages between the connected peers. Every object (operation or block) is relayed only once, and never back
+    to the peer it came from. Operations requested with GET_OPERATIONS are sent to the requesting peers even if they
+    have been relayed before. Peers which can't keep up -- their queue is full -- are disconnected.
+    """
+
+    DEFAULT_MAX_QUEUE_SIZE = 16 * 1024 * 1024
+    DEFAULT_MAX_SEEN = 100000
+
+    # messages carrying objects -- relayed only once
+    OBJECT_MESSAGE_TYPES = {OPERATION, BLOCK, COMPACT_BLOCK}
+
+    def __init__(self, max_queue_size=DEFAULT_MAX_QUEUE_SIZE, max_seen=DEFAULT_MAX_SEEN):
+        self.max_queue_size = max_queue_size
+        self.max_seen = max_seen
+
+        self.peers = {}
+        self.__seen = OrderedDict()
+        self.__requests = OrderedDict()  # id of the requested operation -> list of the requesting peers
+
+    def create_peer(self, transport):
+        return RelayPeer(self, transport, self.max_queue_size)
+
+    def add_peer(self, peer):
+        self.peers[peer.key] = peer
+
+    def remove_peer(self, peer):
+        if self.peers.get(peer.key) is peer:
+            del self.peers[peer.key]
+
+    def disconnect(self, peer):
+        self.remove_peer(peer)
+        peer.transport.close()
+
+    def is_seen(self, object_id):
+        return object_id in self.__seen
+
+    def __mark_seen(self, object_id):
+        self.__seen[object_id] = None
+        if len(self.__seen) > self.max_seen:
+            self.__seen.popitem(last=False)
+
+    def __request(self, peer, payload):
+        try:
+            operations_ids = decode_ids(payload)
+        except RawFormatError:
+            return
+
+        for operation_id in operations_ids:
+            self.__requests.setdefault(operation_id, []).append(peer)
+            self.__requests.move_to_end(operation_id)
+        while len(self.__requests) > self.max_seen:
+            self.__requests.popitem(last=False)
+
+    def __write(self, peer, frame):
+        if peer.write(frame):
+            return True
+        self.disconnect(peer)
+        return False
+
+    def relay(self, origin, message_type, payload):
+        """
+        :return: number of peers the message has been sent to
+        """
+        frame = encode_frame(message_type, payload)
+        sent = 0
+        receivers = set()
+
+        if message_type == GET_OPERATIONS:
+            self.__request(origin, payload)
+
+        if message_type in self.OBJECT_MESSAGE_TYPES:
+            object_id = message_object_id(message_type, payload)
+
+            if message_type == OPERATION:
+                # replies to GET_OPERATIONS
+                for peer in self.__requests.pop(object_id, ()):
+                    if peer is not origin and peer not in receivers and self.peers.get(peer.key) is peer:
+                        receivers.add(peer)
+                        if self.__write(peer, frame):
+                            sent += 1
+
+            if object_id in self.__seen:
+                return sent
+            self.__mark_seen(object_id)
+
+        for peer in list(self.peers.values()):
+            if peer is origin or peer in receivers:
+                continue
+            if self.__write(peer, frame):
+                sent += 1
+        return sent
+
+    def stats(self):
+        return {peer.name: peer.stats() for peer in self.peers.values()}
+
+
+class RelayProtocol(asyncio.Protocol):
+    """
+    Server side of a peer's connection: the first frame (HELLO) carries the peer's public key, all the others are
+    relayed by the hub.
+    """
+
+    def __init__(self, hub):
+        self.hub = hub
+        self.peer = None
+        self.decoder = FrameDecoder()
+
+    def connection_made(self, transport):
+        self.peer = self.hub.create_peer(transport)
+
+    def data_received(self, data):
+        try:
+            messages = self.decoder.feed(data)
+        except FrameDecoder.FrameError:
+            self.hub.disconnect(self.peer)
+            return
+
+        self.peer.bytes_in += len(data)
+
+        for message_type, payload in messages:
+            self.peer.messages_in += 1
+
+            if self.peer.key is None:
+                if message_type == HELLO:
+                    self.peer.key = payload
+                    self.hub.add_peer(self.peer)
+            else:
+                self.hub.relay(self.peer, message_type, payload)
+
+    def pause_writing(self):
+        self.peer.pause_writing()
+
+    def resume_writing(self):
+        self.peer.resume_writing()
+
+    def connection_lost(self, exc):
+        self.hub.remove_peer(self.peer)
@@ -0,0 +1,193 @@
+import mmap
+import os
+
+# record: key length (2 bytes), data length (4 bytes), key, data
+RECORD_HEADER_SIZE = 6
+# data length of a record removing the key
+TOMBSTONE = 0xffffffff
+
+
+class SegmentStore:
+    """
+    Append-only store of immutable values (blocks and operations), kept in segment files of a directory.
+
+    Values are read through memory maps of the segment files -- get returns a memoryview into the file, nothing is
+    copied. Appends are buffered and written (and synced to the disk) in batches; values waiting in the buffer are
+    readable as well. The index, key -> (segment, offset, length) packed into a single int, is rebuilt by scanning the
+    record headers when the store is opened.
+
+    Provides the part of the bsddb3 DB interface used by Database, so it can replace a sub-database.
+    """
+
+    DEFAULT_SEGMENT_SIZE = 256 * 1024 * 1024
+    DEFAULT_FLUSH_SIZE = 4 * 1024 * 1024
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE, flush_size=DEFAULT_FLUSH_SIZE):
+        """
+        :param segment_size: size after which a new segment file is started
+        :param flush_size: size of buffered appends written to the disk at once
+        """
+        self.directory = directory
+        self.segment_size = segment_size
+        self.flush_size = flush_size
+
+        self.__index = {}
+        self.__maps = {}
+
+        self.__pending = {}
+        self.__buffer = bytearray()
+
+        os.makedirs(directory, exist_ok=True)
+        segments = sorted(int(name[:-4]) for name in os.listdir(directory) if name.endswith('.seg'))
+        for segment in segments:
+            self.__scan(segment, truncate=segment == segments[-1])
+
+        self.__segment = segments[-1] if len(segments) > 0 else 0
+        self.__size = self.__segment_file_size(self.__segment)
+
+    # Segment files
+
+    def __path(self, segment):
+        return os.path.join(self.directory, '{:08d}.seg'.format(segment))
+
+    def __segment_file_size(self, segment):
+        try:
+            return os.path.getsize(self.__path(segment))
+        except FileNotFoundError:
+            return 0
+
+    def __map(self, segment):
+        """
+        Map the segment file anew -- memoryviews returned earlier keep the previous maps alive.
+        """
+        if self.__segment_file_size(segment) > 0:
+            with open(self.__path(segment), 'rb') as f:
+                self.__maps[segment] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __scan(self, segment, truncate):
+        """
+        Index the records of the segment. A broken record at the end of the last segment (e.g. left by a crash during
+        writing) is cut off.
+        """
+        self.__map(segment)
+        if segment not in self.__maps:
+            return
+
+        view = self.__maps[segment]
+        position = 0
+        while position + RECORD_HEADER_SIZE <= len(view):
+            key_length = int.from_bytes(view[position:position + 2], 'big')
+            data_length = int.from_bytes(view[position + 2:position + RECORD_HEADER_SIZE], 'big')
+            key_end = position + RECORD_HEADER_SIZE + key_length
+            end = key_end + (data_length if data_length != TOMBSTONE else 0)
+            if end > len(view):
+                break
+
+            key = bytes(view[position + RECORD_HEADER_SIZE:key_end])
+            if data_length == TOMBSTONE:
+                self.__index.pop(key, None)
+            else:
+                self.__index[key] = self.__pack(segment, key_end, data_length)
+            position = end
+
+        if position < len(view):
+            if not truncate:
+                raise self.CorruptedSegmentError("broken record in the middle of the archive")
+            del self.__maps[segment]
+            view.close()
+            with open(self.__path(segment), 'r+b') as f:
+                f.truncate(position)
+            self.__map(segment)
+
+    @staticmethod
+    def __pack(segment, offset, length):
+        return segment << 64 | offset << 32 | length
+
+    @staticmethod
+    def __unpack(location):
+        return location >> 64, (location >> 32) & 0xffffffff, location & 0xffffffff
+
+    # Appends
+
+    def __append(self, key, data_length, data):
+        record_size = RECORD_HEADER_SIZE + len(key) + len(data)
+        if self.__size > 0 and self.__size + record_size > self.segment_size:
+            self.flush()
+            self.__segment += 1
+            self.__size = 0
+
+        self.__buffer += len(key).to_bytes(2, 'big') + data_length.to_bytes(4, 'big') + key
+        self.__buffer += data
+        self.__size += record_size
+
+        location = self.__pack(self.__segment, self.__size - len(data), len(data))
+        if len(self.__buffer) >= self.flush_size:
+            self.flush()
+        return location
+
+    def flush(self):
+        """
+        Write the buffered records to the current segment file and sync it to the disk.
+        """
+        if len(self.__buffer) == 0:
+            return
+
+        with open(self.__path(self.__segment), 'ab') as f:
+            f.write(self.__buffer)
+            f.flush()
+            os.fsync(f.fileno())
+
+        self.__buffer = bytearray()
+        self.__pending = {}
+        self.__map(self.__segment)
+
+    # DB interface
+
+    def __len__(self):
+        return len(self.__index)
+
+    def __contains__(self, key):
+        return key in self.__index
+
+    def keys(self):
+        return list(self.__index.keys())
+
+    def __getitem__(self, key):
+        """
+        :return: memoryview into the segment file (bytes for values not written to the disk yet)
+        """
+        location = self.__index[key]
+        if key in self.__pending:
+            return self.__pending[key]
+
+        segment, offset, length = self.__unpack(location)
+        return memoryview(self.__maps[segment])[offset:offset + length]
+
+    def get(self, key, default=None):
+        return self[key] if key in self.__index else default
+
+    def __setitem__(self, key, data):
+        data = bytes(data)
+        self.__index[key] = self.__append(key, len(data), data)
+        if len(self.__buffer) > 0:
+            self.__pending[key] = data
+
+    def put(self, key, data):
+        self[key] = data
+
+    def delete(self, key):
+        if key not in self.__index:
+            raise KeyError(key)
+        self.__append(key, TOMBSTONE, b'')
+        del self.__index[key]
+        self.__pending.pop(key, None)
+
+    def sync(self):
+        self.flush()
+
+    def close(self):
+        self.flush()
+        self.__maps = {}
+
+    class CorruptedSegmentError(Exception):
+        pass
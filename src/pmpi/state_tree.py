@@ -0,0 +1,239 @@
+from io import BytesIO
+from uuid import UUID
+
+from pmpi.exceptions import RawFormatError
+from pmpi.utils import double_sha, read_bytes, read_uint32
+
+
+KEY_BITS = 128
+EMPTY_HASH = bytes(32)
+
+
+def _leaf_hash(key, value):
+    return double_sha(b'\x00' + key + value)
+
+
+def _branch_hash(left_hash, right_hash):
+    return double_sha(b'\x01' + left_hash + right_hash)
+
+
+def _bit(key, depth):
+    return key[depth >> 3] >> (7 - (depth & 7)) & 1
+
+
+def _hash(node):
+    return EMPTY_HASH if node is None else node.hash
+
+
+class _Leaf:
+    __slots__ = ('key', 'value', 'hash')
+
+    def __init__(self, key, value):
+        self.key = key
+        self.value = value
+        self.hash = _leaf_hash(key, value)
+
+
+class _Branch:
+    __slots__ = ('children', 'hash')
+
+    def __init__(self):
+        self.children = [None, None]
+        self.hash = None  # set by rehash() once the children are in place
+
+    def rehash(self):
+        self.hash = _branch_hash(_hash(self.children[0]), _hash(self.children[1]))
+
+
+class StateTree:
+    """
+    Compacted sparse Merkle tree of the identifiers' state: uuid -> id of the operation the identifier points at.
+
+    The tree is a binary trie over the bits of uuids in which every subtree containing a single identifier is replaced
+    by its leaf -- so for random uuids the depth, the cost of updates and the size of proofs are logarithmic in the
+    number of identifiers. The shape of the tree depends only on its content, so does the root.
+    """
+
+    __slots__ = ('__root', '__size')
+
+    def __init__(self, items=()):
+        """
+        :param items: iterable of (UUID, operation id) pairs
+        """
+        self.__root = None
+        self.__size = 0
+        for uuid, operation_id in items:
+            self.set(uuid, operation_id)
+
+    def __len__(self):
+        return self.__size
+
+    @property
+    def root(self):
+        return _hash(self.__root)
+
+    def get(self, uuid):
+        """
+        :type uuid: UUID
+        :return: operation id of the identifier, or None if the identifier isn't in the tree
+        """
+        key = uuid.bytes
+        node, depth = self.__root, 0
+        while isinstance(node, _Branch):
+            node, depth = node.children[_bit(key, depth)], depth + 1
+        return node.value if node is not None and node.key == key else None
+
+    def set(self, uuid, operation_id):
+        """
+        :type uuid: UUID
+        :param operation_id: 32-byte id of the operation
+        """
+        self.__root = self.__set(self.__root, 0, uuid.bytes, operation_id)
+
+    def __set(self, node, depth, key, value):
+        if node is None:
+            self.__size += 1
+            return _Leaf(key, value)
+
+        if isinstance(node, _Leaf):
+            if node.key == key:
+                return _Leaf(key, value)
+            # split the leaf down to the first bit differing the keys
+            branch = _Branch()
+            branch.children[_bit(node.key, depth)] = node
+            branch.children[_bit(key, depth)] = self.__set(branch.children[_bit(key, depth)], depth + 1, key, value)
+            branch.rehash()
+            return branch
+
+        side = _bit(key, depth)
+        node.children[side] = self.__set(node.children[side], depth + 1, key, value)
+        node.rehash()
+        return node
+
+    def remove(self, uuid):
+        """
+        :type uuid: UUID
+        :raise KeyError: when the identifier isn't in the tree
+        """
+        self.__root = self.__remove(self.__root, 0, uuid.bytes)
+
+    def __remove(self, node, depth, key):
+        if node is None or (isinstance(node, _Leaf) and node.key != key):
+            raise KeyError("uuid is not in the state tree")
+
+        if isinstance(node, _Leaf):
+            self.__size -= 1
+            return None
+
+        side = _bit(key, depth)
+        node.children[side] = self.__remove(node.children[side], depth + 1, key)
+
+        # a branch left with a single leaf is replaced by that leaf
+        left, right = node.children
+        if left is None and (right is None or isinstance(right, _Leaf)):
+            return right
+        if right is None and isinstance(left, _Leaf):
+            return left
+
+        node.rehash()
+        return node
+
+    def proof(self, uuid):
+        """
+        :type uuid: UUID
+        :return: StateProof of the value of the identifier (or of its absence) as of the current root
+        """
+        key = uuid.bytes
+        siblings = []
+        node, depth = self.__root, 0
+        while isinstance(node, _Branch):
+            side = _bit(key, depth)
+            siblings.append(_hash(node.children[1 - side]))
+            node, depth = node.children[side], depth + 1
+
+        leaf = (UUID(bytes=node.key), node.value) if node is not None else None
+        return StateProof(uuid, leaf, siblings)
+
+
+class StateProof:
+    """
+    Proof of the value of an identifier in a StateTree with a given root -- the siblings on the path from the root to
+    the subtree of the identifier, and the leaf found there: the identifier's own leaf, another identifier's leaf or
+    None (the last two prove that the identifier doesn't exist).
+
+    :type uuid: UUID
+    :type leaf: NoneType | (UUID, bytes)
+    :type siblings: tuple[bytes]
+    """
+
+    __slots__ = ('uuid', 'leaf', 'siblings')
+
+    def __init__(self, uuid, leaf, siblings):
+        self.uuid = uuid
+        self.leaf = leaf
+        self.siblings = tuple(siblings)
+
+    def __eq__(self, other):
+        return isinstance(other, StateProof) and \
+            (self.uuid, self.leaf, self.siblings) == (other.uuid, other.leaf, other.siblings)
+
+    @property
+    def operation_id(self):
+        """
+        :return: operation id the identifier points at according to the proof, or None if it doesn't exist
+        """
+        return self.leaf[1] if self.leaf is not None and self.leaf[0] == self.uuid else None
+
+    def verify(self, root, operation_id):
+        """
+        :param root: StateTree root, e.g. BlockChain.state_root of a trusted node
+        :param operation_id: resolution to check -- id of the operation, or None for a missing identifier
+        :return: True if the identifier points at the given operation in the tree with given root
+        """
+        key = self.uuid.bytes
+        depth = len(self.siblings)
+        if depth > KEY_BITS or operation_id != self.operation_id:
+            return False
+
+        if self.leaf is None:
+            node_hash = EMPTY_HASH
+        else:
+            leaf_key = self.leaf[0].bytes
+            if any(_bit(leaf_key, i) != _bit(key, i) for i in range(depth)):
+                return False  # the leaf is not in the subtree of the identifier
+            node_hash = _leaf_hash(leaf_key, self.leaf[1])
+
+        for i in reversed(range(depth)):
+            if _bit(key, i) == 0:
+                node_hash = _branch_hash(node_hash, self.siblings[i])
+            else:
+                node_hash = _branch_hash(self.siblings[i], node_hash)
+
+        return node_hash == root
+
+    # Serialization and deserialization
+
+    def raw(self):
+        ret = self.uuid.bytes
+        if self.leaf is None:
+            ret += (0).to_bytes(4, 'big')
+        else:
+            ret += (1).to_bytes(4, 'big') + self.leaf[0].bytes + self.leaf[1]
+        ret += len(self.siblings).to_bytes(4, 'big')
+        ret += b''.join(self.siblings)
+        return ret
+
+    @classmethod
+    def from_raw(cls, raw):
+        buffer = BytesIO(raw)
+
+        uuid = UUID(bytes=read_bytes(buffer, 16))
+        leaf = None
+        if read_uint32(buffer) != 0:
+            leaf = (UUID(bytes=read_bytes(buffer, 16)), read_bytes(buffer, 32))
+        siblings = [read_bytes(buffer, 32) for _ in range(read_uint32(buffer))]
+
+        if len(buffer.read()) > 0:
+            raise RawFormatError("raw input too long")
+
+        return cls(uuid, leaf, siblings)
@@ -0,0 +1,338 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from pmpi.block import Block
+from pmpi.blockchain import BlockChain
+from pmpi.exceptions import RawFormatError
+from pmpi.operation import Operation
+from pmpi.utils import double_sha
+import pmpi.core
+
+
+def ancestors(block_id, previous_ids):
+    """
+    :param previous_ids: mapping of block ids to ids of their previous blocks
+    :return: set of ids of the block and of all its ancestors found in previous_ids
+    """
+    result = set()
+    while block_id in previous_ids:
+        result.add(block_id)
+        block_id = previous_ids[block_id]
+    return result
+
+
+class LocalPeer:
+    """
+    Peer serving a chain of blocks kept in memory (e.g. taken from another node's database).
+
+    Every peer used by SyncEngine provides get_headers and get_bodies; a peer talking to a remote node implements them
+    with requests sent over the network.
+    """
+
+    def __init__(self, blocks):
+        """
+        :param blocks: chain of blocks, starting with the genesis block
+        """
+        self.__chain = [block.raw() for block in blocks]
+        self.__bodies = {block.id: [op.raw() for op in block.operations] for block in blocks}
+        self.__positions = {block.id: position for position, block in enumerate(blocks)}
+
+    def get_headers(self, locator, limit):
+        """
+        :param locator: ids of blocks known to the node, the most recent first (see SyncEngine.get_locator)
+        :return: raw headers (i.e. Block.raw()) of at most limit blocks following the first block from the locator
+            that is known to the peer
+        """
+        for block_id in locator:
+            if block_id == BlockChain.ROOT:
+                start = 0
+            elif block_id in self.__positions:
+                start = self.__positions[block_id] + 1
+            else:
+                continue
+            return self.__chain[start:start + limit]
+        return []
+
+    def get_bodies(self, block_ids):
+        """
+        :return: list of raw operations of every block, in order of block_ids
+        :raise SyncEngine.PeerError: when some of the blocks are unknown to the peer
+        """
+        try:
+            return [self.__bodies[block_id] for block_id in block_ids]
+        except KeyError:
+            raise SyncEngine.PeerError("block is unknown to the peer")
+
+
+class SyncEngine:
+    """
+    Headers-first synchronisation of the blockchain with a set of peers.
+
+    Headers are downloaded first, and only chains of correctly mined and linked headers are followed. Then bodies of the
+    blocks are fetched in parallel from all the peers and applied in order through BlockChain.update_blocks, in batches.
+    The engine is also the source of new blocks for update_blocks in general -- see apply_blocks.
+
+    Signatures of the blocks (and their operations) buried under the assume-valid block are not verified -- all the
+    other checks are made as usual.
+    """
+
+    DEFAULT_HEADERS_BATCH = 2000
+    DEFAULT_BODIES_BATCH = 50
+    DEFAULT_APPLY_BATCH = 500
+
+    def __init__(self, peers=(), headers_batch=DEFAULT_HEADERS_BATCH, bodies_batch=DEFAULT_BODIES_BATCH,
+                 apply_batch=DEFAULT_APPLY_BATCH, assume_valid=None):
+        """
+        :param peers: peers providing get_headers and get_bodies (see LocalPeer)
+        :param headers_batch: number of headers requested at once
+        :param bodies_batch: number of blocks which bodies are requested at once
+        :param apply_batch: number of blocks put into the blockchain by one call of update_blocks
+        :param assume_valid: id of a trusted block, or None to trust the checkpoint of the database
+        """
+        self.peers = list(peers)
+        self.headers_batch = headers_batch
+        self.bodies_batch = bodies_batch
+        self.apply_batch = apply_batch
+        self.assume_valid = assume_valid
+
+        self.__pending = ()
+        self.__assumed_valid_ids = set()
+
+    # Blocks source for BlockChain.update_blocks
+
+    def get_new_blocks(self):
+        return self.__pending
+
+    def apply_blocks(self, blocks):
+        """
+        Put the blocks into the blockchain with BlockChain.update_blocks.
+
+        :param blocks: iterable of blocks, every one of them after its previous block
+        """
+        blockchain = pmpi.core.get_blockchain()
+        blockchain.set_sync_engine(self)
+
+        self.__pending = blocks
+        try:
+            blockchain.update_blocks()
+        finally:
+            self.__pending = ()
+
+    # Headers
+
+    @staticmethod
+    def get_locator():
+        """
+        :return: ids of the blocks of the main chain -- ten most recent ones, then exponentially sparser, down to ROOT
+        """
+        blockchain = pmpi.core.get_blockchain()
+
+        locator = []
+        depth = blockchain.max_depth
+        step = 1
+        while depth > 0:
+            locator.append(blockchain.main_chain_block_id(depth))
+            if len(locator) >= 10:
+                step *= 2
+            depth -= step
+        locator.append(BlockChain.ROOT)
+        return locator
+
+    @staticmethod
+    def validate_header(header, previous_id):
+        """
+        :type header: Block
+        :raise SyncEngine.HeaderError: when the header is not mined properly or doesn't follow previous_id
+        """
+        if header.previous_block_rev.id != previous_id:
+            raise SyncEngine.HeaderError("header is not linked to the previous one")
+        if not header.is_checksum_correct():
+            raise SyncEngine.HeaderError("wrong checksum")
+        if not header.is_mined():
+            raise SyncEngine.HeaderError("checksum doesn't satisfy the difficulty")
+
+    def download_headers(self, peer):
+        """
+        :return: headers (blocks without operations) of the peer's chain not known to the node yet, in order; headers
+            following the first invalid one are dropped
+        """
+        blockchain = pmpi.core.get_blockchain()
+        locator = self.get_locator()
+
+        headers = []
+        ids = []  # computed from the raw headers -- Block.id would verify the signatures
+        while True:
+            try:
+                raw_headers = peer.get_headers(locator, self.headers_batch)
+            except self.PeerError:
+                break
+
+            try:
+                for raw in raw_headers:
+                    header = Block._from_raw_without_verifying(raw)
+                    header_id = double_sha(raw)
+                    if len(headers) > 0:
+                        previous_id = ids[-1]
+                    else:
+                        previous_id = header.previous_block_rev.id
+                        if not blockchain.exist(previous_id):
+                            raise self.HeaderError("header is not linked to the blockchain")
+                    self.validate_header(header, previous_id)
+
+                    if blockchain.exist(header_id):
+                        if len(headers) > 0:
+                            raise self.HeaderError("known header follows an unknown one")
+                        locator = [header_id]
+                        continue
+                    headers.append(header)
+                    ids.append(header_id)
+            except (self.HeaderError, RawFormatError):
+                break
+
+            if len(raw_headers) < self.headers_batch:
+                break
+            if len(headers) > 0:
+                locator = [ids[-1]]
+
+        return self.__verify_signatures(headers, ids)
+
+    def get_assume_valid(self):
+        """
+        :return: id of the trusted block -- given explicitly or the checkpoint of the database
+        """
+        if self.assume_valid is not None:
+            return self.assume_valid
+        return pmpi.core.get_database().get_checkpoint()
+
+    def __verify_signatures(self, headers, ids):
+        """
+        Verify signatures of the headers, except for the assume-valid block and its ancestors.
+
+        :return: headers preceding the first one not properly signed
+        """
+        assume_valid = self.get_assume_valid()
+        if assume_valid is not None:
+            assumed_valid_ids = ancestors(assume_valid, {header_id: header.previous_block_rev.id
+                                                         for header, header_id in zip(headers, ids)})
+            self.__assumed_valid_ids |= assumed_valid_ids
+        else:
+            assumed_valid_ids = set()
+
+        for index, (header, header_id) in enumerate(zip(headers, ids)):
+            if header_id in assumed_valid_ids:
+                header._assume_signature_verified()
+            else:
+                try:
+                    header.verify_signature()
+                except Block.VerifyError:
+                    return headers[:index]
+        return headers
+
+    def is_assumed_valid(self, block_id):
+        return block_id in self.__assumed_valid_ids
+
+    def best_headers(self):
+        """
+        :return: the longest chain of headers offered by the peers
+        """
+        best = []
+        for peer in self.peers:
+            headers = self.download_headers(peer)
+            if len(headers) > len(best):
+                best = headers
+        return best
+
+    # Bodies
+
+    def __fetch_bodies(self, headers, first_peer):
+        """
+        :return: list of (header, operations) pairs; peers are asked in turn until one serves correct bodies
+        """
+        for attempt in range(len(self.peers)):
+            peer = self.peers[(first_peer + attempt) % len(self.peers)]
+            try:
+                bodies = peer.get_bodies([header.id for header in headers])
+                if len(bodies) != len(headers):
+                    raise self.PeerError("wrong number of bodies")
+
+                result = []
+                for header, body in zip(headers, bodies):
+                    operations = tuple(Operation._from_raw_without_verifying(raw) for raw in body)
+                    if tuple(double_sha(raw) for raw in body) != header.operations_ids:
+                        raise self.PeerError("body doesn't match the header")
+                    # signatures can be checked out of order -- the rest of verification needs the previous blocks
+                    for op in operations:
+                        if self.is_assumed_valid(header.id):
+                            op._assume_signature_verified()
+                        else:
+                            op.verify_signature()
+                    result.append((header, operations))
+                return result
+
+            except (self.PeerError, RawFormatError, Operation.VerifyError):
+                continue
+
+        raise self.SyncError("none of the peers served correct bodies of the blocks")
+
+    def fetch_blocks(self, headers):
+        """
+        Fetch bodies of the blocks in parallel -- consecutive batches of blocks from consecutive peers.
+
+        :return: generator of (header, operations) pairs, in order of headers
+        """
+        if len(self.peers) == 0:
+            raise self.SyncError("there are no peers to fetch the blocks from")
+
+        batches = [headers[i:i + self.bodies_batch] for i in range(0, len(headers), self.bodies_batch)]
+        window = 2 * len(self.peers)
+
+        with ThreadPoolExecutor(max_workers=len(self.peers)) as executor:
+            futures = deque()
+            for index, batch in enumerate(batches):
+                futures.append(executor.submit(self.__fetch_bodies, batch, index % len(self.peers)))
+                if len(futures) >= window:
+                    yield from futures.popleft().result()
+            while len(futures) > 0:
+                yield from futures.popleft().result()
+
+    # Synchronisation
+
+    def synchronise(self):
+        """
+        Download the longest chain offered by the peers and put it into the blockchain.
+
+        :return: number of blocks added
+        """
+        headers = self.best_headers()
+
+        batch = []
+        for header, operations in self.fetch_blocks(headers):
+            batch.append((header, operations))
+            if len(batch) >= self.apply_batch:
+                self.__apply_batch(batch)
+                batch = []
+        if len(batch) > 0:
+            self.__apply_batch(batch)
+
+        return len(headers)
+
+    def __apply_batch(self, batch):
+        # blocks are built lazily -- verification of every block needs its predecessors in the blockchain already
+        self.apply_blocks(self.__build_block(header, operations) for header, operations in batch)
+
+    @staticmethod
+    def __build_block(header, operations):
+        # the header is parsed and its signature verified already (or assumed valid); put() verifies the rest
+        header._attach_operations(operations)
+        return header
+
+    # Exceptions
+
+    class SyncError(Exception):
+        pass
+
+    class HeaderError(SyncError):
+        pass
+
+    class PeerError(SyncError):
+        pass
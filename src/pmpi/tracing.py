@@ -0,0 +1,252 @@
+import binascii
+from collections import deque
+from functools import wraps
+import itertools
+import json
+import os
+import threading
+import time
+
+# True when at least one sink is added -- instrumented code checks it before doing anything else
+enabled = False
+
+_sinks = []
+_sinks_lock = threading.Lock()
+_span_ids = itertools.count(1)
+_local = threading.local()
+
+
+def add_sink(sink):
+    global enabled
+    with _sinks_lock:
+        _sinks.append(sink)
+        enabled = True
+
+
+def remove_sink(sink):
+    global enabled
+    with _sinks_lock:
+        _sinks.remove(sink)
+        enabled = len(_sinks) > 0
+
+
+def hexlify(obj_id):
+    return binascii.hexlify(obj_id).decode()
+
+
+# Database counters -- spans report the reads and writes made by their thread while they were open
+
+def count_read():
+    _local.reads = getattr(_local, 'reads', 0) + 1
+
+
+def count_write():
+    _local.writes = getattr(_local, 'writes', 0) + 1
+
+
+def _stack():
+    try:
+        return _local.stack
+    except AttributeError:
+        _local.stack = []
+        return _local.stack
+
+
+class Span:
+    """
+    Timed section of code. Spans opened while another span of the same thread is open become its children.
+
+    :type attributes: dict
+    :type duration: float
+    """
+
+    def __init__(self, name, attributes=None):
+        self.name = name
+        self.attributes = dict(attributes) if attributes is not None else {}
+        self.span_id = next(_span_ids)
+        self.parent_id = None
+        self.thread_id = threading.get_ident()
+        self.timestamp = None
+        self.start = None
+        self.duration = None
+        self.error = None
+
+        self.__reads = 0
+        self.__writes = 0
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        stack = _stack()
+        if len(stack) > 0:
+            self.parent_id = stack[-1].span_id
+        stack.append(self)
+
+        self.__reads = getattr(_local, 'reads', 0)
+        self.__writes = getattr(_local, 'writes', 0)
+        self.timestamp = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self.start
+        self.attributes['db_reads'] = getattr(_local, 'reads', 0) - self.__reads
+        self.attributes['db_writes'] = getattr(_local, 'writes', 0) - self.__writes
+        if exc_type is not None:
+            self.error = exc_type.__name__
+
+        _stack().pop()
+        for sink in list(_sinks):
+            sink.emit(self)
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'thread_id': self.thread_id,
+            'timestamp': self.timestamp,
+            'duration': self.duration,
+            'error': self.error,
+            'attributes': self.attributes,
+        }
+
+
+class _NoSpan:
+    """
+    Returned by span() while tracing is disabled.
+    """
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_no_span = _NoSpan()
+
+
+def span(name, **attributes):
+    """
+    :return: context manager timing its block as a span -- or doing nothing when tracing is disabled
+    """
+    if not enabled:
+        return _no_span
+    return Span(name, attributes)
+
+
+def current_span():
+    """
+    :return: the innermost open span of the thread, or a span ignoring everything
+    """
+    stack = _stack() if enabled else ()
+    return stack[-1] if len(stack) > 0 else _no_span
+
+
+def traced(name, attributes=None):
+    """
+    Decorator running every call of the function in a span, when tracing is enabled.
+
+    :param attributes: function getting the arguments of the call and returning a dictionary of attributes of the span;
+        called when the function returns (or raises)
+    """
+
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+
+            with Span(name) as s:
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    if attributes is not None:
+                        try:
+                            s.attributes.update(attributes(*args, **kwargs))
+                        except Exception:
+                            pass  # e.g. an id of the object which failed the verification -- it's only an annotation
+
+        return wrapper
+
+    return decorator
+
+
+# Sinks
+
+class RingBufferSink:
+    """
+    Keeps the most recent spans in memory.
+    """
+
+    def __init__(self, capacity=10000):
+        self.__spans = deque(maxlen=capacity)
+
+    def emit(self, s):
+        self.__spans.append(s)
+
+    def spans(self):
+        return list(self.__spans)
+
+    def clear(self):
+        self.__spans.clear()
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    """
+    Writes every span as a line of JSON (see Span.to_dict).
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.__lock = threading.Lock()
+
+    def emit(self, s):
+        line = json.dumps(s.to_dict(), sort_keys=True) + '\n'
+        with self.__lock:
+            self.stream.write(line)
+
+    def close(self):
+        self.stream.flush()
+
+
+class ChromeTraceSink:
+    """
+    Writes spans as complete events of the Chrome trace-event format -- the file can be opened with chrome://tracing,
+    Perfetto or speedscope to see the flame view. The JSON array is closed by close().
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.__lock = threading.Lock()
+        self.__first = True
+        self.stream.write('[\n')
+
+    def emit(self, s):
+        event = json.dumps({
+            'name': s.name,
+            'cat': 'pmpi',
+            'ph': 'X',
+            'ts': s.start * 1e6,
+            'dur': s.duration * 1e6,
+            'pid': os.getpid(),
+            'tid': s.thread_id,
+            'args': dict(s.attributes, error=s.error) if s.error is not None else s.attributes,
+        }, sort_keys=True)
+
+        with self.__lock:
+            self.stream.write(event if self.__first else ',\n' + event)
+            self.__first = False
+
+    def close(self):
+        with self.__lock:
+            self.stream.write('\n]\n')
+            self.stream.flush()
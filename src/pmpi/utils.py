@@ -2,6 +2,7 @@ from hashlib import sha256
 from ecdsa.keys import SigningKey
 from pmpi.exceptions import RawFormatError
 from pmpi.public_key import PublicKey
+import pmpi.metrics
 
 
 def read_bytes(buffer, size):
@@ -24,6 +25,8 @@ def read_string(buffer):
 
 
 def double_sha(b):
+    if pmpi.metrics.enabled:
+        pmpi.metrics.DOUBLE_SHA.inc()
     return sha256(sha256(b).digest()).digest()
 
 
@@ -0,0 +1,405 @@
+"""
+Benchmarks of mining, verification, storage and reorganisations, run for a range of chain sizes.
+
+Usage: python benchmark.py [-s <sizes>] [-k <reorg depths>] [-b <benchmarks>] [-o <output.json>]
+"""
+
+import sys
+
+sys.path.append('..')
+
+import getopt
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from uuid import UUID
+from ecdsa import SigningKey, NIST192p
+from pmpi.block import Block, BlockRev, find_padding
+from pmpi.blockchain import BlockChain
+from pmpi.core import initialise_database, close_database, get_blockchain, ChainParameters, \
+    get_chain_parameters, set_chain_parameters
+from pmpi.identifier import Identifier
+from pmpi.operation import Operation, OperationRev
+from pmpi.packed_ids import PackedIds
+from pmpi.public_key import PublicKey
+from pmpi.state_tree import StateTree
+from pmpi.sync import SyncEngine
+from pmpi.utils import double_sha, sign_object
+
+DEFAULT_SIZES = (10, 100)
+DEFAULT_REORG_DEPTHS = (1, 5)
+OPERATIONS_PER_BLOCK = 4
+HASHES = 20000
+SAMPLES = 1000
+
+
+class ChainBuilder:
+    """
+    Seeded builder of valid chains: every block mints new identifiers and updates the ones minted earlier.
+    """
+
+    def __init__(self, seed=0, operations_per_block=OPERATIONS_PER_BLOCK, update_ratio=0.5):
+        self.random = random.Random(seed)
+        self.operations_per_block = operations_per_block
+        self.update_ratio = update_ratio
+
+        self.private_key = SigningKey.from_secret_exponent(self.random.randrange(1, NIST192p.order), NIST192p)
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+        self.tips = {}  # uuid -> the last operation on the identifier
+        self.counter = 0
+
+    def sign(self, obj):
+        sign_object(self.public_key, self.private_key, obj)
+        return obj
+
+    def operation(self, previous_operation_rev=OperationRev()):
+        self.counter += 1
+        return self.sign(Operation(previous_operation_rev, 'http://example.com/{}'.format(self.counter),
+                                   [self.public_key]))
+
+    def operations(self, minting_only=False):
+        operations = []
+        updated = set()
+        for _ in range(self.operations_per_block):
+            if not minting_only and len(self.tips) > len(updated) and self.random.random() < self.update_ratio:
+                uuid = self.random.choice([uuid for uuid in self.tips if uuid not in updated])
+                op = self.operation(self.tips[uuid].get_rev())
+                updated.add(uuid)
+            else:
+                op = self.operation()
+            operations.append(op)
+
+        if not minting_only:
+            for op in operations:
+                self.tips[op.uuid] = op
+        return operations
+
+    def block(self, previous_block_rev, operations):
+        block = Block.from_operations_list(previous_block_rev, 42 + self.counter, operations)
+        block.mine()
+        return self.sign(block)
+
+    def chain(self, length, previous_block_rev=BlockRev(), minting_only=False):
+        blocks = []
+        for _ in range(length):
+            blocks.append(self.block(previous_block_rev, self.operations(minting_only)))
+            previous_block_rev = blocks[-1].get_rev()
+        return blocks
+
+
+class TemporaryDatabase:
+    """
+    Fresh database in a temporary directory.
+    """
+
+    def __enter__(self):
+        self.directory = tempfile.mkdtemp()
+        initialise_database(os.path.join(self.directory, 'benchmark_database'))
+        return self
+
+    def reopen(self):
+        close_database()
+        initialise_database(os.path.join(self.directory, 'benchmark_database'))
+
+    def __exit__(self, *args):
+        close_database()
+        shutil.rmtree(self.directory)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def percentiles(latencies):
+    latencies = sorted(latencies)
+    return {'p{}_ms'.format(p): 1000 * latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+            for p in (50, 90, 99)}
+
+
+# Benchmarks -- every one of them gets a chain size and returns a dictionary of results
+
+def bench_mine(size):
+    block = ChainBuilder().chain(1)[0]
+    block.difficulty = 255  # no padding satisfies it -- all of the paddings are hashed
+    seconds, _ = timed(find_padding, block.unmined_raw(), block.difficulty, 0, HASHES)
+    return {'hashes': HASHES, 'seconds': seconds, 'hashes_per_second': HASHES / seconds}
+
+
+def bench_mine_header(size):
+    operations_ids = [double_sha(i.to_bytes(4, 'big')) for i in range(size)]
+    result = {'operations': size}
+    for name, version in (('ids', Block.VERSION), ('merkle', Block.MERKLE_VERSION)):
+        block = Block(BlockRev(), 42, operations_ids, version)
+        block.difficulty = 255
+        seconds, _ = timed(find_padding, block.unmined_raw(), block.difficulty, 0, HASHES)
+        result['{}_header_bytes'.format(name)] = len(block.unmined_raw())
+        result['{}_hashes_per_second'.format(name)] = HASHES / seconds
+    return result
+
+
+def bench_operation_verify(size):
+    builder = ChainBuilder()
+    raws = [builder.operation().raw() for _ in range(size)]
+    seconds, _ = timed(lambda: [Operation.from_raw(raw) for raw in raws])
+    return {'operations': size, 'seconds': seconds, 'operations_per_second': size / seconds}
+
+
+def bench_block_verify(size):
+    blocks = ChainBuilder().chain(size)
+    with TemporaryDatabase():
+        SyncEngine().apply_blocks(blocks)
+        raws = [block.raw_with_operations() for block in blocks]
+        seconds, _ = timed(lambda: [Block.from_raw_with_operations(raw) for raw in raws])
+    return {'blocks': size, 'seconds': seconds, 'blocks_per_second': size / seconds}
+
+
+def bench_block_put(size):
+    blocks = ChainBuilder().chain(size)
+    with TemporaryDatabase():
+        seconds, _ = timed(lambda: [block.put() for block in blocks])
+    return {'blocks': size, 'seconds': seconds, 'blocks_per_second': size / seconds}
+
+
+def bench_block_size(size):
+    """
+    Accept a block with `size` operations (half of them updating the identifiers minted by the previous block).
+    """
+    default = get_chain_parameters()
+    set_chain_parameters(ChainParameters(max_operations=max(size, Block.MAX_OPERATIONS)))
+    try:
+        builder = ChainBuilder(operations_per_block=size)
+        blocks = builder.chain(2)
+        raw = blocks[1].raw_with_operations()
+
+        with TemporaryDatabase():
+            SyncEngine().apply_blocks(blocks[:1])
+            parse_seconds, block = timed(Block.from_raw_with_operations, raw)
+            accept_seconds, _ = timed(SyncEngine().apply_blocks, [block])
+    finally:
+        set_chain_parameters(default)
+
+    return {
+        'operations': size,
+        'parse_verify_seconds': parse_seconds,
+        'accept_seconds': accept_seconds,
+        'us_per_operation': 1e6 * (parse_seconds + accept_seconds) / size,
+    }
+
+
+def bench_update_blocks(size):
+    blocks = ChainBuilder().chain(size)
+    with TemporaryDatabase():
+        seconds, _ = timed(SyncEngine().apply_blocks, blocks)
+    return {'blocks': size, 'seconds': seconds, 'blocks_per_second': size / seconds}
+
+
+def bench_startup(size):
+    blocks = ChainBuilder().chain(size)
+    with TemporaryDatabase():
+        SyncEngine().apply_blocks(blocks)
+        seconds, _ = timed(BlockChain)
+    return {'blocks': size, 'seconds': seconds}
+
+
+def bench_reorg(size, depth):
+    builder = ChainBuilder()
+    blocks = builder.chain(size)
+    fork = builder.chain(depth + 1, blocks[size - depth - 1].get_rev(), minting_only=True)
+    with TemporaryDatabase():
+        SyncEngine().apply_blocks(blocks)
+        SyncEngine().apply_blocks(fork[:-1])  # as long as the main chain -- the head stays
+        seconds, _ = timed(SyncEngine().apply_blocks, fork[-1:])
+        assert get_blockchain().head == fork[-1].id
+    return {'blocks': size, 'depth': depth, 'seconds': seconds}
+
+
+def bench_identifier_get(size):
+    builder = ChainBuilder()
+    blocks = builder.chain(size)
+    uuids = list(builder.tips)
+    with TemporaryDatabase() as database:
+        SyncEngine().apply_blocks(blocks)
+        database.reopen()
+
+        latencies = []
+        for uuid in (builder.random.choice(uuids) for _ in range(SAMPLES)):
+            seconds, _ = timed(Identifier.get, uuid)
+            latencies.append(seconds)
+    result = {'identifiers': len(uuids), 'samples': SAMPLES}
+    result.update(percentiles(latencies))
+    return result
+
+
+def traced_memory(function):
+    """
+    :return: (bytes allocated by the function and still in use, its result)
+    """
+    tracemalloc.start()
+    try:
+        result = function()
+        return tracemalloc.get_traced_memory()[0], result
+    finally:
+        tracemalloc.stop()
+
+
+def bench_object_memory(size):
+    builder = ChainBuilder()
+    blocks = builder.chain(max(1, size // OPERATIONS_PER_BLOCK))
+    operations_raws = [op.raw() for block in blocks for op in block.operations]
+    blocks_raws = [block.raw() for block in blocks]
+
+    operations_memory, _ = traced_memory(lambda: [Operation._from_raw_without_verifying(raw)
+                                                  for raw in operations_raws])
+    blocks_memory, _ = traced_memory(lambda: [Block._from_raw_without_verifying(raw) for raw in blocks_raws])
+    revisions_memory, _ = traced_memory(lambda: [OperationRev.from_id(raw[4:36]) for raw in operations_raws])
+    return {
+        'operations': len(operations_raws),
+        'bytes_per_operation': operations_memory / len(operations_raws),
+        'bytes_per_block': blocks_memory / len(blocks_raws),
+        'bytes_per_revision': revisions_memory / len(operations_raws),
+    }
+
+
+def bench_attribute_access(size):
+    block = ChainBuilder().chain(1)[0]
+    op = block.operations[0]
+    rev = op.get_rev()
+
+    result = {'accesses': size}
+    for name, function in (('owners_der', lambda: op.owners_der), ('uuid', lambda: op.uuid),
+                           ('operations_ids', lambda: block.operations_ids), ('revision_id', lambda: rev.id)):
+        seconds, _ = timed(lambda: [function() for _ in range(size)])
+        result['{}_ns'.format(name)] = 1e9 * seconds / size
+    return result
+
+
+def bench_id_membership(size):
+    ids = [double_sha(i.to_bytes(4, 'big')) for i in range(size)]
+    raw = bytearray(b''.join(ids))  # all the containers copy the ids out of a parsed buffer
+    probes = [ids[i % size] for i in range(SAMPLES)] + \
+             [double_sha(b'missing' + i.to_bytes(4, 'big')) for i in range(SAMPLES)]
+
+    # packed ids are for storage (lookups scan the buffer); repeated lookups go to a set built out of them
+    result = {'ids': size}
+    for name, build in (('tuple', lambda: tuple(bytes(raw[i:i + 32]) for i in range(0, len(raw), 32))),
+                        ('packed', lambda: PackedIds.from_raw(raw)),
+                        ('set', lambda: set(PackedIds.from_raw(raw)))):
+        memory, container = traced_memory(build)
+        build_seconds, _ = timed(build)
+        seconds, _ = timed(lambda: [obj_id in container for obj_id in probes])
+        result['{}_bytes_per_id'.format(name)] = memory / size
+        result['{}_build_ms'.format(name)] = 1e3 * build_seconds
+        result['{}_lookup_ns'.format(name)] = 1e9 * seconds / len(probes)
+    return result
+
+
+def bench_state_tree(size):
+    rng = random.Random(0)
+    items = [(UUID(int=rng.getrandbits(128)), double_sha(i.to_bytes(4, 'big'))) for i in range(size)]
+    build_seconds, tree = timed(StateTree, items)
+    samples = [items[rng.randrange(size)][0] for _ in range(SAMPLES)]
+
+    update_seconds, _ = timed(lambda: [tree.set(uuid, double_sha(uuid.bytes)) for uuid in samples])
+    proof_seconds, proofs = timed(lambda: [tree.proof(uuid) for uuid in samples])
+    root = tree.root
+    verify_seconds, _ = timed(lambda: [proof.verify(root, proof.operation_id) for proof in proofs])
+    return {
+        'identifiers': size,
+        'build_seconds': build_seconds,
+        'update_us': 1e6 * update_seconds / SAMPLES,
+        'proof_us': 1e6 * proof_seconds / SAMPLES,
+        'verify_us': 1e6 * verify_seconds / SAMPLES,
+        'proof_bytes': sum(len(proof.raw()) for proof in proofs) / SAMPLES,
+    }
+
+
+BENCHMARKS = {
+    'mine': bench_mine,
+    'mine_header': bench_mine_header,
+    'operation_verify': bench_operation_verify,
+    'block_verify': bench_block_verify,
+    'block_put': bench_block_put,
+    'block_size': bench_block_size,
+    'update_blocks': bench_update_blocks,
+    'startup': bench_startup,
+    'reorg': bench_reorg,
+    'identifier_get': bench_identifier_get,
+    'object_memory': bench_object_memory,
+    'attribute_access': bench_attribute_access,
+    'id_membership': bench_id_membership,
+    'state_tree': bench_state_tree,
+}
+
+
+def run(names, sizes, reorg_depths):
+    results = []
+    for name in names:
+        for size in sizes:
+            if name == 'mine' and size != sizes[0]:
+                continue  # doesn't depend on the size
+            if name == 'reorg':
+                runs = [(size, depth) for depth in reorg_depths if depth < size]
+            else:
+                runs = [(size,)]
+
+            for args in runs:
+                result = {'benchmark': name, 'size': size}
+                result.update(BENCHMARKS[name](*args))
+                results.append(result)
+                print(' '.join('{}={}'.format(key, '{:.6g}'.format(value) if isinstance(value, float) else value)
+                               for key, value in result.items()))
+    return results
+
+
+def main(argv):
+    usage = "[-s <sizes>] [-k <reorg depths>] [-b <benchmarks>] [-o <output.json>]"
+    try:
+        opts, args = getopt.getopt(argv, "hs:k:b:o:")
+    except getopt.GetoptError:
+        print(sys.argv[0], usage)
+        sys.exit(2)
+
+    sizes = DEFAULT_SIZES
+    reorg_depths = DEFAULT_REORG_DEPTHS
+    names = list(BENCHMARKS)
+    output = None
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(sys.argv[0], usage)
+            print("Benchmarks:", ', '.join(BENCHMARKS))
+            sys.exit()
+        elif opt == '-s':
+            sizes = [int(size) for size in arg.split(',')]
+        elif opt == '-k':
+            reorg_depths = [int(depth) for depth in arg.split(',')]
+        elif opt == '-b':
+            names = arg.split(',')
+            for name in names:
+                if name not in BENCHMARKS:
+                    print("Unknown benchmark:", name)
+                    sys.exit(2)
+        elif opt == '-o':
+            output = arg
+
+    results = run(names, sizes, reorg_depths)
+
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump({
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': int(time.time()),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
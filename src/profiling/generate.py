@@ -0,0 +1,410 @@
+"""
+Generator of large, reproducible chains for load and scale tests.
+
+The whole dataset is determined by the seed: the keys, the shape of the chain, the operations and -- as signatures are
+deterministic (RFC 6979) and mining takes the first padding satisfying the difficulty -- every single byte.
+
+Usage: python generate.py [options] (-d <database file> | -a <archive file>)
+"""
+
+import sys
+
+sys.path.append('..')
+
+from concurrent.futures import ProcessPoolExecutor
+import getopt
+from itertools import repeat
+import random
+import time
+from uuid import UUID
+from ecdsa import SigningKey, NIST192p
+from pmpi.archive import write_archive
+from pmpi.block import Block, BlockRev, find_padding, MAX_PADDING
+from pmpi.core import initialise_database, close_database, get_chain_parameters, get_database
+from pmpi.operation import Operation, OperationRev
+from pmpi.public_key import PublicKey
+from pmpi.sync import SyncEngine
+from pmpi.utils import double_sha, sign_object
+
+
+class Config:
+    def __init__(self, blocks=1000, operations_per_block=Block.MAX_OPERATIONS, update_ratio=0.3, keys=100,
+                 max_owners=2, fork_rate=0.05, fork_depth=3, seed=0, window=1000, difficulty=1):
+        """
+        :param blocks: length of the main chain
+        :param operations_per_block: number of operations in every block
+        :param update_ratio: fraction of operations updating existing identifiers (the rest mints new ones)
+        :param keys: number of owners' keys -- every identifier is owned by keys drawn from this pool
+        :param max_owners: maximal number of owners of an identifier
+        :param fork_rate: probability of a side branch starting next to a block of the main chain
+        :param fork_depth: maximal depth of reorganisations caused by side branches
+        :param window: number of main chain blocks planned and signed at once
+        :param difficulty: difficulty of the blocks
+        """
+        self.blocks = blocks
+        self.operations_per_block = operations_per_block
+        self.update_ratio = update_ratio
+        self.keys = keys
+        self.max_owners = max_owners
+        self.fork_rate = fork_rate
+        self.fork_depth = fork_depth
+        self.seed = seed
+        self.window = window
+        self.difficulty = difficulty
+
+
+# Signing -- run in the worker processes, which build the keys once, at their first task
+
+_signing_keys = None
+_secret_exponents = None
+
+
+def _initialise_keys(secret_exponents):
+    global _signing_keys, _secret_exponents
+    if _secret_exponents != secret_exponents:
+        private_keys = [SigningKey.from_secret_exponent(secret_exponent, NIST192p)
+                        for secret_exponent in secret_exponents]
+        _signing_keys = [(private_key, PublicKey.from_signing_key(private_key)) for private_key in private_keys]
+        _secret_exponents = secret_exponents
+
+
+def _sign_operations(secret_exponents, specs):
+    """
+    :param secret_exponents: secret exponents of the keys -- sent with every task, but the keys are built only once
+    :param specs: list of (previous operation id or None, uuid bytes or None, address, owners, signer) tuples; owners
+        and signer are indices of the keys
+    :return: list of raw signed operations
+    """
+    _initialise_keys(secret_exponents)
+    raws = []
+    for previous_id, uuid, address, owners, signer in specs:
+        owners_keys = [_signing_keys[owner][1] for owner in owners]
+        if previous_id is None:
+            op = Operation(OperationRev(), address, owners_keys)
+        else:
+            op = Operation.from_owners_der(OperationRev.from_id(previous_id), UUID(bytes=uuid), address,
+                                           [key.der for key in owners_keys])
+        private_key, public_key = _signing_keys[signer]
+        sign_object(public_key, private_key, op)
+        op._assume_signature_verified()  # signed right now
+        raws.append(op.raw())
+    return raws
+
+
+class Generator:
+    """
+    Plans the chain with a seeded random generator, signs operations and mines blocks in parallel and yields blocks,
+    every one of them after its previous block. The main chain is interleaved with side branches containing minting
+    operations only, which temporarily overtake it.
+    """
+
+    SIGNING_CHUNK = 64
+    MINING_CHUNK = 1 << 12
+
+    def __init__(self, config, executor=None, workers=1):
+        """
+        :param executor: concurrent.futures.ProcessPoolExecutor, or None to sign and mine in this process
+        :param workers: number of workers of the executor -- chunks of the padding space searched at once
+        """
+        chain_parameters = get_chain_parameters()
+        if not chain_parameters.min_operations <= config.operations_per_block <= chain_parameters.max_operations:
+            raise ValueError("operations_per_block out of range")
+        if not 1 <= config.max_owners <= config.keys:
+            raise ValueError("max_owners out of range")
+
+        self.config = config
+        self.executor = executor
+        self.workers = workers
+        self.random = random.Random(config.seed)
+
+        self.secret_exponents = tuple(self.random.randrange(1, NIST192p.order) for _ in range(config.keys + 1))
+        self.miner_key = self.secret_exponents[-1]
+
+        self.__addresses = 0
+        # identifier number -> (id of the last operation, uuid bytes) on the main chain
+        self.__tips = []
+        # identifier number -> owners, as planned so far
+        self.__owners_of = []
+
+    def __address(self):
+        self.__addresses += 1
+        return 'http://example.com/{}'.format(self.__addresses)
+
+    def __owners(self):
+        return tuple(sorted(self.random.sample(range(self.config.keys), self.random.randint(1, self.config.max_owners))))
+
+    # Planning
+
+    def __plan_block(self, minting_only):
+        """
+        :return: list of operation specs: (identifier number or None for minting, address, owners, signer)
+        """
+        specs = []
+        updated = set()
+        for _ in range(self.config.operations_per_block):
+            if not minting_only and len(self.__owners_of) > 2 * len(updated) \
+                    and self.random.random() < self.config.update_ratio:
+                identifier = self.random.randrange(len(self.__owners_of))
+                while identifier in updated:
+                    identifier = self.random.randrange(len(self.__owners_of))
+                updated.add(identifier)
+                owners = self.__owners()
+                specs.append((identifier, self.__address(), owners, self.random.choice(self.__owners_of[identifier])))
+                self.__owners_of[identifier] = owners
+            else:
+                owners = self.__owners()
+                specs.append((None, self.__address(), owners, self.random.choice(owners)))
+        return specs
+
+    def __plan_window(self, length, remaining):
+        """
+        Side branch forking depth blocks below the tip of the main chain is one block longer than the main chain -- it
+        becomes the main chain (a reorganisation of the given depth) until two more blocks are added to the old one.
+
+        :param remaining: number of main chain blocks to be planned after this window
+        :return: list of (main chain flag, parent position or None, operation specs) -- parent position refers to the
+            list itself, None means the previous main chain block
+        """
+        plan = []
+        main_positions = []
+        for i in range(length):
+            plan.append((True, None, self.__plan_block(False)))
+            main_positions.append(len(plan) - 1)
+
+            if length - i + remaining > 2 and len(main_positions) > 1 \
+                    and self.random.random() < self.config.fork_rate:
+                depth = self.random.randint(1, min(self.config.fork_depth, len(main_positions) - 1))
+                parent = main_positions[-1 - depth]
+                for _ in range(depth + 1):
+                    plan.append((False, parent, self.__plan_block(True)))
+                    parent = len(plan) - 1
+        return plan
+
+    # Signing
+
+    def __sign(self, specs):
+        chunks = [specs[i:i + self.SIGNING_CHUNK] for i in range(0, len(specs), self.SIGNING_CHUNK)]
+        mapping = map if self.executor is None else self.executor.map
+        raws = []
+        for chunk in mapping(_sign_operations, [self.secret_exponents] * len(chunks), chunks):
+            raws.extend(chunk)
+        return raws
+
+    def __sign_window(self, plan):
+        """
+        Sign operations level by level -- an update can be signed only when the id of its previous operation is known.
+
+        :return: list of lists of operations, in order of plan
+        """
+        operations = [[None] * len(specs) for _, _, specs in plan]
+
+        # minting operations do not depend on anything
+        pending = [(b, o) for b, (_, _, specs) in enumerate(plan) for o, spec in enumerate(specs) if spec[0] is None]
+        updates = [(b, o) for b, (_, _, specs) in enumerate(plan) for o, spec in enumerate(specs)
+                   if spec[0] is not None]
+        tips = {}  # identifier number -> (operation id, uuid) -- updated as the levels are signed
+
+        new_identifiers = []
+        while len(pending) > 0:
+            specs = []
+            for b, o in pending:
+                identifier, address, owners, signer = plan[b][2][o]
+                if identifier is None:
+                    specs.append((None, None, address, owners, signer))
+                else:
+                    previous_id, uuid = tips.get(identifier, self.__tips[identifier])
+                    specs.append((previous_id, uuid, address, owners, signer))
+
+            for (b, o), raw in zip(pending, self.__sign(specs)):
+                op = Operation._from_raw_without_verifying(raw)
+                op._assume_signature_verified()  # signed right now
+                operations[b][o] = op
+
+                identifier = plan[b][2][o][0]
+                if identifier is not None:
+                    tips[identifier] = (double_sha(raw), op.uuid.bytes)
+                elif plan[b][0]:
+                    new_identifiers.append((b, o))
+
+            # next level: the first pending update of every identifier whose previous operation is signed already
+            # (identifiers minted in this window can be updated only by the next windows)
+            pending = []
+            waiting = []
+            seen = set()
+            for b, o in updates:
+                identifier = plan[b][2][o][0]
+                if identifier not in seen:
+                    seen.add(identifier)
+                    pending.append((b, o))
+                else:
+                    waiting.append((b, o))
+            updates = waiting
+
+        for identifier, tip in tips.items():
+            self.__tips[identifier] = tip
+        for b, o in new_identifiers:
+            op = operations[b][o]
+            self.__tips.append((op.id, op.uuid.bytes))
+            self.__owners_of.append(plan[b][2][o][2])
+
+        return operations
+
+    # Blocks
+
+    def __mine(self, block):
+        """
+        Find the first padding satisfying the difficulty, exactly as Block.mine() -- the first chunk of the padding
+        space is searched in this process (at low difficulties it's faster than a round trip to the workers), the
+        following ones in rounds of one chunk per worker.
+        """
+        unmined_raw = block.unmined_raw()
+        padding = find_padding(unmined_raw, block.difficulty, 0, self.MINING_CHUNK)
+
+        start = self.MINING_CHUNK
+        while padding is None and start < MAX_PADDING:
+            starts = range(start, min(start + self.workers * self.MINING_CHUNK, MAX_PADDING), self.MINING_CHUNK)
+            stops = [min(chunk_start + self.MINING_CHUNK, MAX_PADDING) for chunk_start in starts]
+            mapping = map if self.executor is None else self.executor.map
+            for result in mapping(find_padding, repeat(unmined_raw), repeat(block.difficulty), starts, stops):
+                if padding is None:
+                    padding = result
+            start += len(starts) * self.MINING_CHUNK
+
+        if padding is None:
+            raise Block.MiningError("no padding satisfies the difficulty")
+        block.apply_padding(padding)
+
+    def blocks(self):
+        """
+        :return: generator of blocks
+        """
+        miner_private_key = SigningKey.from_secret_exponent(self.miner_key, NIST192p)
+        miner_public_key = PublicKey.from_signing_key(miner_private_key)
+        timestamp = 1400000000
+
+        main_tip = None
+        generated = 0
+        while generated < self.config.blocks:
+            length = min(self.config.window, self.config.blocks - generated)
+            plan = self.__plan_window(length, self.config.blocks - generated - length)
+            operations = self.__sign_window(plan)
+
+            blocks = []
+            for (main, parent, _), block_operations in zip(plan, operations):
+                if parent is not None:
+                    previous = blocks[parent]
+                else:
+                    previous = main_tip
+
+                timestamp += 1
+                previous_block_rev = previous.get_rev() if previous is not None else BlockRev()
+                block = Block.from_operations_list(previous_block_rev, timestamp, block_operations)
+                block.operations_limit = self.config.operations_per_block
+                block.difficulty = self.config.difficulty
+                self.__mine(block)
+                sign_object(miner_public_key, miner_private_key, block)
+                blocks.append(block)
+                if main:
+                    main_tip = block
+                yield block
+
+            generated += length
+
+
+def apply_blocks(blocks, batch_size=SyncEngine.DEFAULT_APPLY_BATCH):
+    """
+    Put the blocks into the blockchain batch by batch, flushing the database after every batch -- only one batch (and
+    one window of the generator) is kept in memory.
+
+    :return: number of blocks put
+    """
+    engine = SyncEngine()
+    count = 0
+    batch = []
+    for block in blocks:
+        batch.append(block)
+        if len(batch) >= batch_size:
+            engine.apply_blocks(batch)
+            get_database().sync()
+            count += len(batch)
+            batch = []
+    if len(batch) > 0:
+        engine.apply_blocks(batch)
+        count += len(batch)
+    return count
+
+
+def main(argv):
+    usage = "[-n <blocks>] [-m <operations per block>] [-u <update ratio>] [-k <keys>] [-o <max owners>] " \
+            "[-f <fork rate>] [-l <fork depth>] [-s <seed>] [-D <difficulty>] [-j <workers>] " \
+            "(-d <database file> | -a <archive file>)"
+    try:
+        opts, args = getopt.getopt(argv, "hn:m:u:k:o:f:l:s:D:j:d:a:")
+    except getopt.GetoptError:
+        print(sys.argv[0], usage)
+        sys.exit(2)
+
+    config = Config()
+    workers = 0
+    database_file = None
+    archive_file = None
+
+    for opt, arg in opts:
+        if opt == '-h':
+            print(sys.argv[0], usage)
+            sys.exit()
+        elif opt == '-n':
+            config.blocks = int(arg)
+        elif opt == '-m':
+            config.operations_per_block = int(arg)
+        elif opt == '-u':
+            config.update_ratio = float(arg)
+        elif opt == '-k':
+            config.keys = int(arg)
+        elif opt == '-o':
+            config.max_owners = int(arg)
+        elif opt == '-f':
+            config.fork_rate = float(arg)
+        elif opt == '-l':
+            config.fork_depth = int(arg)
+        elif opt == '-s':
+            config.seed = int(arg)
+        elif opt == '-D':
+            config.difficulty = int(arg)
+        elif opt == '-j':
+            workers = int(arg)
+        elif opt == '-d':
+            database_file = arg
+        elif opt == '-a':
+            archive_file = arg
+
+    if (database_file is None) == (archive_file is None):
+        print(sys.argv[0], usage)
+        sys.exit(2)
+
+    generator = Generator(config)
+    executor = None
+    if workers > 0:
+        executor = generator.executor = ProcessPoolExecutor(workers)
+        generator.workers = workers
+
+    start = time.time()
+    try:
+        if archive_file is not None:
+            with open(archive_file, 'wb') as f:
+                count = write_archive(f, generator.blocks())
+        else:
+            initialise_database(database_file)
+            try:
+                count = apply_blocks(generator.blocks())
+            finally:
+                close_database()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print("Generated {} blocks in {:.1f} s.".format(count, time.time() - start))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
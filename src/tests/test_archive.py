@@ -0,0 +1,169 @@
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from ecdsa.keys import SigningKey, VerifyingKey
+from pmpi.archive import export_chain, import_archive, read_archive, verify_record, write_archive, ArchiveError
+from pmpi.block import Block, BlockRev
+from pmpi.core import initialise_database, close_database, get_blockchain
+from pmpi.identifier import Identifier
+from pmpi.operation import Operation, OperationRev
+from pmpi.protocol import FrameDecoder, encode_frame, BLOCK, OPERATION
+from pmpi.public_key import PublicKey
+from pmpi.utils import sign_object
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        initialise_database('test_database_file')
+
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+
+        # every block mints an identifier and updates the one minted by the previous block
+        self.blocks = []
+        self.operations = []
+        previous_block_rev = BlockRev()
+        for i in range(5):
+            operations = [self.sign(Operation(OperationRev(), 'http://example{}.com/'.format(i), [self.public_key]))]
+            if i > 0:
+                operations.append(self.sign(Operation(self.operations[-1][0].get_rev(),
+                                                      'http://example{}.com/v2/'.format(i - 1), [self.public_key])))
+            else:
+                operations.append(self.sign(Operation(OperationRev(), 'http://other.com/', [self.public_key])))
+
+            block = Block.from_operations_list(previous_block_rev, 42 + i, operations)
+            block.mine()
+            self.blocks.append(self.sign(block))
+            self.operations.append(operations)
+            previous_block_rev = block.get_rev()
+
+        self.archive = BytesIO()
+        write_archive(self.archive, self.blocks)
+        self.archive.seek(0)
+
+    def sign(self, obj):
+        sign_object(self.public_key, self.private_key, obj)
+        return obj
+
+    def assertImported(self, blocks_count):
+        blockchain = get_blockchain()
+        self.assertEqual(blockchain.max_depth, blocks_count)
+        self.assertEqual(blockchain.head, self.blocks[blocks_count - 1].id)
+
+        for i in range(blocks_count - 1):
+            self.assertEqual(Identifier.get(self.operations[i][0].uuid).operation_rev.id, self.operations[i + 1][1].id)
+        self.assertEqual(Identifier.get(self.operations[blocks_count - 1][0].uuid).operation_rev.id,
+                         self.operations[blocks_count - 1][0].id)
+
+    def test_read_archive(self):
+        records = list(read_archive(self.archive, chunk_size=100))
+
+        self.assertEqual(records, [block.raw_with_operations() for block in self.blocks])
+        self.assertEqual(verify_record(records[0]), 2)
+
+    def test_import(self):
+        reports = []
+        progress = import_archive(self.archive, batch_size=2, progress=lambda p: reports.append(p.blocks))
+
+        self.assertEqual(progress.blocks, 5)
+        self.assertEqual(progress.operations, 10)
+        self.assertGreater(progress.blocks_per_second, 0)
+        self.assertEqual(reports, [2, 4, 5])
+        self.assertImported(5)
+
+    def test_import_in_executor(self):
+        with ThreadPoolExecutor(2) as executor:
+            import_archive(self.archive, executor, batch_size=2)
+
+        self.assertImported(5)
+
+    def test_signatures_verified_once(self):
+        with patch.object(VerifyingKey, 'verify', autospec=True, side_effect=VerifyingKey.verify) as verify:
+            import_archive(self.archive, batch_size=2)
+
+        self.assertEqual(verify.call_count, 15)  # every block and its two operations
+        self.assertImported(5)
+
+    def test_export(self):
+        import_archive(self.archive)
+
+        exported = BytesIO()
+        self.assertEqual(export_chain(exported), 5)
+        self.assertEqual(exported.getvalue(), self.archive.getvalue())
+
+    def test_truncated_archive(self):
+        truncated = BytesIO(self.archive.getvalue()[:-1])
+
+        with self.assertRaisesRegex(ArchiveError, "import stopped after 4 blocks: incomplete frame"):
+            import_archive(truncated, batch_size=2)
+
+        self.assertImported(4)
+
+    def test_wrong_signature(self):
+        records = [block.raw_with_operations() for block in self.blocks]
+        records[3] = records[3][:-1] + bytes([records[3][-1] ^ 1])  # damage the signature of the block
+
+        archive = BytesIO(b''.join(encode_frame(BLOCK, record) for record in records))
+
+        with self.assertRaisesRegex(ArchiveError, "import stopped after 2 blocks: wrong signature"):
+            import_archive(archive, batch_size=2)
+
+        self.assertImported(2)
+
+    def test_rejected_block(self):
+        # the identifier minted by the first block has been updated by the second one already
+        stale = self.sign(Operation(self.operations[0][0].get_rev(), 'http://stale.com/', [self.public_key]))
+        rejected = Block.from_operations_list(self.blocks[2].get_rev(), 100, [
+            stale, self.sign(Operation(OperationRev(), 'http://new.com/', [self.public_key]))])
+        rejected.mine()
+
+        archive = BytesIO()
+        write_archive(archive, self.blocks[:3] + [self.sign(rejected)] + self.blocks[3:])
+        archive.seek(0)
+
+        with self.assertRaisesRegex(ArchiveError, "import stopped after 3 blocks: operation's previous_operation_rev "
+                                                  "is not pointing at the last operation on current blockchain"):
+            import_archive(archive, batch_size=2)
+
+        self.assertImported(3)
+
+    def test_assume_valid(self):
+        forged = Operation(self.operations[4][0].get_rev(), 'http://forged.com/', [self.public_key])
+        forged.sign(self.public_key, bytes(48))
+        forged._assume_signature_verified()
+
+        blocks = self.blocks[:]
+        for i in range(2):
+            block = Block.from_operations_list(blocks[-1].get_rev(), 100 + i, [
+                [forged, self.sign(Operation(OperationRev(), 'http://new.com/', [self.public_key]))],
+                [self.sign(Operation(forged.get_rev(), 'http://example4.com/v3/', [self.public_key])),
+                 self.sign(Operation(OperationRev(), 'http://new2.com/', [self.public_key]))]
+            ][i])
+            block.mine()
+            blocks.append(self.sign(block))
+
+        archive = BytesIO()
+        write_archive(archive, blocks)
+
+        archive.seek(0)
+        with self.assertRaisesRegex(ArchiveError, "import stopped after 5 blocks: wrong signature"):
+            import_archive(archive, batch_size=1)
+
+        close_database()
+        os.remove('test_database_file')
+        initialise_database('test_database_file')
+
+        archive.seek(0)
+        import_archive(archive, batch_size=1, assume_valid=blocks[5].id)
+
+        self.assertEqual(get_blockchain().head, blocks[6].id)
+
+    def test_other_messages(self):
+        with self.assertRaisesRegex(FrameDecoder.FrameError, "archive contains a message other than block"):
+            list(read_archive(BytesIO(encode_frame(OPERATION, b'op'))))
+
+    def tearDown(self):
+        close_database()
+        os.remove('test_database_file')
@@ -6,8 +6,9 @@ import time
 
 from ecdsa.keys import SigningKey
 
-from pmpi.block import BlockRev, Block
-from pmpi.core import close_database, initialise_database
+from pmpi.block import BlockRev, Block, CompactBlock
+from pmpi.core import close_database, initialise_database, ChainParameters, get_chain_parameters, \
+    set_chain_parameters
 import pmpi.database
 from pmpi.exceptions import RawFormatError
 from pmpi.operation import Operation, OperationRev
@@ -99,7 +100,7 @@ class TestSingleBlock(TestCase):
             Block.from_raw_with_operations(raw).verify_id(sha256(b'wrong hash'))
 
         with self.assertRaisesRegex(RawFormatError, "version number mismatch"):
-            Block.from_raw((2).to_bytes(4, 'big') + self.block.raw()[4:])
+            Block.from_raw((3).to_bytes(4, 'big') + self.block.raw()[4:])
 
     def test_unsigned_operation(self):
         with self.assertRaisesRegex(Block.VerifyError, "at least one of the operations is not properly signed"):
@@ -120,6 +121,71 @@ class TestSingleBlock(TestCase):
             block.verify()
 
 
+class TestMerkleBlock(TestCase):
+    def setUp(self):
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+
+        self.operations = [Operation(OperationRev(), 'http://example{}.com/'.format(i), [self.public_key])
+                           for i in range(5)]
+        for op in self.operations:
+            sign_object(self.public_key, self.private_key, op)
+
+        self.block = Block.from_operations_list(BlockRev(), int(time.time()), self.operations, Block.MERKLE_VERSION)
+        self.block.operations_limit = 5
+        self.block.mine()
+        sign_object(self.public_key, self.private_key, self.block)
+
+    def test_header(self):
+        unmined_raw = self.block.unmined_raw()
+
+        self.assertEqual(len(unmined_raw), Block.HEADER_SIZE)
+        self.assertEqual(unmined_raw[:4], b'\x00\x00\x00\x02')
+        self.assertEqual(self.block.unsigned_raw(), unmined_raw + double_sha(unmined_raw) + b''.join(
+            op.id for op in self.operations))
+
+        op = Operation(OperationRev(), 'http://example5.com/', [self.public_key])
+        sign_object(self.public_key, self.private_key, op)
+        self.block.extend_operations([op])
+        self.assertEqual(len(self.block.unmined_raw()), Block.HEADER_SIZE)
+        self.assertNotEqual(self.block.unmined_raw()[48:80], unmined_raw[48:80])
+
+    def test_from_raw(self):
+        new_block = Block.from_raw_with_operations(self.block.raw_with_operations())
+
+        self.assertEqual(new_block.version, Block.MERKLE_VERSION)
+        self.assertEqual(new_block.operations_ids, self.block.operations_ids)
+        self.assertEqual(new_block.merkle_root, self.block.merkle_root)
+        self.assertEqual(new_block.id, self.block.id)
+        self.assertTrue(new_block.verify())
+
+    def test_mangled_raw(self):
+        raw = bytearray(self.block.raw())
+        raw[Block.HEADER_SIZE + 32] ^= 1  # the first operation id
+
+        with self.assertRaisesRegex(RawFormatError, "merkle root mismatch"):
+            Block.from_raw(bytes(raw))
+
+        with self.assertRaisesRegex(Block.VerifyError, "unknown block version"):
+            Block(BlockRev(), 0, [], 3)
+
+    def test_operation_proof(self):
+        unmined_raw = self.block.unmined_raw()
+
+        for op in self.operations:
+            proof = self.block.operation_proof(op.id)
+            self.assertTrue(Block.verify_operation_proof(unmined_raw, op.id, proof))
+            self.assertFalse(Block.verify_operation_proof(unmined_raw, double_sha(op.id), proof))
+
+        with self.assertRaises(ValueError):
+            self.block.operation_proof(double_sha(b'missing'))
+
+        proof = self.block.operation_proof(self.operations[0].id)
+        legacy_block = Block.from_operations_list(BlockRev(), 0, self.operations)
+        self.assertEqual(legacy_block.operation_proof(self.operations[0].id), proof)
+        self.assertFalse(Block.verify_operation_proof(legacy_block.unmined_raw(), self.operations[0].id, proof))
+
+
 class TestOperationsLimits(TestCase):
     def setUp(self):
         self.private_key = SigningKey.generate()
@@ -153,6 +219,90 @@ class TestOperationsLimits(TestCase):
         with self.assertRaisesRegex(Block.VerifyError, "operations_limit out of range"):
             block.verify()
 
+    def test_chain_parameters(self):
+        default = get_chain_parameters()
+        try:
+            set_chain_parameters(ChainParameters(min_operations=1, max_operations=Block.MAX_OPERATIONS + 1))
+
+            block = Block.from_operations_list(BlockRev(), int(time.time()), self.operations[:1])
+            self.assertEqual(block.operations_limit, Block.MAX_OPERATIONS + 1)
+            block.mine()
+            sign_object(self.public_key, self.private_key, block)
+            self.assertTrue(block.verify())
+        finally:
+            set_chain_parameters(default)
+
+        with self.assertRaisesRegex(Block.VerifyError, "operations_limit out of range"):
+            block.verify()
+
+    def test_extend_operations(self):
+        operations = [Operation(OperationRev(), 'http://example{}.com/'.format(i), [self.public_key]) for i in range(3)]
+        for op in operations:
+            sign_object(self.public_key, self.private_key, op)
+        block = Block.from_operations_list(BlockRev(), int(time.time()), operations[:1])
+
+        with self.assertRaisesRegex(Block.VerifyError, "some of the new operations have been added to the block"):
+            block.extend_operations(operations[:2])
+        with self.assertRaisesRegex(Block.VerifyError, "some of the new operations have been added to the block"):
+            block.extend_operations([operations[1], operations[1]])
+
+        block.extend_operations(op for op in operations[1:])
+        self.assertEqual(block.operations, tuple(operations))
+        self.assertEqual(block.operations_ids, [op.id for op in operations])
+
+
+class TestCompactBlock(TestCase):
+    def setUp(self):
+        initialise_database('test_database_file')
+
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+
+        self.operations = [Operation(OperationRev(), 'http://example{}.com/'.format(i), [self.public_key])
+                           for i in range(3)]
+        for op in self.operations:
+            sign_object(self.public_key, self.private_key, op)
+
+        self.block = Block.from_operations_list(BlockRev(), int(time.time()), self.operations)
+        self.block.mine()
+        sign_object(self.public_key, self.private_key, self.block)
+
+    def test_rebuild(self):
+        compact_block = CompactBlock(self.block.raw())
+
+        self.assertEqual(compact_block.id, self.block.id)
+        self.assertEqual(compact_block.operations_ids, self.block.operations_ids)
+        self.assertEqual(compact_block.fill({op.id: op for op in self.operations[1:]}), [self.operations[0].id])
+        self.assertFalse(compact_block.is_complete())
+
+        with self.assertRaisesRegex(CompactBlock.IncompleteError, "some of the operations are missing"):
+            compact_block.to_block()
+
+        compact_block.add_operations(self.operations[:1])
+        block = compact_block.to_block()
+
+        self.assertEqual(block.id, self.block.id)
+        self.assertEqual(block.operations_full_raw(), self.block.operations_full_raw())
+
+    def test_operations_from_database(self):
+        self.block.put()
+
+        compact_block = CompactBlock(self.block.raw())
+
+        self.assertEqual(compact_block.fill({}), [])
+        self.assertEqual(compact_block.to_block().id, self.block.id)
+
+    def test_wrong_operations(self):
+        with self.assertRaisesRegex(Block.VerifyError, "wrong given operations list"):
+            Block.from_raw_and_operations(self.block.raw(), self.operations[:2])
+
+        with self.assertRaisesRegex(Block.VerifyError, "wrong given operations list"):
+            Block.from_raw_and_operations(self.block.raw(), list(reversed(self.operations)))
+
+    def tearDown(self):
+        close_database()
+        os.remove('test_database_file')
+
 
 class TestBlockNoDatabase(TestCase):
     def test_no_database(self):
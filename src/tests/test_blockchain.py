@@ -5,11 +5,13 @@ from uuid import uuid4
 from ecdsa.keys import SigningKey
 from pmpi.block import Block, BlockRev
 from pmpi.blockchain import BlockChain
-from pmpi.core import initialise_database, close_database, get_blockchain
+from pmpi.core import initialise_database, close_database, get_blockchain, get_database
+from pmpi.database import Database
 from pmpi.identifier import Identifier
 from pmpi.operation import Operation, OperationRev
 from pmpi.utils import sign_object
 from pmpi.public_key import PublicKey
+from pmpi.state_tree import StateTree
 
 patch.object = patch.object
 
@@ -106,6 +108,26 @@ class TestBlockChain(TestCase):
 
         return blocks
 
+    @staticmethod
+    def reopen_as_legacy_database():
+        """
+        Reopen the database rewritten as by the versions which didn't record the format -- with the containing blocks
+        kept inside the records of operations, without the identifiers' history and undo records.
+        """
+        database = get_database()
+        for operation_id in database.keys(Database.OPERATIONS):
+            raw = database.get(Database.OPERATIONS, operation_id)
+            containing_blocks = Operation.get_containing_blocks(operation_id)
+            database.put(Database.OPERATIONS, operation_id, len(raw).to_bytes(4, 'big') + raw +
+                         len(containing_blocks).to_bytes(4, 'big') + b''.join(containing_blocks))
+        for dbname in (Database.OPERATIONS_BLOCKS, Database.IDENTIFIERS_HISTORY, Database.IDENTIFIERS_UNDO):
+            for key in database.keys(dbname):
+                database.delete(dbname, key)
+        database.delete(Database.META, Database.FORMAT_KEY)
+
+        close_database()
+        initialise_database('test_database_file')
+
     def test_build_blocks(self):
         blocks = self.add_blocks(self.add_operations())
 
@@ -212,6 +234,322 @@ class TestBlockChain(TestCase):
         self.assertCountEqual([op.uuid for op in blocks[0].operations + blocks[2].operations[1:2]],
                               Identifier.get_uuid_list())
 
+    def test_reorganisation(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        def current_operations():
+            return {uuid: Identifier.get(uuid).operation_rev.id for uuid in Identifier.get_uuid_list()}
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks[:4]):
+            bc.update_blocks()
+
+        self.assertEqual(bc.head, blocks[3].id)
+        self.assertEqual(current_operations(), {ops[0].uuid: ops[8].id, ops[1].uuid: ops[4].id, ops[5].uuid: ops[5].id})
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=[blocks[4], blocks[6]]):
+            bc.update_blocks()
+
+        self.assertEqual(bc.head, blocks[6].id)
+        self.assertEqual(current_operations(), {ops[0].uuid: ops[8].id, ops[1].uuid: ops[4].id, ops[5].uuid: ops[9].id})
+
+        with self.assertRaises(Identifier.DoesNotExist):
+            Identifier.pop_undo_record(blocks[3].id)  # undo record of the abandoned block has been used
+
+        self.assertEqual(Identifier.pop_undo_record(blocks[6].id), [(ops[0].uuid, ops[6].id), (ops[5].uuid, ops[7].id)])
+
+    def test_reorganisation_without_undo_records(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks[:4]):
+            bc.update_blocks()
+
+        for block in blocks[:4]:  # blocks connected before undo records were stored
+            Identifier.pop_undo_record(block.id)
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=[blocks[4], blocks[6]]):
+            bc.update_blocks()
+
+        self.assertEqual(bc.head, blocks[6].id)
+        self.assertEqual({uuid: Identifier.get(uuid).operation_rev.id for uuid in Identifier.get_uuid_list()},
+                         {ops[0].uuid: ops[8].id, ops[1].uuid: ops[4].id, ops[5].uuid: ops[9].id})
+        self.assertEqual(bc.state_root, StateTree((uuid, Identifier.get_operation_id(uuid))
+                                                  for uuid in Identifier.get_uuid_list()).root)
+
+    def test_legacy_head_removal(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks[:4]):
+            get_blockchain().update_blocks()
+
+        self.reopen_as_legacy_database()
+
+        blocks[3].remove()  # disconnected when the block isn't in the database any more
+
+        bc = get_blockchain()
+        self.assertEqual(bc.head, blocks[2].id)
+        self.assertEqual({uuid: Identifier.get(uuid).operation_rev.id for uuid in Identifier.get_uuid_list()},
+                         {ops[0].uuid: ops[6].id, ops[1].uuid: ops[3].id, ops[5].uuid: ops[5].id})
+
+    def test_containing_blocks(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks):
+            bc.update_blocks()
+
+        self.assertCountEqual(ops[4].containing_blocks, [blocks[3].id, blocks[4].id])
+        self.assertCountEqual(ops[9].containing_blocks, [blocks[5].id, blocks[6].id])
+        self.assertEqual(Operation.get(ops[4].id).raw(), ops[4].raw())
+
+        with self.assertRaisesRegex(Operation.DuplicationError, "operation is already contained by the block"):
+            ops[4].put(blocks[3].get_rev())
+
+        blocks[5].remove()
+        blocks[3].remove()
+
+        self.assertEqual(ops[4].containing_blocks, (blocks[4].id,))
+        self.assertEqual(ops[9].containing_blocks, (blocks[6].id,))
+        self.assertTrue(Operation.exist(ops[4].id))
+
+        blocks[6].remove()
+        blocks[4].remove()
+
+        self.assertEqual(ops[4].containing_blocks, ())
+        self.assertFalse(Operation.exist(ops[4].id))
+        self.assertFalse(Operation.exist(ops[9].id))
+
+    def test_minting_checked_against_history(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks[:1]):
+            bc.update_blocks()
+
+        copied_op = Operation(OperationRev(), ops[0].address, ops[0].owners)
+        sign_object(self.public_keys[1], self.private_keys[1], copied_op)
+        self.assertEqual(copied_op.uuid, ops[0].uuid)
+        self.assertNotEqual(copied_op.id, ops[0].id)
+
+        block = Block.from_operations_list(blocks[0].get_rev(), 100, [ops[3], copied_op])
+        block.mine()
+        sign_object(self.public_keys[0], self.private_keys[0], block)
+
+        with self.assertRaisesRegex(Operation.VerifyError, "trying to create a minting operation for an existing uuid"):
+            block.put()
+
+    def test_legacy_operations(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks[:6]):
+            get_blockchain().update_blocks()
+
+        self.reopen_as_legacy_database()
+
+        self.assertEqual(get_blockchain().head, blocks[5].id)
+        self.assertEqual(Operation.get(ops[4].id).raw(), ops[4].raw())
+        self.assertCountEqual(ops[4].containing_blocks, [blocks[3].id, blocks[4].id])
+        self.assertEqual(ops[0].containing_blocks, (blocks[0].id,))
+
+        blocks[4].remove()
+
+        self.assertEqual(ops[4].containing_blocks, (blocks[3].id,))
+        self.assertTrue(Operation.exist(ops[4].id))
+
+        # upgraded once -- records are read as they are from now on
+        close_database()
+        initialise_database('test_database_file')
+        self.assertEqual(Operation.get(ops[8].id).raw(), ops[8].raw())
+
+    def test_legacy_minting_check(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks[:2]):
+            get_blockchain().update_blocks()
+
+        self.reopen_as_legacy_database()
+
+        self.assertEqual(Identifier.get_history(ops[0].uuid),
+                         [(1, blocks[0].id, ops[0].id), (2, blocks[1].id, ops[6].id)])
+
+        copied_op = Operation(OperationRev(), ops[0].address, ops[0].owners)
+        sign_object(self.public_keys[1], self.private_keys[1], copied_op)
+
+        block = Block.from_operations_list(blocks[1].get_rev(), 100, [ops[3], copied_op])
+        block.mine()
+        sign_object(self.public_keys[0], self.private_keys[0], block)
+
+        with self.assertRaisesRegex(Operation.VerifyError, "trying to create a minting operation for an existing uuid"):
+            block.put()
+
+    def test_resolve_at(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks):
+            bc.update_blocks()
+
+        for uuid, block_id_or_depth, op in (
+                (ops[0].uuid, 1, ops[0]),
+                (ops[0].uuid, 2, ops[6]),
+                (ops[0].uuid, 3, ops[6]),
+                (ops[0].uuid, 5, ops[8]),
+                (ops[1].uuid, 3, ops[3]),
+                (ops[1].uuid, 4, ops[4]),
+                (ops[5].uuid, 5, ops[9]),
+                (ops[5].uuid, blocks[2].id, ops[5]),
+                (ops[0].uuid, blocks[4].id, ops[6]),
+                (ops[1].uuid, blocks[4].id, ops[4]),
+                (ops[5].uuid, blocks[4].id, ops[7]),
+                (ops[0].uuid, blocks[6].id, ops[8]),
+                (ops[5].uuid, blocks[6].id, ops[9])
+        ):
+            self.assertEqual(Identifier.resolve_at(uuid, block_id_or_depth).operation_rev.id, op.id)
+
+        with self.assertRaises(Identifier.DoesNotExist):
+            Identifier.resolve_at(ops[5].uuid, 2)
+
+        with self.assertRaises(Block.DoesNotExist):
+            Identifier.resolve_at(ops[0].uuid, 6)
+
+        blocks[5].remove()  # head moves to the other branch
+
+        self.assertEqual(bc.head, blocks[6].id)
+        self.assertEqual(Identifier.resolve_at(ops[5].uuid, 5).operation_rev.id, ops[9].id)
+        self.assertEqual(Identifier.resolve_at(ops[5].uuid, 4).operation_rev.id, ops[7].id)
+        self.assertEqual(Identifier.resolve_at(ops[5].uuid, blocks[3].id).operation_rev.id, ops[5].id)
+
+    def test_legacy_resolve_at(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks[:6]):
+            get_blockchain().update_blocks()
+
+        self.reopen_as_legacy_database()
+
+        for uuid, block_id_or_depth, op in (
+                (ops[0].uuid, 1, ops[0]),
+                (ops[0].uuid, 5, ops[8]),
+                (ops[1].uuid, 3, ops[3]),
+                (ops[0].uuid, blocks[4].id, ops[6]),
+                (ops[1].uuid, blocks[4].id, ops[4]),
+                (ops[5].uuid, blocks[4].id, ops[7])
+        ):
+            self.assertEqual(Identifier.resolve_at(uuid, block_id_or_depth).operation_rev.id, op.id)
+
+        self.assertEqual(get_blockchain().resolve_operation_ids([ops[0].uuid, ops[5].uuid], blocks[4].id),
+                         {ops[0].uuid: ops[6].id, ops[5].uuid: ops[7].id})
+
+    def test_resolve_operation_ids(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks):
+            bc.update_blocks()
+
+        uuids = [ops[0].uuid, ops[1].uuid, ops[5].uuid]
+        self.assertEqual(bc.resolve_operation_ids(uuids, blocks[5].id),
+                         dict(zip(uuids, [ops[8].id, ops[4].id, ops[9].id])))
+        self.assertEqual(bc.resolve_operation_ids(uuids, blocks[4].id),
+                         dict(zip(uuids, [ops[6].id, ops[4].id, ops[7].id])))
+        self.assertEqual(bc.resolve_operation_ids(uuids, blocks[0].id), dict(zip(uuids, [ops[0].id, ops[1].id, None])))
+
+    def test_verify_on_head(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks):
+            bc.update_blocks()
+
+        stale_op = Operation(ops[6].get_rev(), 'http://example1.com/stale/', [self.public_keys[0]])
+        sign_object(self.public_keys[0], self.private_keys[0], stale_op)
+        block = Block.from_operations_list(blocks[5].get_rev(), 142, [stale_op])
+        block.mine()
+        sign_object(self.public_keys[0], self.private_keys[0], block)
+
+        with self.assertRaisesRegex(Block.ChainError, "operation's previous_operation_rev is not pointing at "
+                                                      "the last operation on current blockchain"):
+            block.verify()
+
+        new_ops = [Operation(ops[8].get_rev(), 'http://example1.com/v5/', [self.public_keys[2]]),
+                   Operation(ops[4].get_rev(), 'http://example2.com/v4/', [self.public_keys[1]])]
+        sign_object(self.public_keys[2], self.private_keys[2], new_ops[0])
+        sign_object(self.public_keys[1], self.private_keys[1], new_ops[1])
+        block = Block.from_operations_list(blocks[5].get_rev(), 142, new_ops)
+        block.mine()
+        sign_object(self.public_keys[0], self.private_keys[0], block)
+
+        self.assertTrue(block.verify())
+
+    def test_header_hashed_once_per_block(self):
+        bc = get_blockchain()
+        previous_block_rev = BlockRev()
+        unmined_raw_calls = []
+
+        for size in (2, Block.MAX_OPERATIONS):
+            operations = [Operation(OperationRev(), 'http://example{}.com/{}'.format(i, size), [self.public_keys[0]])
+                          for i in range(size)]
+            for op in operations:
+                sign_object(self.public_keys[0], self.private_keys[0], op)
+            block = Block.from_operations_list(previous_block_rev, 42 + size, operations)
+            block.mine()
+            sign_object(self.public_keys[0], self.private_keys[0], block)
+            previous_block_rev = block.get_rev()
+
+            with patch.object(Block, 'unmined_raw', autospec=True, side_effect=Block.unmined_raw) as unmined_raw, \
+                    patch.object(BlockChain, '_get_new_blocks', return_value=[block]):
+                bc.update_blocks()
+            unmined_raw_calls.append(unmined_raw.call_count)
+
+        # the header (containing all the operations' ids) isn't hashed again for every operation
+        self.assertEqual(unmined_raw_calls[0], unmined_raw_calls[1])
+        self.assertEqual(bc.head, block.id)
+
+    def test_state_tree(self):
+        ops = self.add_operations()
+        blocks = self.add_blocks(ops)
+        bc = get_blockchain()
+
+        def state_root():
+            return StateTree((uuid, Identifier.get_operation_id(uuid)) for uuid in Identifier.get_uuid_list()).root
+
+        self.assertEqual(bc.state_root, StateTree().root)
+
+        with patch.object(BlockChain, '_get_new_blocks', return_value=blocks):
+            bc.update_blocks()
+
+        self.assertEqual(bc.state_root, state_root())
+        self.assertEqual(BlockChain().state_root, bc.state_root)  # rebuilt from the database
+        for uuid in {op.uuid for op in ops}:
+            proof = bc.state_proof(uuid)
+            self.assertTrue(proof.verify(bc.state_root, Identifier.get_operation_id(uuid)))
+        self.assertTrue(bc.state_proof(uuid4()).verify(bc.state_root, None))
+
+        head_root = bc.state_root
+        blocks[5].remove()  # head moves to the other branch
+
+        self.assertEqual(bc.head, blocks[6].id)
+        self.assertEqual(bc.state_root, state_root())
+        self.assertTrue(bc.state_proof(ops[5].uuid).verify(bc.state_root, ops[9].id))
+
+        blocks[6].remove()
+
+        self.assertNotEqual(bc.state_root, head_root)
+        self.assertEqual(bc.state_root, state_root())
+        self.assertFalse(bc.state_proof(ops[5].uuid).verify(bc.state_root, ops[9].id))
+
     def test_wrong_operations(self):
         operations = self.add_operations()
         blocks = self.add_blocks(operations)
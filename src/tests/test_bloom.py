@@ -0,0 +1,36 @@
+from unittest import TestCase
+from pmpi.bloom import BloomFilter
+from pmpi.utils import double_sha
+
+
+class TestBloomFilter(TestCase):
+    def setUp(self):
+        self.keys = [double_sha(str(i).encode()) for i in range(2000)]
+        self.other_keys = [double_sha(str(-i).encode()) for i in range(1, 2001)]
+        self.bloom_filter = BloomFilter.from_keys(self.keys)
+
+    def test_contains(self):
+        for key in self.keys:
+            self.assertIn(key, self.bloom_filter)
+
+        false_positives = len([key for key in self.other_keys if key in self.bloom_filter])
+        self.assertLess(false_positives, len(self.other_keys) * BloomFilter.DEFAULT_ERROR_RATE * 3)
+
+    def test_raw(self):
+        new_filter = BloomFilter.from_raw(self.bloom_filter.raw())
+
+        for attr in ('capacity', 'size', 'hashes', 'count', 'stale'):
+            self.assertEqual(getattr(new_filter, attr), getattr(self.bloom_filter, attr))
+
+        for key in self.keys + self.other_keys:
+            self.assertEqual(key in new_filter, key in self.bloom_filter)
+
+    def test_saturation(self):
+        bloom_filter = BloomFilter(BloomFilter.MIN_CAPACITY)
+
+        for key in self.keys[:BloomFilter.MIN_CAPACITY]:
+            bloom_filter.add(key)
+        self.assertFalse(bloom_filter.is_saturated())
+
+        bloom_filter.add(self.keys[BloomFilter.MIN_CAPACITY])
+        self.assertTrue(bloom_filter.is_saturated())
@@ -1,8 +1,11 @@
 import os
 from unittest.case import TestCase
 from pmpi.abstract import AbstractRevision
-from pmpi.core import initialise_database, close_database, get_database
+from pmpi.block import Block
+from pmpi.core import initialise_database, close_database, get_database, ChainParameters, get_chain_parameters, \
+    set_chain_parameters
 import pmpi.database
+import pmpi.exceptions
 
 
 class TestDatabase(TestCase):
@@ -15,7 +18,31 @@ class TestDatabase(TestCase):
         for dbname in pmpi.database.Database.DBNAMES:
             self.assertEqual(self.db.length(dbname), 0)
 
+    def test_filters(self):
+        dbname = pmpi.database.Database.BLOCKS
+        keys = [bytes([i]) * 32 for i in range(3)]
+
+        for key in keys[:2]:
+            self.db.put(dbname, key, b'data')
+
+        self.db.delete(dbname, keys[1])
+
+        self.db.close()
+        self.db = pmpi.database.Database('test_database_file')
+
+        self.assertTrue(self.db.exist(dbname, keys[0]))
+        self.assertFalse(self.db.exist(dbname, keys[1]))
+        self.assertFalse(self.db.exist(dbname, keys[2]))
+        self.assertEqual(self.db.get(dbname, keys[0]), b'data')
+
+        with self.assertRaises(KeyError):
+            self.db.get(dbname, keys[2])
+
+        with self.assertRaises(pmpi.exceptions.ObjectDoesNotExist):
+            self.db.delete(dbname, keys[2])
+
     def tearDown(self):
+        self.db.close()
         os.remove('test_database_file')
 
 
@@ -39,6 +66,21 @@ class TestInitialiseDatabase(TestCase):
         os.remove('test_database_file')
         os.remove('test_database_file2')
 
+    def test_newer_format(self):
+        initialise_database('test_database_file')
+        get_database().put(pmpi.database.Database.META, pmpi.database.Database.FORMAT_KEY,
+                           (pmpi.database.Database.FORMAT + 1).to_bytes(4, 'big'))
+        close_database()
+
+        with self.assertRaisesRegex(pmpi.database.Database.InitialisationError,
+                                    "database format is newer than supported"):
+            initialise_database('test_database_file')
+
+        with self.assertRaisesRegex(pmpi.database.Database.InitialisationError, "initialise database first"):
+            get_database()
+
+        os.remove('test_database_file')
+
     def test_no_database(self):
         with self.assertRaisesRegex(pmpi.database.Database.InitialisationError, "initialise database first"):
             get_database()
@@ -48,3 +90,24 @@ class TestAbstractRevision(TestCase):
     def test_not_implemented(self):
         with self.assertRaises(NotImplementedError):
             AbstractRevision()._get_obj_from_database()
+
+
+class TestChainParameters(TestCase):
+    def test_defaults(self):
+        chain_parameters = ChainParameters()
+        self.assertEqual(chain_parameters.min_operations, Block.MIN_OPERATIONS)
+        self.assertEqual(chain_parameters.max_operations, Block.MAX_OPERATIONS)
+        self.assertEqual(ChainParameters(max_operations=10000).min_operations, Block.MIN_OPERATIONS)
+
+    def test_set(self):
+        default = get_chain_parameters()
+        try:
+            set_chain_parameters(ChainParameters(max_operations=10000))
+            self.assertEqual(get_chain_parameters().max_operations, 10000)
+        finally:
+            set_chain_parameters(default)
+
+    def test_wrong_limits(self):
+        for min_operations, max_operations in ((0, 10), (5, 4), (1, 1 << 32)):
+            with self.assertRaisesRegex(ChainParameters.ParametersError, "wrong limits of the number of operations"):
+                ChainParameters(min_operations, max_operations)
@@ -0,0 +1,145 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from ecdsa.keys import SigningKey
+from pmpi.block import Block, BlockRev
+from pmpi.blockchain import BlockChain
+from pmpi.core import initialise_database, close_database, get_blockchain
+from pmpi.mempool import Mempool
+from pmpi.operation import Operation, OperationRev
+from pmpi.public_key import PublicKey
+from pmpi.utils import sign_object
+
+
+class TestMempool(TestCase):
+    def setUp(self):
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+
+        self.mint = [self.sign(Operation(OperationRev(), 'http://example{}.com/'.format(i), [self.public_key]))
+                     for i in range(2)]
+        self.update = self.sign(Operation(self.mint[0].get_rev(), 'http://example0.com/v2/', [self.public_key]))
+        self.next_update = self.sign(Operation(self.update.get_rev(), 'http://example0.com/v3/', [self.public_key]))
+        self.conflicting = self.sign(Operation(self.mint[0].get_rev(), 'http://other.com/', [self.public_key]))
+
+        self.mempool = Mempool()
+
+    def sign(self, op):
+        sign_object(self.public_key, self.private_key, op)
+        return op
+
+    def test_add(self):
+        for op in self.mint + [self.update, self.next_update]:
+            self.mempool.add(op)
+
+        self.assertEqual(len(self.mempool), 4)
+        self.assertIn(self.update.id, self.mempool)
+        self.assertNotIn(self.conflicting.id, self.mempool)
+        self.assertEqual(self.mempool[self.update.id], self.update)
+        self.assertEqual(list(self.mempool), self.mint + [self.update, self.next_update])
+        self.assertEqual(self.mempool.get_by_uuid(self.mint[0].uuid), [self.mint[0], self.update, self.next_update])
+        self.assertEqual(self.mempool.get_successor(self.mint[0].id), self.update)
+        self.assertEqual(self.mempool.get_minting(self.mint[1].uuid), self.mint[1])
+        self.assertIsNone(self.mempool.get_successor(self.next_update.id))
+
+        with self.assertRaisesRegex(Mempool.DuplicationError, "operation is already in the pool"):
+            self.mempool.add(self.update)
+
+        with self.assertRaisesRegex(Mempool.ConflictError, "another operation pointing at the same revision"):
+            self.mempool.add(self.conflicting)
+
+        other_private_key = SigningKey.generate()
+        copied_mint = Operation(OperationRev(), self.mint[1].address, [self.public_key])
+        sign_object(PublicKey.from_signing_key(other_private_key), other_private_key, copied_mint)
+        self.assertNotEqual(copied_mint.id, self.mint[1].id)
+        with self.assertRaisesRegex(Mempool.ConflictError, "another operation pointing at the same revision"):
+            self.mempool.add(copied_mint)
+
+    def test_remove(self):
+        for op in self.mint + [self.update, self.next_update]:
+            self.mempool.add(op)
+
+        self.assertEqual(self.mempool.remove(self.update.id), [self.update, self.next_update])
+        self.assertEqual(list(self.mempool), self.mint)
+        self.assertEqual(self.mempool.get_by_uuid(self.mint[0].uuid), [self.mint[0]])
+
+        self.mempool.add(self.conflicting)
+        self.assertEqual(self.mempool.get_successor(self.mint[0].id), self.conflicting)
+
+    def test_remove_confirmed(self):
+        for op in self.mint + [self.conflicting]:
+            self.mempool.add(op)
+
+        removed = self.mempool.remove_confirmed([self.mint[0], self.update])
+
+        self.assertCountEqual(removed, [self.mint[0], self.conflicting])
+        self.assertEqual(list(self.mempool), [self.mint[1]])
+
+        self.mempool.add(self.next_update)
+        self.assertEqual(self.mempool.remove_confirmed([self.mint[1]]), [self.mint[1]])
+        self.assertEqual(list(self.mempool), [self.next_update])
+
+    def test_eviction(self):
+        self.mempool = Mempool(max_size=3)
+
+        for op in [self.mint[0], self.update, self.mint[1]]:
+            self.mempool.add(op)
+
+        self.mempool.add(self.next_update)  # evicts mint[0] together with the update built on it
+
+        self.assertEqual(list(self.mempool), [self.mint[1], self.next_update])
+
+
+class TestBlockTemplate(TestCase):
+    def setUp(self):
+        initialise_database('test_database_file')
+
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+
+        self.mint = [self.sign(Operation(OperationRev(), 'http://example{}.com/'.format(i), [self.public_key]))
+                     for i in range(3)]
+        self.update = self.sign(Operation(self.mint[0].get_rev(), 'http://example0.com/v2/', [self.public_key]))
+        self.next_update = self.sign(Operation(self.update.get_rev(), 'http://example0.com/v3/', [self.public_key]))
+
+        other_private_key = SigningKey.generate()
+        self.copied_mint = Operation(OperationRev(), self.mint[1].address, [self.public_key])
+        sign_object(PublicKey.from_signing_key(other_private_key), other_private_key, self.copied_mint)
+
+        self.add_block(Block.from_operations_list(BlockRev(), 42, self.mint[:2]))
+
+        self.mempool = Mempool()
+        for op in (self.update, self.next_update, self.copied_mint, self.mint[2]):
+            self.mempool.add(op)
+
+    def sign(self, op):
+        sign_object(self.public_key, self.private_key, op)
+        return op
+
+    def add_block(self, block):
+        block.mine()
+        self.sign(block)
+        with patch.object(BlockChain, '_get_new_blocks', return_value=[block]):
+            get_blockchain().update_blocks()
+
+    def test_select_operations(self):
+        self.assertEqual(self.mempool.select_operations(10), [self.update, self.next_update, self.mint[2]])
+        self.assertEqual(self.mempool.select_operations(2), [self.update, self.next_update])
+
+    def test_build_block(self):
+        block = self.mempool.build_block(43, 3)
+
+        self.assertEqual(block.previous_block_rev.id, get_blockchain().head)
+        self.assertEqual(block.operations, (self.update, self.next_update, self.mint[2]))
+        self.assertEqual(block.operations_limit, 3)
+
+        self.add_block(block)
+        self.mempool.remove_confirmed(block.operations)
+
+        self.assertEqual(get_blockchain().head, block.id)
+        self.assertEqual(list(self.mempool), [self.copied_mint])
+        self.assertIsNone(self.mempool.build_block(44))
+
+    def tearDown(self):
+        close_database()
+        os.remove('test_database_file')
@@ -0,0 +1,52 @@
+from unittest import TestCase
+from pmpi.exceptions import RawFormatError
+from pmpi.merkle import MerkleTree, MerkleProof, merkle_root, EMPTY_ROOT
+from pmpi.utils import double_sha
+
+
+class TestMerkleTree(TestCase):
+    def setUp(self):
+        self.ids = [double_sha(i.to_bytes(4, 'big')) for i in range(13)]
+
+    def test_root(self):
+        a, b, c = self.ids[:3]
+
+        self.assertEqual(merkle_root([]), EMPTY_ROOT)
+        self.assertEqual(merkle_root([a]), a)
+        self.assertEqual(merkle_root([a, b]), double_sha(a + b))
+        self.assertEqual(merkle_root([a, b, c]), double_sha(double_sha(a + b) + c))
+        self.assertNotEqual(merkle_root([a, b, c]), merkle_root([a, b, c, c]))
+        self.assertNotEqual(merkle_root([a, b]), merkle_root([b, a]))
+
+    def test_proofs(self):
+        for count in range(1, len(self.ids) + 1):
+            tree = MerkleTree(self.ids[:count])
+            for index in range(count):
+                proof = tree.proof(index)
+                self.assertLessEqual(len(proof.hashes), count.bit_length())
+                self.assertTrue(proof.verify(self.ids[index], tree.root))
+                self.assertFalse(proof.verify(self.ids[(index + 1) % len(self.ids)], tree.root))
+                self.assertFalse(proof.verify(self.ids[index], double_sha(tree.root)))
+
+        with self.assertRaises(IndexError):
+            MerkleTree(self.ids).proof(len(self.ids))
+
+    def test_wrong_proofs(self):
+        tree = MerkleTree(self.ids)
+        proof = tree.proof(4)
+
+        for wrong_proof in (MerkleProof(5, proof.count, proof.hashes),
+                            MerkleProof(proof.index, 5, proof.hashes),
+                            MerkleProof(proof.index, proof.count, proof.hashes[:-1]),
+                            MerkleProof(proof.index, proof.count, proof.hashes + (tree.root,)),
+                            MerkleProof(proof.count, proof.count, proof.hashes)):
+            self.assertFalse(wrong_proof.verify(self.ids[4], tree.root))
+
+    def test_raw(self):
+        proof = MerkleTree(self.ids).proof(7)
+        self.assertEqual(MerkleProof.from_raw(proof.raw()), proof)
+
+        with self.assertRaisesRegex(RawFormatError, "raw input too short"):
+            MerkleProof.from_raw(proof.raw()[:-1])
+        with self.assertRaisesRegex(RawFormatError, "raw input too long"):
+            MerkleProof.from_raw(proof.raw() + b'\x00')
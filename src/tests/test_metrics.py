@@ -0,0 +1,162 @@
+import os
+from unittest import TestCase
+from urllib.error import HTTPError
+from urllib.request import urlopen
+from ecdsa.keys import SigningKey
+from pmpi.block import Block, BlockRev
+from pmpi.core import initialise_database, close_database
+from pmpi.database import Database
+from pmpi.operation import Operation, OperationRev
+from pmpi.public_key import PublicKey
+from pmpi.sync import SyncEngine
+from pmpi.utils import sign_object
+import pmpi.metrics
+from pmpi.metrics import Registry, Counter, Gauge, Histogram
+
+
+class TestRegistry(TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_exposition(self):
+        counter = Counter('test_reads', "Reads.", ['database'], registry=self.registry)
+        gauge = Gauge('test_depth', "Depth\nof the head.", registry=self.registry)
+        histogram = Histogram('test_seconds', "Time.", registry=self.registry, buckets=(0.1, 1))
+
+        counter.labels('blocks').inc()
+        counter.labels('blocks').inc(2)
+        counter.labels('a"b').inc()
+        gauge.set(7)
+        gauge.dec()
+        for value in (0.05, 0.1, 0.5, 3):
+            histogram.observe(value)
+
+        self.assertEqual(self.registry.exposition(), '\n'.join([
+            '# HELP test_reads Reads.',
+            '# TYPE test_reads counter',
+            'test_reads_total{database="a\\"b"} 1',
+            'test_reads_total{database="blocks"} 3',
+            '# HELP test_depth Depth\\nof the head.',
+            '# TYPE test_depth gauge',
+            'test_depth 6',
+            '# HELP test_seconds Time.',
+            '# TYPE test_seconds histogram',
+            'test_seconds_bucket{le="0.1"} 2',
+            'test_seconds_bucket{le="1"} 3',
+            'test_seconds_bucket{le="+Inf"} 4',
+            'test_seconds_sum 3.65',
+            'test_seconds_count 4',
+        ]) + '\n')
+
+    def test_errors(self):
+        counter = Counter('test_counter', "Counter.", registry=self.registry)
+        labeled = Counter('test_labeled', "Labeled counter.", ['a', 'b'], registry=self.registry)
+
+        with self.assertRaisesRegex(ValueError, "already registered"):
+            Counter('test_counter', "Counter.", registry=self.registry)
+        with self.assertRaisesRegex(ValueError, "can only be increased"):
+            counter.inc(-1)
+        with self.assertRaisesRegex(ValueError, "wrong number of label values"):
+            labeled.labels('x')
+        with self.assertRaisesRegex(ValueError, "use labels"):
+            labeled.inc()
+        with self.assertRaisesRegex(ValueError, "buckets must be sorted"):
+            Histogram('test_histogram', "Histogram.", registry=self.registry, buckets=(2, 1))
+
+    def test_timed(self):
+        histogram = Histogram('test_seconds', "Time.", registry=self.registry)
+
+        @pmpi.metrics.timed(histogram)
+        def function(x):
+            return 2 * x
+
+        self.assertEqual(function(21), 42)
+        self.assertEqual(histogram.count, 0)
+
+        pmpi.metrics.enable()
+        self.assertEqual(function(21), 42)
+        self.assertEqual(histogram.count, 1)
+
+    def test_http_server(self):
+        Counter('test_counter', "Counter.", registry=self.registry).inc()
+        server = pmpi.metrics.start_http_server(0, registry=self.registry)
+        try:
+            self.assertTrue(pmpi.metrics.enabled)
+            url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+
+            with urlopen(url + '/metrics') as response:
+                self.assertTrue(response.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+                self.assertIn('test_counter_total 1\n', response.read().decode())
+
+            with self.assertRaises(HTTPError):
+                urlopen(url + '/other')
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def tearDown(self):
+        pmpi.metrics.disable()
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        initialise_database('test_database_file')
+
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+
+    def build_chain(self, previous_block_rev, length, branch=0):
+        blocks = []
+        for i in range(length):
+            operations = [Operation(OperationRev(), 'http://example{}.com/{}/{}'.format(j, branch, i), [self.public_key])
+                          for j in range(2)]
+            for op in operations:
+                sign_object(self.public_key, self.private_key, op)
+            block = Block.from_operations_list(previous_block_rev, 42 + i, operations)
+            block.mine()
+            sign_object(self.public_key, self.private_key, block)
+            blocks.append(block)
+            previous_block_rev = block.get_rev()
+        return blocks
+
+    def test_disabled(self):
+        accepted = pmpi.metrics.BLOCKS_ACCEPTED.value
+        writes = pmpi.metrics.DATABASE_WRITES.labels(Database.BLOCKS).value
+
+        SyncEngine().apply_blocks(self.build_chain(BlockRev(), 2))
+
+        self.assertEqual(pmpi.metrics.BLOCKS_ACCEPTED.value, accepted)
+        self.assertEqual(pmpi.metrics.DATABASE_WRITES.labels(Database.BLOCKS).value, writes)
+
+    def test_enabled(self):
+        blocks = self.build_chain(BlockRev(), 3)
+        fork = self.build_chain(blocks[0].get_rev(), 3, branch=1)
+
+        pmpi.metrics.enable()
+        accepted = pmpi.metrics.BLOCKS_ACCEPTED.value
+        rejected = pmpi.metrics.BLOCKS_REJECTED.value
+        writes = pmpi.metrics.DATABASE_WRITES.labels(Database.BLOCKS).value
+        verifications = pmpi.metrics.SIGNATURE_VERIFICATIONS.labels('Block').value
+        block_puts = pmpi.metrics.BLOCK_PUT_SECONDS.count
+        reorgs = pmpi.metrics.REORG_DEPTH.count
+        reorg_depths = pmpi.metrics.REORG_DEPTH.sum
+
+        SyncEngine().apply_blocks(blocks)
+        SyncEngine().apply_blocks(fork)
+        with self.assertRaises(Block.DuplicationError):
+            SyncEngine().apply_blocks(blocks[-1:])
+        Block.from_raw(blocks[0].raw())
+
+        self.assertEqual(pmpi.metrics.BLOCKS_ACCEPTED.value, accepted + 6)
+        self.assertEqual(pmpi.metrics.BLOCKS_REJECTED.value, rejected + 1)
+        self.assertEqual(pmpi.metrics.DATABASE_WRITES.labels(Database.BLOCKS).value, writes + 6)
+        self.assertEqual(pmpi.metrics.SIGNATURE_VERIFICATIONS.labels('Block').value, verifications + 1)
+        self.assertEqual(pmpi.metrics.BLOCK_PUT_SECONDS.count, block_puts + 7)
+        self.assertEqual(pmpi.metrics.REORG_DEPTH.count, reorgs + 1)
+        self.assertEqual(pmpi.metrics.REORG_DEPTH.sum, reorg_depths + 2)
+        self.assertEqual(pmpi.metrics.HEAD_DEPTH.value, 4)
+
+    def tearDown(self):
+        pmpi.metrics.disable()
+        close_database()
+        os.remove('test_database_file')
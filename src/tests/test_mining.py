@@ -0,0 +1,69 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+from unittest import TestCase
+from ecdsa.keys import SigningKey
+from pmpi.block import Block, BlockRev, find_padding, mining_target
+from pmpi.mining import Miner
+from pmpi.operation import Operation, OperationRev
+from pmpi.public_key import PublicKey
+from pmpi.utils import sign_object, double_sha
+
+
+class TestMining(TestCase):
+    def setUp(self):
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+
+        operations = [Operation(OperationRev(), 'http://example{}.com/'.format(i), [self.public_key])
+                      for i in range(2)]
+        for op in operations:
+            sign_object(self.public_key, self.private_key, op)
+
+        self.block = Block.from_operations_list(BlockRev(), int(time.time()), operations)
+        self.block.difficulty = 8
+
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(1)
+
+    def test_find_padding(self):
+        padding = find_padding(self.block.unmined_raw(), self.block.difficulty)
+
+        self.block.apply_padding(padding)
+        self.assertLessEqual(double_sha(self.block.unmined_raw()), mining_target(self.block.difficulty))
+        self.assertTrue(self.block.is_checksum_correct())
+
+        self.assertIsNone(find_padding(self.block.unmined_raw(), self.block.difficulty, 0, padding))
+
+        self.block.mine()
+        self.assertEqual(self.block.padding, padding)
+
+    def test_mine(self):
+        miner = Miner(self.executor, chunk_size=16, loop=self.loop)
+        block = self.loop.run_until_complete(miner.mine(self.block))
+
+        self.assertIs(block, self.block)
+        self.assertEqual(block.padding, find_padding(block.unmined_raw(), block.difficulty))
+
+        sign_object(self.public_key, self.private_key, block)
+        self.assertTrue(block.verify())
+
+    def test_cancel(self):
+        miner = Miner(self.executor, chunk_size=16, loop=self.loop)
+        self.block.difficulty = 64
+
+        task = miner.start(self.block)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+
+        self.assertTrue(miner.is_mining())
+        miner.cancel()
+        self.assertFalse(miner.is_mining())
+
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
+
+        self.assertFalse(self.block.is_checksum_correct())
+
+    def tearDown(self):
+        self.executor.shutdown()
+        self.loop.close()
@@ -8,10 +8,11 @@ from ecdsa.curves import NIST256p
 
 from ecdsa.keys import SigningKey
 
-from pmpi.block import BlockRev
+from pmpi.block import Block, BlockRev
 from pmpi.core import initialise_database, close_database
 import pmpi.database
 from pmpi.exceptions import RawFormatError
+from pmpi.identifier import Identifier
 from pmpi.operation import Operation, OperationRev
 from pmpi.utils import sign_object
 from pmpi.public_key import PublicKey
@@ -34,6 +35,20 @@ class TestSingleOperation(TestCase):
         self.assertEqual(self.operation.owners, (self.public_key,))
         self.assertEqual(self.operation.public_key, self.public_key)
 
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            self.operation.other_attribute = None
+        with self.assertRaises(AttributeError):
+            self.operation.get_rev().other_attribute = None
+
+        self.assertEqual(self.operation.owners_der, (self.public_key.der,))
+        self.assertIs(self.operation.owners_der, self.operation.owners_der)
+        self.assertIs(self.operation.owners_verifying_keys, self.operation.owners_verifying_keys)
+
+        op = Operation._from_raw_without_verifying(self.operation.raw())
+        self.assertEqual(op.owners_der, self.operation.owners_der)
+        self.assertEqual(op.owners[0].der, self.public_key.der)
+
     # noinspection PyPropertyAccess
     def test_immutable(self):
         with self.assertRaisesRegex(AttributeError, "can't set attribute"):
@@ -296,6 +311,13 @@ class TestOperationVerify(TestCase):
         sign_object(self.public_keys[0], self.private_keys[0], self.operation[0])
         self.operation[0].put()
 
+        # operations reach the database only inside blocks, whose identifiers' history is recorded first -- the minting
+        # check looks the uuid up there, so the history of a block containing the operation put above is recorded here
+        block = Block.from_operations_list(BlockRev(), 42, [self.operation[0]])
+        block.mine()
+        sign_object(self.public_keys[0], self.private_keys[0], block)
+        Identifier.put_history(block, 1)
+
         copied_op = Operation(self.operation[0].previous_operation_rev,
                               self.operation[0].address,
                               self.operation[0].owners)
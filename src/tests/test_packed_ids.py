@@ -0,0 +1,71 @@
+from unittest import TestCase
+from pmpi.packed_ids import PackedIds
+from pmpi.utils import double_sha
+
+
+class TestPackedIds(TestCase):
+    def setUp(self):
+        self.ids = [double_sha(i.to_bytes(4, 'big')) for i in range(100)]
+
+    def test_sequence(self):
+        packed_ids = PackedIds(self.ids)
+
+        self.assertEqual(len(packed_ids), 100)
+        self.assertEqual(list(packed_ids), self.ids)
+        self.assertEqual(packed_ids[3], self.ids[3])
+        self.assertEqual(packed_ids[-1], self.ids[-1])
+        self.assertEqual(packed_ids[10:20], self.ids[10:20])
+        self.assertEqual(packed_ids[::-1], self.ids[::-1])
+        with self.assertRaises(IndexError):
+            packed_ids[100]
+
+        self.assertEqual(packed_ids, tuple(self.ids))
+        self.assertEqual(tuple(self.ids), packed_ids)
+        self.assertNotEqual(packed_ids, tuple(self.ids[:-1]))
+        self.assertNotEqual(packed_ids, 'something else')
+        self.assertEqual(PackedIds(), ())
+
+        self.assertEqual(PackedIds(self.ids[:50]) + PackedIds(self.ids[50:]), packed_ids)
+        self.assertEqual(PackedIds(self.ids[:50]) + self.ids[50:], packed_ids)
+        self.assertEqual(hash(PackedIds(self.ids)), hash(packed_ids))
+        self.assertEqual(hash(packed_ids), hash(tuple(self.ids)))
+        self.assertIn(tuple(self.ids), {packed_ids})
+        self.assertIn(packed_ids, {tuple(self.ids): None})
+
+    def test_raw(self):
+        packed_ids = PackedIds(self.ids)
+        raw = b''.join(self.ids)
+
+        self.assertEqual(packed_ids.raw(), raw)
+        self.assertIs(PackedIds.from_raw(raw).raw(), raw)
+        self.assertEqual(PackedIds.from_raw(memoryview(raw)), packed_ids)
+
+        with self.assertRaisesRegex(ValueError, "not a multiple of 32"):
+            PackedIds.from_raw(raw[:-1])
+        with self.assertRaisesRegex(ValueError, "32-byte"):
+            PackedIds([b'short'])
+
+    def test_membership(self):
+        for size in (0, 1, 8, 100):
+            packed_ids = PackedIds(self.ids[:size])
+            for position, obj_id in enumerate(self.ids[:size]):
+                self.assertIn(obj_id, packed_ids)
+                self.assertEqual(packed_ids.index(obj_id), position)
+            for obj_id in self.ids[size:]:
+                self.assertNotIn(obj_id, packed_ids)
+            with self.assertRaises(ValueError):
+                packed_ids.index(self.ids[-1] if size < 100 else bytes(32))
+
+        self.assertNotIn(self.ids[0][:16], PackedIds(self.ids))
+        self.assertNotIn(None, PackedIds(self.ids))
+
+    def test_unaligned(self):
+        # an id found across the boundary of two ids isn't a member
+        packed_ids = PackedIds([bytes(16) + bytes([1]) * 16, bytes([1]) * 16 + bytes(16)])
+        self.assertNotIn(bytes([1]) * 32, packed_ids)
+        self.assertIn(bytes([1]) * 16 + bytes(16), packed_ids)
+
+    def test_duplicates(self):
+        packed_ids = PackedIds(self.ids + self.ids[:10])
+        self.assertEqual(len(packed_ids), 110)
+        self.assertEqual(packed_ids.index(self.ids[5]), 5)
@@ -0,0 +1,112 @@
+import os
+import pstats
+import sys
+from unittest import TestCase
+from pmpi.mempool import Mempool
+from pmpi.core import initialise_database, close_database, get_blockchain
+from pmpi.profiler import Profiler, MemoryTracer, deep_sizeof, structure_sizes, format_size
+
+
+def busy_function():
+    return sum(i * i for i in range(10000))
+
+
+class Slotted:
+    __slots__ = ('__private', 'public')
+
+    def __init__(self, private, public):
+        self.__private = private
+        self.public = public
+
+
+class TestProfiler(TestCase):
+    def setUp(self):
+        self.profiler = Profiler()
+
+    def test_profile(self):
+        self.assertFalse(self.profiler.is_running())
+        self.profiler.start()
+        self.assertTrue(self.profiler.is_running())
+        busy_function()
+        report = self.profiler.stop('tottime', 10, 'test_profile_stats')
+
+        self.assertFalse(self.profiler.is_running())
+        self.assertIn('busy_function', report)
+        self.assertGreater(pstats.Stats('test_profile_stats').total_calls, 0)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(Profiler.ProfilerError, "not running"):
+            self.profiler.stop()
+
+        self.profiler.start()
+        with self.assertRaisesRegex(Profiler.ProfilerError, "already running"):
+            self.profiler.start()
+        with self.assertRaisesRegex(Profiler.ProfilerError, "unknown sort key"):
+            self.profiler.stop('name')
+        self.profiler.stop()
+
+    def tearDown(self):
+        if self.profiler.is_running():
+            self.profiler.stop()
+        if os.path.exists('test_profile_stats'):
+            os.remove('test_profile_stats')
+
+
+class TestMemoryTracer(TestCase):
+    def setUp(self):
+        self.tracer = MemoryTracer()
+
+    def test_snapshots(self):
+        with self.assertRaisesRegex(MemoryTracer.TracerError, "not running"):
+            self.tracer.snapshot()
+
+        self.tracer.start()
+        with self.assertRaisesRegex(MemoryTracer.TracerError, "already running"):
+            self.tracer.start()
+        with self.assertRaisesRegex(MemoryTracer.TracerError, "take a snapshot first"):
+            self.tracer.diff()
+
+        self.assertTrue(self.tracer.snapshot().startswith("Traced memory:"))
+        allocated = [bytes(1000) for _ in range(1000)]
+        report = self.tracer.diff()
+        self.assertTrue(report.startswith("Change of traced memory: +"))
+        self.assertIn('test_profiler.py', report)
+        del allocated
+
+        self.tracer.stop()
+        self.assertFalse(self.tracer.is_running())
+
+    def tearDown(self):
+        if self.tracer.is_running():
+            self.tracer.stop()
+
+
+class TestSizes(TestCase):
+    def test_deep_sizeof(self):
+        data = bytes(1000)
+        self.assertEqual(deep_sizeof(data), sys.getsizeof(data))
+        self.assertGreater(deep_sizeof([data]), sys.getsizeof(data))
+        self.assertEqual(deep_sizeof([data, data]), sys.getsizeof([data, data]) + sys.getsizeof(data))
+        self.assertGreater(deep_sizeof({b'key': data}), sys.getsizeof(data))
+        self.assertGreater(deep_sizeof(Slotted(data, None)), sys.getsizeof(data))
+        self.assertGreater(deep_sizeof(Slotted(None, data)), sys.getsizeof(data))
+
+    def test_structure_sizes(self):
+        sizes = structure_sizes({'small': [], 'large': [bytes(1000)], 'object': Slotted(bytes(100), None)})
+        self.assertEqual([(name, length) for name, length, _ in sizes], [('large', 1), ('object', None), ('small', 0)])
+
+    def test_structures(self):
+        initialise_database('test_database_file')
+        try:
+            names = [name for name, _, _ in structure_sizes(get_blockchain().structures())]
+            self.assertEqual(set(names), {'blockchain map', 'main chain', 'state tree'})
+        finally:
+            close_database()
+            os.remove('test_database_file')
+
+        self.assertEqual(len(Mempool().structures()), 3)
+
+    def test_format_size(self):
+        self.assertEqual(format_size(10), '10 B')
+        self.assertEqual(format_size(1536), '1.5 KiB')
+        self.assertEqual(format_size(3 * 1024 ** 3), '3.0 GiB')
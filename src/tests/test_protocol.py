@@ -0,0 +1,78 @@
+from unittest import TestCase
+from ecdsa.keys import SigningKey
+from pmpi.operation import Operation, OperationRev
+from pmpi.protocol import FrameDecoder, decode_frames, encode_frame, encode_frames, message_object_id, OPERATION, \
+    BLOCK, COMPACT_BLOCK, HELLO, HEADER_SIZE
+from pmpi.public_key import PublicKey
+from pmpi.utils import double_sha, sign_object
+
+
+class TestFrames(TestCase):
+    def setUp(self):
+        private_key = SigningKey.generate()
+        public_key = PublicKey.from_signing_key(private_key)
+
+        self.operations = [Operation(OperationRev(), 'http://example{}.com/'.format(i), [public_key])
+                           for i in range(3)]
+        for op in self.operations:
+            sign_object(public_key, private_key, op)
+
+        self.messages = [(HELLO, public_key.der)] + [(OPERATION, op.raw()) for op in self.operations]
+
+    def test_encode(self):
+        frame = encode_frame(BLOCK, b'payload')
+
+        self.assertEqual(frame, b'\x01' + BLOCK + (7).to_bytes(4, 'big') + b'payload')
+        self.assertEqual(len(frame), HEADER_SIZE + 7)
+
+        with self.assertRaisesRegex(FrameDecoder.FrameError, "unknown message type"):
+            encode_frame(b'XX', b'payload')
+
+    def test_batch(self):
+        messages = decode_frames(encode_frames(self.messages))
+
+        self.assertEqual(messages, self.messages)
+        self.assertEqual([Operation.from_raw(payload).id for _, payload in messages[1:]],
+                         [op.id for op in self.operations])
+
+        with self.assertRaisesRegex(FrameDecoder.FrameError, "incomplete frame at the end of the batch"):
+            decode_frames(encode_frames(self.messages)[:-1])
+
+    def test_fragmented(self):
+        data = encode_frames(self.messages)
+        decoder = FrameDecoder()
+
+        messages = []
+        for i in range(len(data)):
+            messages.extend(decoder.feed(data[i:i + 1]))
+
+        self.assertEqual(messages, self.messages)
+        self.assertEqual(decoder.buffered_size, 0)
+
+    def test_coalesced(self):
+        data = encode_frames(self.messages)
+        split = len(encode_frame(*self.messages[0])) + HEADER_SIZE + 3
+        decoder = FrameDecoder()
+
+        self.assertEqual(decoder.feed(data[:split]), self.messages[:1])
+        self.assertEqual(decoder.feed(data[split:]), self.messages[1:])
+
+    def test_malformed(self):
+        with self.assertRaisesRegex(FrameDecoder.FrameError, "protocol version mismatch"):
+            FrameDecoder().feed(b'\x02' + encode_frame(OPERATION, b'payload')[1:])
+
+        with self.assertRaisesRegex(FrameDecoder.FrameError, "unknown message type"):
+            FrameDecoder().feed(b'\x01XX' + (1).to_bytes(4, 'big') + b'x')
+
+        with self.assertRaisesRegex(FrameDecoder.FrameError, "payload too long"):
+            FrameDecoder(max_payload_size=4).feed(encode_frame(OPERATION, b'payload'))
+
+    def test_object_id(self):
+        op = self.operations[0]
+        raw_block = b'block'
+        operations_raw = (1).to_bytes(4, 'big') + len(op.raw()).to_bytes(4, 'big') + op.raw()
+
+        self.assertEqual(message_object_id(OPERATION, op.raw()), op.id)
+        self.assertEqual(message_object_id(COMPACT_BLOCK, raw_block), double_sha(raw_block))
+        self.assertEqual(message_object_id(BLOCK, operations_raw + raw_block), double_sha(raw_block))
+        self.assertEqual(message_object_id(BLOCK, b'malformed'), double_sha(b'malformed'))
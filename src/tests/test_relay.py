@@ -0,0 +1,150 @@
+from unittest import TestCase
+from pmpi.protocol import decode_frames, encode_frame, encode_frames, encode_ids, OPERATION, BLOCK, COMPACT_BLOCK, \
+    HELLO, GET_OPERATIONS
+from pmpi.relay import RelayHub, RelayProtocol
+from pmpi.utils import double_sha
+
+
+class FakeTransport:
+    def __init__(self):
+        self.written = b''
+        self.closed = False
+
+    def write(self, data):
+        self.written += data
+
+    def close(self):
+        self.closed = True
+
+    def received(self):
+        return decode_frames(self.written)
+
+
+class TestRelayHub(TestCase):
+    def setUp(self):
+        self.hub = RelayHub(max_queue_size=100)
+        self.protocols = []
+        for i in range(3):
+            protocol = RelayProtocol(self.hub)
+            protocol.connection_made(FakeTransport())
+            protocol.data_received(encode_frame(HELLO, 'key{}'.format(i).encode()))
+            self.protocols.append(protocol)
+
+    def transport(self, i):
+        return self.protocols[i].peer.transport
+
+    def test_hello(self):
+        self.assertEqual(set(self.hub.peers), {b'key0', b'key1', b'key2'})
+
+        protocol = RelayProtocol(self.hub)
+        protocol.connection_made(FakeTransport())
+        protocol.data_received(encode_frame(OPERATION, b'op'))
+
+        self.assertEqual(len(self.hub.peers), 3)
+        self.assertEqual(self.transport(1).received(), [])
+
+    def test_relay(self):
+        self.protocols[0].data_received(encode_frames([(OPERATION, b'op'), (BLOCK, b'block')]))
+
+        self.assertEqual(self.transport(0).received(), [])
+        for i in (1, 2):
+            self.assertEqual(self.transport(i).received(), [(OPERATION, b'op'), (BLOCK, b'block')])
+
+    def test_deduplication(self):
+        self.protocols[0].data_received(encode_frame(OPERATION, b'op'))
+        self.protocols[1].data_received(encode_frame(OPERATION, b'op'))
+        self.protocols[2].data_received(encode_frame(OPERATION, b'op'))
+
+        self.assertEqual(self.transport(0).received(), [])
+        self.assertEqual(self.transport(1).received(), [(OPERATION, b'op')])
+
+        # requests are not objects -- every one of them is relayed
+        self.protocols[0].data_received(encode_frame(GET_OPERATIONS, b'request'))
+        self.protocols[1].data_received(encode_frame(GET_OPERATIONS, b'request'))
+
+        self.assertEqual(self.transport(2).received(), [(OPERATION, b'op')] + [(GET_OPERATIONS, b'request')] * 2)
+
+    def test_block_deduplication(self):
+        raw_block = b'block'
+        block = (1).to_bytes(4, 'big') + (2).to_bytes(4, 'big') + b'op' + raw_block
+
+        self.protocols[0].data_received(encode_frame(BLOCK, block))
+        self.protocols[1].data_received(encode_frame(COMPACT_BLOCK, raw_block))  # the same block
+
+        self.assertEqual(self.transport(0).received(), [])
+        self.assertEqual(self.transport(2).received(), [(BLOCK, block)])
+
+    def test_requested_operations(self):
+        self.protocols[0].data_received(encode_frame(OPERATION, b'op'))
+
+        request = encode_ids([double_sha(b'op')])
+        self.protocols[1].data_received(encode_frame(GET_OPERATIONS, request))
+        self.protocols[2].data_received(encode_frame(OPERATION, b'op'))  # reply to the request
+        self.protocols[2].data_received(encode_frame(OPERATION, b'op'))
+
+        self.assertEqual(self.transport(0).received(), [(GET_OPERATIONS, request)])
+        self.assertEqual(self.transport(1).received(), [(OPERATION, b'op')] * 2)
+        self.assertEqual(self.transport(2).received(), [(OPERATION, b'op'), (GET_OPERATIONS, request)])
+
+    def test_seen_limit(self):
+        hub = RelayHub(max_seen=2)
+        origin = hub.create_peer(FakeTransport())
+        for payload in (b'a', b'b', b'c'):
+            self.assertEqual(hub.relay(origin, OPERATION, payload), 0)
+
+        self.assertEqual(hub.relay(origin, OPERATION, b'c'), 0)
+        self.assertEqual(hub.relay(origin, OPERATION, b'a'), 0)
+
+        receiver = hub.create_peer(FakeTransport())
+        receiver.key = b'receiver'
+        hub.add_peer(receiver)
+
+        self.assertEqual(hub.relay(origin, OPERATION, b'c'), 0)
+        self.assertEqual(hub.relay(origin, OPERATION, b'b'), 1)
+
+    def test_backpressure(self):
+        self.protocols[1].pause_writing()
+        self.protocols[0].data_received(encode_frame(OPERATION, b'op1'))
+        self.protocols[0].data_received(encode_frame(OPERATION, b'op2'))
+
+        self.assertEqual(self.transport(1).received(), [])
+        self.assertEqual(self.transport(2).received(), [(OPERATION, b'op1'), (OPERATION, b'op2')])
+        self.assertEqual(self.protocols[1].peer.queue_size, 2 * len(encode_frame(OPERATION, b'op1')))
+
+        self.protocols[1].resume_writing()
+
+        self.assertEqual(self.transport(1).received(), [(OPERATION, b'op1'), (OPERATION, b'op2')])
+        self.assertEqual(self.protocols[1].peer.queue_size, 0)
+
+    def test_slow_peer(self):
+        self.protocols[1].pause_writing()
+        self.protocols[0].data_received(encode_frame(BLOCK, b'x' * 90))
+        self.assertFalse(self.transport(1).closed)
+
+        self.protocols[0].data_received(encode_frame(BLOCK, b'y' * 90))
+
+        self.assertTrue(self.transport(1).closed)
+        self.assertEqual(set(self.hub.peers), {b'key0', b'key2'})
+        self.assertEqual(self.protocols[1].peer.messages_dropped, 1)
+        self.assertEqual(len(self.transport(2).received()), 2)
+
+    def test_malformed_frame(self):
+        self.protocols[0].data_received(b'\x02XX\x00\x00\x00\x00')
+
+        self.assertTrue(self.transport(0).closed)
+        self.assertNotIn(b'key0', self.hub.peers)
+
+    def test_stats(self):
+        self.protocols[0].data_received(encode_frame(OPERATION, b'op'))
+        self.protocols[2].connection_lost(None)
+
+        stats = self.hub.stats()
+
+        self.assertEqual(len(stats), 2)
+        sender = self.protocols[0].peer.stats()
+        self.assertEqual(sender['messages_in'], 2)
+        self.assertEqual(sender['messages_out'], 0)
+        receiver = self.protocols[1].peer.stats()
+        self.assertEqual(receiver['messages_out'], 1)
+        self.assertEqual(receiver['bytes_out'], len(encode_frame(OPERATION, b'op')))
+        self.assertGreater(receiver['bytes_out_per_second'], 0)
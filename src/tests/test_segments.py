@@ -0,0 +1,126 @@
+import os
+import shutil
+from unittest import TestCase
+from ecdsa.keys import SigningKey
+from pmpi.block import Block, BlockRev
+from pmpi.core import initialise_database, close_database, get_blockchain
+from pmpi.operation import Operation, OperationRev
+from pmpi.public_key import PublicKey
+from pmpi.segments import SegmentStore
+from pmpi.sync import SyncEngine
+from pmpi.utils import sign_object
+
+
+class TestSegmentStore(TestCase):
+    def setUp(self):
+        self.store = SegmentStore('test_segments', segment_size=100, flush_size=50)
+
+    def reopen(self):
+        self.store.close()
+        self.store = SegmentStore('test_segments', segment_size=100, flush_size=50)
+
+    def test_put_and_get(self):
+        self.store[b'key1'] = b'value1'
+
+        self.assertIn(b'key1', self.store)
+        self.assertEqual(self.store[b'key1'], b'value1')
+        self.assertIsNone(self.store.get(b'key2'))
+
+        self.store.flush()
+
+        self.assertIsInstance(self.store[b'key1'], memoryview)
+        self.assertEqual(self.store[b'key1'], b'value1')
+
+        self.store[b'key2'] = b'x' * 40  # exceeds flush_size -- written at once
+        self.assertIsInstance(self.store[b'key2'], memoryview)
+        self.assertEqual(set(self.store.keys()), {b'key1', b'key2'})
+
+    def test_reopen(self):
+        values = {'key{}'.format(i).encode(): b'v' * i for i in range(20)}
+        for key, value in values.items():
+            self.store[key] = value
+
+        self.reopen()
+
+        self.assertEqual(len(self.store), 20)
+        for key, value in values.items():
+            self.assertEqual(self.store[key], value)
+        self.assertGreater(len(os.listdir('test_segments')), 1)
+        for name in os.listdir('test_segments'):
+            self.assertLessEqual(os.path.getsize(os.path.join('test_segments', name)), 100)
+
+    def test_delete(self):
+        self.store[b'key1'] = b'value1'
+        self.store[b'key2'] = b'value2'
+        self.store.delete(b'key1')
+
+        with self.assertRaises(KeyError):
+            self.store.delete(b'key1')
+
+        self.reopen()
+
+        self.assertNotIn(b'key1', self.store)
+        self.assertEqual(self.store[b'key2'], b'value2')
+
+        self.store[b'key1'] = b'new value'
+        self.reopen()
+        self.assertEqual(self.store[b'key1'], b'new value')
+
+    def test_broken_record(self):
+        self.store[b'key1'] = b'value1'
+        self.reopen()
+
+        with open(os.path.join('test_segments', '00000000.seg'), 'ab') as f:
+            f.write(b'\x00\x04\x00\x00\x00\x10key2val')
+
+        self.reopen()
+
+        self.assertEqual(self.store.keys(), [b'key1'])
+        self.store[b'key2'] = b'value2'
+        self.reopen()
+        self.assertEqual(self.store[b'key2'], b'value2')
+
+    def tearDown(self):
+        self.store.close()
+        shutil.rmtree('test_segments')
+
+
+class TestSegmentedDatabase(TestCase):
+    def setUp(self):
+        initialise_database('test_database_file', 'test_segments')
+
+        private_key = SigningKey.generate()
+        public_key = PublicKey.from_signing_key(private_key)
+
+        self.blocks = []
+        previous_block_rev = BlockRev()
+        for i in range(3):
+            operations = [Operation(OperationRev(), 'http://example{}.com/{}'.format(j, i), [public_key])
+                          for j in range(2)]
+            for op in operations:
+                sign_object(public_key, private_key, op)
+
+            block = Block.from_operations_list(previous_block_rev, 42 + i, operations)
+            block.mine()
+            sign_object(public_key, private_key, block)
+            self.blocks.append(block)
+            previous_block_rev = block.get_rev()
+
+    def test_blocks_in_segments(self):
+        SyncEngine().apply_blocks(self.blocks)
+
+        close_database()
+        initialise_database('test_database_file', 'test_segments')
+
+        self.assertEqual(get_blockchain().head, self.blocks[-1].id)
+        for block in self.blocks:
+            self.assertEqual(Block.get(block.id).raw(), block.raw())
+            for op in block.operations:
+                self.assertEqual(Operation.get(op.id).raw(), op.raw())
+
+        self.assertEqual(set(os.listdir('test_segments')), {'blocks', 'operations'})
+
+    def tearDown(self):
+        close_database()
+        os.remove('test_database_file')
+        shutil.rmtree('test_segments')
@@ -0,0 +1,99 @@
+import random
+from unittest import TestCase
+from uuid import UUID
+from pmpi.exceptions import RawFormatError
+from pmpi.state_tree import StateTree, StateProof, EMPTY_HASH
+from pmpi.utils import double_sha
+
+
+class TestStateTree(TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+        self.items = [(UUID(int=self.random.getrandbits(128)), double_sha(i.to_bytes(4, 'big'))) for i in range(100)]
+        self.tree = StateTree(self.items)
+
+    def test_get_and_set(self):
+        self.assertEqual(len(self.tree), 100)
+        for uuid, operation_id in self.items:
+            self.assertEqual(self.tree.get(uuid), operation_id)
+        self.assertIsNone(self.tree.get(UUID(int=0)))
+
+        root = self.tree.root
+        uuid = self.items[0][0]
+        self.tree.set(uuid, double_sha(b'new version'))
+        self.assertEqual(len(self.tree), 100)
+        self.assertEqual(self.tree.get(uuid), double_sha(b'new version'))
+        self.assertNotEqual(self.tree.root, root)
+
+        self.tree.set(uuid, self.items[0][1])
+        self.assertEqual(self.tree.root, root)
+
+    def test_canonical_root(self):
+        items = list(self.items)
+        self.random.shuffle(items)
+        self.assertEqual(StateTree(items).root, self.tree.root)
+
+        for uuid, _ in self.items[50:]:
+            self.tree.remove(uuid)
+        self.assertEqual(len(self.tree), 50)
+        self.assertEqual(self.tree.root, StateTree(self.items[:50]).root)
+
+        for uuid, _ in self.items[:50]:
+            self.tree.remove(uuid)
+        self.assertEqual(self.tree.root, EMPTY_HASH)
+
+        with self.assertRaises(KeyError):
+            self.tree.remove(self.items[0][0])
+
+    def test_shared_prefixes(self):
+        items = [(UUID(int=i), double_sha(i.to_bytes(16, 'big'))) for i in (0, 1, 2, 1 << 127)]
+        tree = StateTree(items)
+
+        for uuid, operation_id in items:
+            self.assertTrue(tree.proof(uuid).verify(tree.root, operation_id))
+        self.assertTrue(tree.proof(UUID(int=3)).verify(tree.root, None))
+
+        tree.remove(UUID(int=1))
+        self.assertEqual(tree.root, StateTree(items[:1] + items[2:]).root)
+
+    def test_proofs(self):
+        root = self.tree.root
+
+        for uuid, operation_id in self.items:
+            proof = self.tree.proof(uuid)
+            self.assertEqual(proof.operation_id, operation_id)
+            self.assertTrue(proof.verify(root, operation_id))
+            self.assertFalse(proof.verify(root, double_sha(operation_id)))
+            self.assertFalse(proof.verify(root, None))
+            self.assertFalse(proof.verify(double_sha(root), operation_id))
+            self.assertLess(len(proof.siblings), 32)
+
+        missing = UUID(int=self.random.getrandbits(128))
+        proof = self.tree.proof(missing)
+        self.assertIsNone(proof.operation_id)
+        self.assertTrue(proof.verify(root, None))
+        self.assertFalse(proof.verify(root, self.items[0][1]))
+
+        self.assertTrue(StateTree().proof(missing).verify(EMPTY_HASH, None))
+
+    def test_wrong_proofs(self):
+        uuid, operation_id = self.items[0]
+        proof = self.tree.proof(uuid)
+        other = self.tree.proof(self.items[1][0])
+
+        for wrong_proof in (StateProof(uuid, proof.leaf, proof.siblings[:-1]),
+                            StateProof(uuid, proof.leaf, proof.siblings + (EMPTY_HASH,)),
+                            StateProof(uuid, other.leaf, other.siblings),
+                            StateProof(uuid, None, proof.siblings)):
+            self.assertFalse(wrong_proof.verify(self.tree.root, wrong_proof.operation_id))
+
+    def test_raw(self):
+        for uuid in (self.items[0][0], UUID(int=self.random.getrandbits(128))):
+            proof = self.tree.proof(uuid)
+            self.assertEqual(StateProof.from_raw(proof.raw()), proof)
+
+        raw = self.tree.proof(self.items[0][0]).raw()
+        with self.assertRaisesRegex(RawFormatError, "raw input too short"):
+            StateProof.from_raw(raw[:-1])
+        with self.assertRaisesRegex(RawFormatError, "raw input too long"):
+            StateProof.from_raw(raw + b'\x00')
@@ -0,0 +1,145 @@
+import os
+from unittest import TestCase
+from unittest.mock import patch
+from ecdsa.keys import SigningKey, VerifyingKey
+from pmpi.block import Block, BlockRev
+from pmpi.blockchain import BlockChain
+from pmpi.core import initialise_database, close_database, get_blockchain, get_database
+from pmpi.operation import Operation, OperationRev
+from pmpi.public_key import PublicKey
+from pmpi.sync import LocalPeer, SyncEngine
+from pmpi.utils import sign_object
+
+
+class FaultyPeer(LocalPeer):
+    def get_bodies(self, block_ids):
+        raise SyncEngine.PeerError("connection lost")
+
+
+class TestSyncEngine(TestCase):
+    def setUp(self):
+        initialise_database('test_database_file')
+
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+        self.blocks = self.build_chain(BlockRev(), 12)
+
+    def sign(self, obj):
+        sign_object(self.public_key, self.private_key, obj)
+        return obj
+
+    def build_chain(self, previous_block_rev, length, unmined_at=None, forged_at=None):
+        """
+        Chain of blocks, each of them minting two identifiers.
+        """
+        blocks = []
+        for i in range(length):
+            operations = [self.sign(Operation(OperationRev(), 'http://example{}.com/{}'.format(j, i),
+                                              [self.public_key])) for j in range(2)]
+            if i == forged_at:
+                operations[0].sign(self.public_key, bytes(48))
+                operations[0]._assume_signature_verified()
+            block = Block.from_operations_list(previous_block_rev, 42 + i, operations)
+            if i == unmined_at:
+                block.difficulty = 64
+                block.apply_padding(0)
+            else:
+                block.mine()
+            blocks.append(self.sign(block))
+            previous_block_rev = block.get_rev()
+        return blocks
+
+    def test_synchronise(self):
+        engine = SyncEngine([LocalPeer(self.blocks), LocalPeer(self.blocks)], headers_batch=5, bodies_batch=2,
+                            apply_batch=3)
+
+        self.assertEqual(engine.synchronise(), 12)
+
+        blockchain = get_blockchain()
+        self.assertEqual(blockchain.head, self.blocks[-1].id)
+        self.assertEqual(blockchain.max_depth, 12)
+        for block in self.blocks:
+            self.assertTrue(Block.exist(block.id))
+
+        self.assertEqual(engine.synchronise(), 0)
+
+    def test_synchronise_incrementally(self):
+        engine = SyncEngine([LocalPeer(self.blocks)], headers_batch=4)
+        engine.apply_blocks(self.blocks[:5])
+
+        self.assertEqual(get_blockchain().head, self.blocks[4].id)
+        self.assertEqual([header.id for header in engine.best_headers()], [block.id for block in self.blocks[5:]])
+
+        self.assertEqual(engine.synchronise(), 7)
+        self.assertEqual(get_blockchain().head, self.blocks[-1].id)
+
+    def test_signatures_verified_once(self):
+        with patch.object(VerifyingKey, 'verify', autospec=True, side_effect=VerifyingKey.verify) as verify:
+            SyncEngine([LocalPeer(self.blocks)], bodies_batch=5).synchronise()
+
+        self.assertEqual(verify.call_count, 3 * len(self.blocks))  # every block and its two operations
+
+    def test_locator(self):
+        self.assertEqual(SyncEngine.get_locator(), [BlockChain.ROOT])
+
+        SyncEngine().apply_blocks(self.blocks)
+
+        self.assertEqual(SyncEngine.get_locator(),
+                         [block.id for block in reversed(self.blocks[2:])] + [self.blocks[0].id, BlockChain.ROOT])
+
+    def test_invalid_headers(self):
+        invalid_blocks = self.blocks[:3] + self.build_chain(self.blocks[2].get_rev(), 12, unmined_at=2)
+
+        engine = SyncEngine([LocalPeer(invalid_blocks)])
+        self.assertEqual([header.id for header in engine.best_headers()], [block.id for block in invalid_blocks[:5]])
+
+        engine.peers.append(LocalPeer(self.blocks))
+        self.assertEqual(engine.synchronise(), 12)
+        self.assertEqual(get_blockchain().head, self.blocks[-1].id)
+
+        with self.assertRaisesRegex(SyncEngine.HeaderError, "header is not linked to the previous one"):
+            SyncEngine.validate_header(self.blocks[3], self.blocks[1].id)
+
+        with self.assertRaisesRegex(SyncEngine.HeaderError, "checksum doesn't satisfy the difficulty"):
+            SyncEngine.validate_header(invalid_blocks[5], invalid_blocks[4].id)
+
+    def test_bodies_from_other_peer(self):
+        engine = SyncEngine([FaultyPeer(self.blocks)], bodies_batch=3)
+
+        with self.assertRaisesRegex(SyncEngine.SyncError, "none of the peers served correct bodies"):
+            engine.synchronise()
+        self.assertEqual(get_blockchain().max_depth, 0)
+
+        engine.peers.append(LocalPeer(self.blocks))
+        self.assertEqual(engine.synchronise(), 12)
+        self.assertEqual(get_blockchain().head, self.blocks[-1].id)
+
+    def test_assume_valid(self):
+        blocks = self.build_chain(BlockRev(), 4, forged_at=1)
+
+        with self.assertRaisesRegex(SyncEngine.SyncError, "none of the peers served correct bodies"):
+            SyncEngine([LocalPeer(blocks)], assume_valid=blocks[0].id).synchronise()
+
+        engine = SyncEngine([LocalPeer(blocks)], assume_valid=blocks[2].id)
+        self.assertEqual(engine.synchronise(), 4)
+        self.assertEqual(get_blockchain().head, blocks[-1].id)
+        self.assertTrue(engine.is_assumed_valid(blocks[1].id))
+        self.assertFalse(engine.is_assumed_valid(blocks[3].id))
+
+    def test_checkpoint(self):
+        blocks = self.build_chain(BlockRev(), 3, forged_at=1)
+        get_database().set_checkpoint(blocks[1].id)
+
+        self.assertEqual(get_database().get_checkpoint(), blocks[1].id)
+        self.assertEqual(SyncEngine([LocalPeer(blocks)]).synchronise(), 3)
+
+        get_database().set_checkpoint(None)
+        self.assertIsNone(get_database().get_checkpoint())
+
+    def test_no_sync_engine(self):
+        with self.assertRaises(NotImplementedError):
+            BlockChain().update_blocks()
+
+    def tearDown(self):
+        close_database()
+        os.remove('test_database_file')
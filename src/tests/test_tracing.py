@@ -0,0 +1,171 @@
+from io import StringIO
+import json
+import os
+from unittest import TestCase
+from ecdsa.keys import SigningKey
+from pmpi.block import Block, BlockRev
+from pmpi.core import initialise_database, close_database
+from pmpi.operation import Operation, OperationRev
+from pmpi.public_key import PublicKey
+from pmpi.sync import SyncEngine
+from pmpi.utils import sign_object
+import pmpi.tracing
+from pmpi.tracing import RingBufferSink, JsonLinesSink, ChromeTraceSink
+
+
+class TestSpans(TestCase):
+    def setUp(self):
+        self.sink = RingBufferSink(capacity=3)
+
+    def test_disabled(self):
+        self.assertFalse(pmpi.tracing.enabled)
+        with pmpi.tracing.span('outer') as s:
+            s.set(x=1)
+            pmpi.tracing.current_span().set(y=2)
+
+        pmpi.tracing.add_sink(self.sink)
+        pmpi.tracing.remove_sink(self.sink)
+        self.assertFalse(pmpi.tracing.enabled)
+        self.assertEqual(self.sink.spans(), [])
+
+    def test_nesting(self):
+        pmpi.tracing.add_sink(self.sink)
+
+        with pmpi.tracing.span('outer', x=1) as outer:
+            with pmpi.tracing.span('inner'):
+                pmpi.tracing.current_span().set(y=2)
+                pmpi.tracing.count_read()
+                pmpi.tracing.count_read()
+            pmpi.tracing.count_write()
+
+        inner, outer = self.sink.spans()
+        self.assertEqual(inner.name, 'inner')
+        self.assertEqual(inner.parent_id, outer.span_id)
+        self.assertIsNone(outer.parent_id)
+        self.assertEqual(inner.attributes, {'y': 2, 'db_reads': 2, 'db_writes': 0})
+        self.assertEqual(outer.attributes, {'x': 1, 'db_reads': 2, 'db_writes': 1})
+        self.assertLessEqual(inner.duration, outer.duration)
+
+    def test_traced(self):
+        pmpi.tracing.add_sink(self.sink)
+
+        @pmpi.tracing.traced('function', lambda x: {'x': x, 'inverse': 1 / x})
+        def function(x):
+            if x == 0:
+                raise ValueError
+            return 2 * x
+
+        self.assertEqual(function(21), 42)
+        with self.assertRaises(ValueError):
+            function(0)
+
+        spans = self.sink.spans()
+        self.assertEqual(spans[0].attributes['x'], 21)
+        self.assertIsNone(spans[0].error)
+        self.assertEqual(spans[1].error, 'ValueError')
+        self.assertNotIn('inverse', spans[1].attributes)
+
+    def test_ring_buffer(self):
+        pmpi.tracing.add_sink(self.sink)
+        for i in range(5):
+            with pmpi.tracing.span('span', i=i):
+                pass
+
+        self.assertEqual([s.attributes['i'] for s in self.sink.spans()], [2, 3, 4])
+        self.sink.clear()
+        self.assertEqual(self.sink.spans(), [])
+
+    def test_file_sinks(self):
+        json_lines = StringIO()
+        chrome_trace = StringIO()
+        sinks = [JsonLinesSink(json_lines), ChromeTraceSink(chrome_trace)]
+        for sink in sinks:
+            pmpi.tracing.add_sink(sink)
+
+        with pmpi.tracing.span('outer'):
+            with pmpi.tracing.span('inner', block_id='00ff'):
+                pass
+
+        for sink in sinks:
+            pmpi.tracing.remove_sink(sink)
+            sink.close()
+
+        records = [json.loads(line) for line in json_lines.getvalue().splitlines()]
+        self.assertEqual([record['name'] for record in records], ['inner', 'outer'])
+        self.assertEqual(records[0]['parent_id'], records[1]['span_id'])
+        self.assertEqual(records[0]['attributes']['block_id'], '00ff')
+
+        events = json.loads(chrome_trace.getvalue())
+        self.assertEqual([event['name'] for event in events], ['inner', 'outer'])
+        self.assertEqual({event['ph'] for event in events}, {'X'})
+        self.assertLessEqual(events[1]['ts'], events[0]['ts'])
+        self.assertGreaterEqual(events[1]['ts'] + events[1]['dur'], events[0]['ts'] + events[0]['dur'])
+
+    def tearDown(self):
+        if self.sink in pmpi.tracing._sinks:
+            pmpi.tracing.remove_sink(self.sink)
+
+
+class TestInstrumentation(TestCase):
+    def setUp(self):
+        initialise_database('test_database_file')
+
+        self.private_key = SigningKey.generate()
+        self.public_key = PublicKey.from_signing_key(self.private_key)
+        self.sink = RingBufferSink()
+
+    def sign(self, obj):
+        sign_object(self.public_key, self.private_key, obj)
+        return obj
+
+    def test_block_acceptance(self):
+        minting = [self.sign(Operation(OperationRev(), 'http://example{}.com/'.format(j), [self.public_key]))
+                   for j in range(2)]
+        block1 = Block.from_operations_list(BlockRev(), 42, minting)
+        block1.mine()
+        self.sign(block1)
+
+        updates = [self.sign(Operation(op.get_rev(), 'http://updated.com/', [self.public_key])) for op in minting]
+        block2 = Block.from_operations_list(block1.get_rev(), 43, updates)
+        block2.mine()
+        self.sign(block2)
+
+        SyncEngine().apply_blocks([block1])
+        pmpi.tracing.add_sink(self.sink)
+        SyncEngine().apply_blocks([block2])
+
+        spans = self.sink.spans()
+        by_name = {}
+        for s in spans:
+            by_name.setdefault(s.name, []).append(s)
+
+        update_blocks, = by_name['BlockChain.update_blocks']
+        block_put, = by_name['Block.put']
+        set_head, = by_name['BlockChain.set_head']
+        self.assertIsNone(update_blocks.parent_id)
+        self.assertEqual(block_put.parent_id, update_blocks.span_id)
+        self.assertEqual(set_head.parent_id, update_blocks.span_id)
+
+        self.assertEqual(block_put.attributes['block_id'], pmpi.tracing.hexlify(block2.id))
+        self.assertEqual(block_put.attributes['operations'], 2)
+        self.assertGreater(block_put.attributes['db_reads'], 0)
+        self.assertGreater(block_put.attributes['db_writes'], 0)
+        self.assertEqual(update_blocks.attributes['head_depth'], 2)
+
+        self.assertEqual(len(by_name['Operation.put']), 2)
+        for s in by_name['Operation.put']:
+            self.assertEqual(s.parent_id, block_put.span_id)
+        self.assertEqual({s.attributes['operation_id'] for s in by_name['Operation.put']},
+                         {pmpi.tracing.hexlify(op.id) for op in updates})
+
+        verify, = by_name['Block.verify']
+        resolve, = by_name['BlockChain.resolve_operation_ids']  # all the operations of the block at once
+        self.assertEqual(resolve.parent_id, verify.span_id)
+        self.assertEqual(resolve.attributes['identifiers'], 2)
+        self.assertTrue(resolve.attributes['head'])
+
+    def tearDown(self):
+        if self.sink in pmpi.tracing._sinks:
+            pmpi.tracing.remove_sink(self.sink)
+        close_database()
+        os.remove('test_database_file')